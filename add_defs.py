@@ -1,59 +1,308 @@
 import sqlite3
 import csv
+import hashlib
 import argparse
+import mmap
+import os
+import shutil
+import struct
+import sys
+import time
+from array import array
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+DIFF_FORMAT = ['#csd-diff', '1']
+DEFAULT_JOBS = 4
+# UPDATE ... FROM is only available from SQLite 3.33.0
+UPDATE_FROM_SUPPORTED = sqlite3.sqlite_version_info >= (3, 33, 0)
+# Must match the edition format in csd.py
+EDITION_MAGIC = b'CSDE'
+EDITION_VERSION = 1
+EDITION_HEADER = struct.Struct('<4sIIIIIII')
+# Must match the working store format in csd.py
+STORE_MAGIC = b'SQLite format 3\x00'
+STORE_VERSION = 1
+
+# Reads the words and definitions of an edition file written by csd.py --edition
+def read_edition_rows(edition_file):
+    with open(edition_file, 'rb') as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as edition:
+            magic, version, num_strings, _, num_words, num_entries, num_groups, num_group_members = EDITION_HEADER.unpack_from(edition, 0)
+            if magic != EDITION_MAGIC or version != EDITION_VERSION:
+                raise ValueError(f"{edition_file} is not a version {EDITION_VERSION} edition file")
+
+            def read_column(start, length):
+                values = array('I')
+                values.frombytes(edition[start:start + length * 4])
+                if sys.byteorder != 'little':
+                    values.byteswap()
+                return values
+
+            string_offsets = read_column(EDITION_HEADER.size, num_strings + 1)
+            word_column = read_column(EDITION_HEADER.size + (num_strings + 1) * 4, num_words)
+            definition_column = read_column(EDITION_HEADER.size + (num_strings + 1 + num_words) * 4, num_words)
+            string_data = EDITION_HEADER.size + (num_strings + 1 + 3 * num_words + 1 + 5 * num_entries + num_groups + 1 + num_group_members) * 4
+
+            def read_string(string_id):
+                return edition[string_data + string_offsets[string_id]:string_data + string_offsets[string_id + 1]].decode('utf-8')
+
+            return [(read_string(word_id), read_string(definition_id)) for word_id, definition_id in zip(word_column, definition_column)]
+
+# Reads the words and definitions of a working store written by csd.py --store.
+# The definition column holds the autosuggested definition, so the reviewed
+# definition of the input file is read from old_definition.
+def read_store_rows(store_file):
+    conn = sqlite3.connect(store_file)
+    try:
+        if conn.execute("PRAGMA user_version").fetchone()[0] != STORE_VERSION:
+            raise ValueError(f"{store_file} is not a version {STORE_VERSION} working store")
+        return conn.execute("SELECT word, old_definition FROM words ORDER BY position").fetchall()
+    finally:
+        conn.close()
+
+# Reads the words and definitions of a TSV, edition or working store file
+def read_definition_rows(tsv_file):
+    with open(tsv_file, 'rb') as file:
+        magic = file.read(len(STORE_MAGIC))
+    if magic.startswith(EDITION_MAGIC):
+        return read_edition_rows(tsv_file)
+    if magic == STORE_MAGIC:
+        return read_store_rows(tsv_file)
+    with open(tsv_file, 'r', encoding='utf-8') as file:
+        reader = csv.reader(file, delimiter='\t')
+        return [(row[0].upper(), row[1]) for row in reader]
+
+# Connects to the SQLite database and begins a transaction that is managed
+# explicitly
+def open_database(db_file):
+    conn = sqlite3.connect(db_file, isolation_level=None)
+    cursor = conn.cursor()
+    # The default rollback journal keeps the database intact if the update is
+    # killed part way, and turning it off was not measurably faster
+    cursor.execute("PRAGMA synchronous = NORMAL")
+    cursor.execute("PRAGMA temp_store = MEMORY")
+    cursor.execute("BEGIN")
+    return conn, cursor
+
+# Stages the definitions, keeping the last definition of each word
+def stage_definitions(cursor, rows):
+    cursor.execute("CREATE TEMP TABLE tsv_definitions (word TEXT PRIMARY KEY, definition TEXT)")
+    cursor.executemany("INSERT OR REPLACE INTO tsv_definitions (word, definition) VALUES (?, ?)", rows)
+
+def find_missing_words(cursor):
+    cursor.execute("SELECT word FROM tsv_definitions EXCEPT SELECT word FROM words")
+    return [row[0] for row in cursor.fetchall()]
+
+def find_not_updated_words(cursor):
+    cursor.execute("SELECT word FROM words EXCEPT SELECT word FROM tsv_definitions")
+    return [row[0] for row in cursor.fetchall()]
+
+def apply_staged_definitions(cursor):
+    if UPDATE_FROM_SUPPORTED:
+        cursor.execute("""
+            UPDATE words
+            SET definition = tsv_definitions.definition
+            FROM tsv_definitions
+            WHERE words.word = tsv_definitions.word
+            AND words.definition IS NOT tsv_definitions.definition
+        """)
+    else:
+        cursor.execute("""
+            UPDATE words
+            SET definition = (SELECT definition FROM tsv_definitions WHERE tsv_definitions.word = words.word)
+            WHERE definition IS NOT (SELECT definition FROM tsv_definitions WHERE tsv_definitions.word = words.word)
+        """)
+    return cursor.rowcount
+
+# Must match definitions_hash in csd.py
+def database_hash(cursor):
+    sha = hashlib.sha256()
+    cursor.execute("SELECT word, definition FROM words ORDER BY word")
+    for word, definition in cursor:
+        sha.update(f"{word}\t{definition if definition is not None else ''}\n".encode('utf-8'))
+    return sha.hexdigest()
+
+def print_words(message, words):
+    print(message)
+    for word in words:
+        print(f"{word}")
+
+# Stages the definitions, checks that they are for exactly the words of the
+# database and updates the definitions that changed. Returns an error message
+# with the words it is about, or None, and the number of updated definitions.
+def apply_definitions(cursor, rows):
+    stage_definitions(cursor, rows)
+
+    # Check if all TSV words exist in the SQLite 'words' table
+    missing_words = find_missing_words(cursor)
+    if missing_words:
+        return "Error: The following words in the TSV file are not in the SQLite 'words' table:", missing_words, 0
+
+    # Check if all words in the SQLite 'words' table have a TSV definition
+    not_updated_words = find_not_updated_words(cursor)
+    if not_updated_words:
+        return "Error: The following words were not updated with new definitions:", not_updated_words, 0
+
+    # Update the definitions that changed in the SQLite database
+    return None, [], apply_staged_definitions(cursor)
 
 def update_definitions(tsv_file, db_file):
     try:
-        # Read TSV file
-        with open(tsv_file, 'r', encoding='utf-8') as file:
+        # Read the TSV or edition file
+        tsv_rows = read_definition_rows(tsv_file)
+
+        conn, cursor = open_database(db_file)
+        error, words, _ = apply_definitions(cursor, tsv_rows)
+        if error:
+            print_words(error, words)
+            cursor.execute("ROLLBACK")
+            return
+
+        # Commit the changes
+        cursor.execute("COMMIT")
+        print("Update successful. All words were updated with new definitions.")
+
+    except sqlite3.Error as e:
+        print(f"SQLite error: {e}")
+    except FileNotFoundError:
+        print("Error: TSV file not found.")
+    except Exception as e:
+        print(f"Unexpected error: {e}")
+    finally:
+        if 'conn' in locals():
+            conn.close()
+
+DatabaseResult = namedtuple('DatabaseResult', ['db_file', 'error', 'words', 'updated', 'seconds'])
+
+# Applies the definitions to a copy of the database and renames the copy over
+# the database, so that readers never see a partially updated database. Runs
+# on a worker thread, so the result is returned instead of printed.
+def update_database_copy(rows, db_file):
+    start = time.perf_counter()
+    temp_file = db_file + '.tmp'
+    conn = None
+    try:
+        # Connecting would create a missing database
+        if not os.path.isfile(db_file):
+            return DatabaseResult(db_file, "Error: database file not found.", [], 0, time.perf_counter() - start)
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+        # The backup API copies a consistent snapshot even while the
+        # database is being read
+        source = sqlite3.connect(db_file)
+        try:
+            copy = sqlite3.connect(temp_file)
+            source.backup(copy)
+            copy.close()
+        finally:
+            source.close()
+        shutil.copymode(db_file, temp_file)
+
+        conn, cursor = open_database(temp_file)
+        error, words, updated = apply_definitions(cursor, rows)
+        if error:
+            cursor.execute("ROLLBACK")
+            return DatabaseResult(db_file, error, words, 0, time.perf_counter() - start)
+        cursor.execute("COMMIT")
+        conn.close()
+        conn = None
+
+        # Make sure the copy is on disk before it replaces the database
+        with open(temp_file, 'rb+') as file:
+            os.fsync(file.fileno())
+        os.replace(temp_file, db_file)
+        return DatabaseResult(db_file, None, [], updated, time.perf_counter() - start)
+    except (sqlite3.Error, OSError) as e:
+        return DatabaseResult(db_file, f"Error: {e}", [], 0, time.perf_counter() - start)
+    finally:
+        if conn is not None:
+            conn.close()
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+
+# Reads the definitions once and updates every database with up to jobs
+# databases at a time, printing the result of each as it finishes
+def update_databases(tsv_file, db_files, jobs):
+    try:
+        tsv_rows = read_definition_rows(tsv_file)
+    except FileNotFoundError:
+        print("Error: TSV file not found.")
+        exit(1)
+    except Exception as e:
+        print(f"Unexpected error: {e}")
+        exit(1)
+
+    start = time.perf_counter()
+    db_files = list(dict.fromkeys(db_files))
+    failed = 0
+    with ThreadPoolExecutor(max_workers=max(1, min(jobs, len(db_files)))) as executor:
+        futures = [executor.submit(update_database_copy, tsv_rows, db_file) for db_file in db_files]
+        for future in as_completed(futures):
+            result = future.result()
+            if result.error:
+                failed += 1
+                print_words(f"{result.db_file}: {result.error}", result.words)
+                print(f"{result.db_file}: not updated ({result.seconds:.2f}s)")
+            else:
+                print(f"{result.db_file}: {result.updated} definitions updated ({result.seconds:.2f}s)")
+    print(f"{len(db_files) - failed} of {len(db_files)} databases updated in {time.perf_counter() - start:.2f}s")
+    if failed:
+        exit(1)
+
+# Applies a diff file created by csd.py --diff to a database that holds the
+# base edition of the diff
+def apply_diff(diff_file, db_file):
+    try:
+        with open(diff_file, 'r', encoding='utf-8') as file:
             reader = csv.reader(file, delimiter='\t')
-            tsv_data = {row[0].upper(): row[1] for row in reader}
+            header = next(reader, [])
+            if header[:2] != DIFF_FORMAT or len(header) != 4:
+                print("Error: The diff file does not have a valid header.")
+                return
+            base_hash, new_hash = header[2:]
+            diff_rows = []
+            removed_words = []
+            for row in reader:
+                if row[0] == '-':
+                    removed_words.append(row[1])
+                else:
+                    diff_rows.append((row[1], row[2]))
 
-        # Connect to SQLite database
-        conn = sqlite3.connect(db_file)
-        cursor = conn.cursor()
+        conn, cursor = open_database(db_file)
 
-        # Retrieve all words from the 'words' table
-        cursor.execute("SELECT word, definition FROM words")
-        db_words = {row[0]: row[1] for row in cursor.fetchall()}
+        if database_hash(cursor) != base_hash:
+            print("Error: The database definitions do not match the base edition of the diff file.")
+            cursor.execute("ROLLBACK")
+            return
 
-        # Check if all TSV words exist in the SQLite 'words' table
-        tsv_words = set(tsv_data.keys())
-        db_word_keys = set(db_words.keys())
-        missing_words = tsv_words - db_word_keys
+        if removed_words:
+            print_words("Error: The following words were not updated with new definitions:", removed_words)
+            cursor.execute("ROLLBACK")
+            return
+
+        stage_definitions(cursor, diff_rows)
+
+        missing_words = find_missing_words(cursor)
         if missing_words:
-            print("Error: The following words in the TSV file are not in the SQLite 'words' table:")
-            for word in missing_words:
-                print(f"{word}")
+            print_words("Error: The following words in the diff file are not in the SQLite 'words' table:", missing_words)
+            cursor.execute("ROLLBACK")
             return
 
-        # Prepare to track updated words
-        updated_words = set()
-
-        # Update definitions in the SQLite database
-        for word, new_definition in tsv_data.items():
-            db_word_keys.remove(word)
-            cursor.execute("""
-                UPDATE words
-                SET definition = ?
-                WHERE word = ?
-            """, (new_definition, word))
-
-        if db_word_keys:
-            print("Error: The following words were not updated with new definitions:")
-            for word in db_word_keys:
-                print(f"{word}")
-            conn.rollback()
+        updated = apply_staged_definitions(cursor)
+
+        if database_hash(cursor) != new_hash:
+            print("Error: The updated database definitions do not match the new edition of the diff file.")
+            cursor.execute("ROLLBACK")
             return
 
-        # Commit the changes
-        conn.commit()
-        print("Update successful. All words were updated with new definitions.")
+        cursor.execute("COMMIT")
+        print(f"Update successful. {updated} definitions were updated from the diff file.")
 
     except sqlite3.Error as e:
         print(f"SQLite error: {e}")
     except FileNotFoundError:
-        print("Error: TSV file not found.")
+        print("Error: Diff file not found.")
     except Exception as e:
         print(f"Unexpected error: {e}")
     finally:
@@ -63,7 +312,17 @@ def update_definitions(tsv_file, db_file):
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Update definitions in a SQLite database using a TSV file.")
     parser.add_argument("defs", help="Path to the TSV file containing word-definition pairs.")
-    parser.add_argument("db", help="Path to the SQLite database file.")
+    parser.add_argument("db", nargs="+", help="Path to the SQLite database file. With several files the definitions are read once and each database is updated in a copy that replaces it once it is complete.")
+    parser.add_argument("--diff", action="store_true", help="Treat the definitions file as a diff file created by csd.py --diff and only apply its changes.")
+    parser.add_argument("--jobs", type=int, default=DEFAULT_JOBS, help="Number of databases updated at the same time when updating several databases.")
     args = parser.parse_args()
 
-    update_definitions(args.defs, args.db)
+    if args.diff:
+        if len(args.db) != 1:
+            print("Error: --diff only updates one database at a time.")
+            exit(1)
+        apply_diff(args.defs, args.db[0])
+    elif len(args.db) == 1:
+        update_definitions(args.defs, args.db[0])
+    else:
+        update_databases(args.defs, args.db, args.jobs)
@@ -1,117 +1,276 @@
 import sqlite3
 import csv
-import tkinter as tk
-from tkinter import filedialog, messagebox
+import mmap
+import queue
+import struct
+import sys
+import threading
+from array import array
 
-def update_definitions(tsv_file, db_file, output_text):
+PROGRESS_BATCH_SIZE = 5000
+POLL_INTERVAL_MS = 100
+# Number of SQLite virtual machine steps between checks for a cancelled update
+CANCEL_CHECK_STEPS = 10000
+CANCELLED_MESSAGE = "Update cancelled. No changes were made to the database.\n"
+
+# UPDATE ... FROM is only available from SQLite 3.33.0
+UPDATE_FROM_SUPPORTED = sqlite3.sqlite_version_info >= (3, 33, 0)
+# Must match the edition format in csd.py
+EDITION_MAGIC = b'CSDE'
+EDITION_VERSION = 1
+EDITION_HEADER = struct.Struct('<4sIIIIIII')
+# Must match the working store format in csd.py
+STORE_MAGIC = b'SQLite format 3\x00'
+STORE_VERSION = 1
+
+# Reads the words and definitions of an edition file written by csd.py --edition
+def read_edition_rows(edition_file):
+    with open(edition_file, 'rb') as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as edition:
+            magic, version, num_strings, _, num_words, num_entries, num_groups, num_group_members = EDITION_HEADER.unpack_from(edition, 0)
+            if magic != EDITION_MAGIC or version != EDITION_VERSION:
+                raise ValueError(f"{edition_file} is not a version {EDITION_VERSION} edition file")
+
+            def read_column(start, length):
+                values = array('I')
+                values.frombytes(edition[start:start + length * 4])
+                if sys.byteorder != 'little':
+                    values.byteswap()
+                return values
+
+            string_offsets = read_column(EDITION_HEADER.size, num_strings + 1)
+            word_column = read_column(EDITION_HEADER.size + (num_strings + 1) * 4, num_words)
+            definition_column = read_column(EDITION_HEADER.size + (num_strings + 1 + num_words) * 4, num_words)
+            string_data = EDITION_HEADER.size + (num_strings + 1 + 3 * num_words + 1 + 5 * num_entries + num_groups + 1 + num_group_members) * 4
+
+            def read_string(string_id):
+                return edition[string_data + string_offsets[string_id]:string_data + string_offsets[string_id + 1]].decode('utf-8')
+
+            return [(read_string(word_id), read_string(definition_id)) for word_id, definition_id in zip(word_column, definition_column)]
+
+# Reads the words and definitions of a working store written by csd.py --store.
+# The definition column holds the autosuggested definition, so the reviewed
+# definition of the input file is read from old_definition.
+def read_store_rows(store_file):
+    conn = sqlite3.connect(store_file)
+    try:
+        if conn.execute("PRAGMA user_version").fetchone()[0] != STORE_VERSION:
+            raise ValueError(f"{store_file} is not a version {STORE_VERSION} working store")
+        return conn.execute("SELECT word, old_definition FROM words ORDER BY position").fetchall()
+    finally:
+        conn.close()
+
+# Reads the words and definitions of a TSV, edition or working store file
+def read_definition_rows(tsv_file):
+    with open(tsv_file, 'rb') as file:
+        magic = file.read(len(STORE_MAGIC))
+    if magic.startswith(EDITION_MAGIC):
+        return read_edition_rows(tsv_file)
+    if magic == STORE_MAGIC:
+        return read_store_rows(tsv_file)
+    with open(tsv_file, 'r', encoding='utf-8') as file:
+        reader = csv.reader(file, delimiter='\t')
+        return [(row[0].upper(), row[1]) for row in reader]
+
+def apply_staged_definitions(cursor):
+    if UPDATE_FROM_SUPPORTED:
+        cursor.execute("""
+            UPDATE words
+            SET definition = tsv_definitions.definition
+            FROM tsv_definitions
+            WHERE words.word = tsv_definitions.word
+            AND words.definition IS NOT tsv_definitions.definition
+        """)
+    else:
+        cursor.execute("""
+            UPDATE words
+            SET definition = (SELECT definition FROM tsv_definitions WHERE tsv_definitions.word = words.word)
+            WHERE definition IS NOT (SELECT definition FROM tsv_definitions WHERE tsv_definitions.word = words.word)
+        """)
+
+# Runs on the worker thread and reports to the GUI only through the messages
+# queue. Setting cancel_event interrupts the update and rolls it back.
+def update_definitions(tsv_file, db_file, messages, cancel_event):
     try:
-        # Read TSV file
-        with open(tsv_file, 'r', encoding='utf-8') as file:
-            reader = csv.reader(file, delimiter='\t')
-            tsv_data = {row[0].upper(): row[1] for row in reader}
+        # Read the TSV or edition file
+        tsv_rows = read_definition_rows(tsv_file)
+        messages.put(('total', len(tsv_rows)))
 
-        # Connect to SQLite database
-        conn = sqlite3.connect(db_file)
+        # Connect to SQLite database and manage the transaction explicitly
+        conn = sqlite3.connect(db_file, isolation_level=None)
+        # Interrupt the running statement as soon as the update is cancelled
+        conn.set_progress_handler(cancel_event.is_set, CANCEL_CHECK_STEPS)
         cursor = conn.cursor()
+        # The default rollback journal keeps the database intact if the update is
+        # killed part way, and turning it off was not measurably faster
+        cursor.execute("PRAGMA synchronous = NORMAL")
+        cursor.execute("PRAGMA temp_store = MEMORY")
+        cursor.execute("BEGIN")
 
-        # Retrieve all words from the 'words' table
-        cursor.execute("SELECT word, definition FROM words")
-        db_words = {row[0]: row[1] for row in cursor.fetchall()}
+        # Stage the TSV definitions, keeping the last definition of each word
+        cursor.execute("CREATE TEMP TABLE tsv_definitions (word TEXT PRIMARY KEY, definition TEXT)")
+        for start in range(0, len(tsv_rows), PROGRESS_BATCH_SIZE):
+            batch = tsv_rows[start:start + PROGRESS_BATCH_SIZE]
+            cursor.executemany("INSERT OR REPLACE INTO tsv_definitions (word, definition) VALUES (?, ?)", batch)
+            messages.put(('progress', start + len(batch)))
 
         # Check if all TSV words exist in the SQLite 'words' table
-        tsv_words = set(tsv_data.keys())
-        db_word_keys = set(db_words.keys())
-        missing_words = tsv_words - db_word_keys
+        cursor.execute("SELECT word FROM tsv_definitions EXCEPT SELECT word FROM words")
+        missing_words = [row[0] for row in cursor.fetchall()]
         if missing_words:
-            output_text.insert(tk.END, "Error: The following words in the TSV file are not in the SQLite 'words' table:\n")
-            for word in missing_words:
-                output_text.insert(tk.END, f"{word}\n")
+            messages.put(('output', "Error: The following words in the TSV file are not in the SQLite 'words' table:\n" + "".join(f"{word}\n" for word in missing_words)))
+            cursor.execute("ROLLBACK")
             return
 
-        # Prepare to track updated words
-        updated_words = set()
-
-        # Update definitions in the SQLite database
-        for word, new_definition in tsv_data.items():
-            db_word_keys.remove(word)
-            cursor.execute("""
-                UPDATE words
-                SET definition = ?
-                WHERE word = ?
-            """, (new_definition, word))
-
-        if db_word_keys:
-            output_text.insert(tk.END, "Error: The following words were not updated with new definitions:\n")
-            for word in db_word_keys:
-                output_text.insert(tk.END, f"{word}\n")
-            conn.rollback()
+        # Check if all words in the SQLite 'words' table have a TSV definition
+        cursor.execute("SELECT word FROM words EXCEPT SELECT word FROM tsv_definitions")
+        not_updated_words = [row[0] for row in cursor.fetchall()]
+        if not_updated_words:
+            messages.put(('output', "Error: The following words were not updated with new definitions:\n" + "".join(f"{word}\n" for word in not_updated_words)))
+            cursor.execute("ROLLBACK")
+            return
+
+        # Update the definitions that changed in the SQLite database
+        apply_staged_definitions(cursor)
+
+        if cancel_event.is_set():
+            cursor.execute("ROLLBACK")
+            messages.put(('output', CANCELLED_MESSAGE))
             return
 
         # Commit the changes
-        conn.commit()
-        output_text.insert(tk.END, "Update successful. All words were updated with new definitions. You must restart Zyzzyva for the changes to take effect. You can now close the application.\n")
+        cursor.execute("COMMIT")
+        messages.put(('output', "Update successful. All words were updated with new definitions. You must restart Zyzzyva for the changes to take effect. You can now close the application.\n"))
 
     except sqlite3.Error as e:
-        output_text.insert(tk.END, f"SQLite error: {e}\n")
+        if cancel_event.is_set():
+            messages.put(('output', CANCELLED_MESSAGE))
+        else:
+            messages.put(('output', f"SQLite error: {e}\n"))
     except FileNotFoundError:
-        output_text.insert(tk.END, "Error: TSV file not found.\n")
+        messages.put(('output', "Error: TSV file not found.\n"))
     except Exception as e:
-        output_text.insert(tk.END, f"Unexpected error: {e}\n")
+        messages.put(('output', f"Unexpected error: {e}\n"))
     finally:
         if 'conn' in locals():
             conn.close()
+        messages.put(('done', None))
+
+# Builds the window and runs it. tkinter is only imported here so that the
+# update logic above can be imported and run without a display.
+def main():
+    import tkinter as tk
+    from tkinter import filedialog, messagebox, ttk
+
+    messages = queue.Queue()
+    cancel_event = threading.Event()
+    worker = None
+
+    def browse_tsv_file():
+        tsv_path = filedialog.askopenfilename(filetypes=[("TSV Files", "*.tsv"), ("Edition Files", "*.csde"), ("Working Store Files", "*.db")])
+        tsv_entry.delete(0, tk.END)
+        tsv_entry.insert(0, tsv_path)
+
+    def browse_db_file():
+        db_path = filedialog.askopenfilename(filetypes=[("SQLite DB Files", "*.db"), ("SQLite Files", "*.sqlite")])
+        db_entry.delete(0, tk.END)
+        db_entry.insert(0, db_path)
+
+    # Drains the messages from the worker thread, rendering all new output with a
+    # single insert, and polls again until the worker is done
+    def poll_messages():
+        output = []
+        done = False
+        while True:
+            try:
+                kind, value = messages.get_nowait()
+            except queue.Empty:
+                break
+            if kind == 'output':
+                output.append(value)
+            elif kind == 'total':
+                progress_bar.config(maximum=max(value, 1))
+            elif kind == 'progress':
+                progress_bar.config(value=value)
+            elif kind == 'done':
+                done = True
+        if output:
+            output_text.insert(tk.END, "".join(output))
+        if done:
+            run_button.config(state=tk.NORMAL)
+            cancel_button.config(state=tk.DISABLED)
+        else:
+            root.after(POLL_INTERVAL_MS, poll_messages)
+
+    def run_update():
+        nonlocal worker
+        tsv_file = tsv_entry.get()
+        db_file = db_entry.get()
+        if not tsv_file or not db_file:
+            messagebox.showerror("Error", "Both TSV and database files are required.")
+            return
+        output_text.delete(1.0, tk.END)  # Clear previous output
+        progress_bar.config(value=0)
+        cancel_event.clear()
+        run_button.config(state=tk.DISABLED)
+        cancel_button.config(state=tk.NORMAL)
+        worker = threading.Thread(target=update_definitions, args=(tsv_file, db_file, messages, cancel_event))
+        worker.start()
+        root.after(POLL_INTERVAL_MS, poll_messages)
+
+    def cancel_update():
+        cancel_event.set()
+        cancel_button.config(state=tk.DISABLED)
+
+    # Roll back a running update before closing so the database is left untouched
+    def close_window():
+        cancel_event.set()
+        if worker is not None:
+            worker.join()
+        root.destroy()
+
+    # Set up the GUI
+    root = tk.Tk()
+    root.title("Update Definitions")
+
+    # TSV file input
+    tsv_label = tk.Label(root, text="Definitions File:")
+    tsv_label.grid(row=0, column=0, padx=10, pady=10)
+    tsv_entry = tk.Entry(root, width=40)
+    tsv_entry.grid(row=0, column=1, padx=10, pady=10)
+    tsv_button = tk.Button(root, text="Browse", command=browse_tsv_file)
+    tsv_button.grid(row=0, column=2, padx=10, pady=10)
+    tsv_description = tk.Label(root, text="This should be a plain text file that contains each word with its definition delimited by a tab.", fg="gray")
+    tsv_description.grid(row=1, column=0, columnspan=3, padx=10, pady=(0, 10), sticky="w")
+
+    # Database file input
+    db_label = tk.Label(root, text="Database File:")
+    db_label.grid(row=2, column=0, padx=10, pady=10)
+    db_entry = tk.Entry(root, width=40)
+    db_entry.grid(row=2, column=1, padx=10, pady=10)
+    db_button = tk.Button(root, text="Browse", command=browse_db_file)
+    db_button.grid(row=2, column=2, padx=10, pady=10)
+    db_description = tk.Label(root, text="This is the SQLite database file that contains the words and definitions for Zyzzyva.\nIt should look something like 'CSW24.db' and\ncan usually be found in C:\\Users\\<name>\\.collinszyzzyva\\lexicons for Collins Zyzzyva or C:\\Users\\<name>\\Zyzzyva\\lexicons for NASPA Zyzzyva.\nFor MacOS and Linux users it can be found in ~/.collinszyzzyva/lexicons for Collins Zyzzyva or ~/Zyzzyva/lexicons for NASPA Zyzzyva.", fg="gray")
+    db_description.grid(row=3, column=0, columnspan=3, padx=10, pady=(0, 10), sticky="w")
+
+    # Output text area
+    output_label = tk.Label(root, text="Output:")
+    output_label.grid(row=4, column=0, padx=10, pady=10)
+    output_text = tk.Text(root, height=15, width=60)
+    output_text.grid(row=5, column=0, columnspan=3, padx=10, pady=10)
+
+    # Progress bar
+    progress_bar = ttk.Progressbar(root, mode="determinate", length=400)
+    progress_bar.grid(row=6, column=0, columnspan=3, padx=10, pady=10)
+
+    # Run and cancel buttons
+    run_button = tk.Button(root, text="Update Definitions", command=run_update)
+    run_button.grid(row=7, column=0, columnspan=2, padx=10, pady=10)
+    cancel_button = tk.Button(root, text="Cancel", command=cancel_update, state=tk.DISABLED)
+    cancel_button.grid(row=7, column=2, padx=10, pady=10)
+
+    root.protocol("WM_DELETE_WINDOW", close_window)
+    root.mainloop()
 
-def browse_tsv_file():
-    tsv_path = filedialog.askopenfilename(filetypes=[("TSV Files", "*.tsv")])
-    tsv_entry.delete(0, tk.END)
-    tsv_entry.insert(0, tsv_path)
-
-def browse_db_file():
-    db_path = filedialog.askopenfilename(filetypes=[("SQLite DB Files", "*.db"), ("SQLite Files", "*.sqlite")])
-    db_entry.delete(0, tk.END)
-    db_entry.insert(0, db_path)
-
-def run_update():
-    tsv_file = tsv_entry.get()
-    db_file = db_entry.get()
-    if not tsv_file or not db_file:
-        messagebox.showerror("Error", "Both TSV and database files are required.")
-        return
-    output_text.delete(1.0, tk.END)  # Clear previous output
-    update_definitions(tsv_file, db_file, output_text)
-
-# Set up the GUI
-root = tk.Tk()
-root.title("Update Definitions")
-
-# TSV file input
-tsv_label = tk.Label(root, text="Definitions File:")
-tsv_label.grid(row=0, column=0, padx=10, pady=10)
-tsv_entry = tk.Entry(root, width=40)
-tsv_entry.grid(row=0, column=1, padx=10, pady=10)
-tsv_button = tk.Button(root, text="Browse", command=browse_tsv_file)
-tsv_button.grid(row=0, column=2, padx=10, pady=10)
-tsv_description = tk.Label(root, text="This should be a plain text file that contains each word with its definition delimited by a tab.", fg="gray")
-tsv_description.grid(row=1, column=0, columnspan=3, padx=10, pady=(0, 10), sticky="w")
-
-# Database file input
-db_label = tk.Label(root, text="Database File:")
-db_label.grid(row=2, column=0, padx=10, pady=10)
-db_entry = tk.Entry(root, width=40)
-db_entry.grid(row=2, column=1, padx=10, pady=10)
-db_button = tk.Button(root, text="Browse", command=browse_db_file)
-db_button.grid(row=2, column=2, padx=10, pady=10)
-db_description = tk.Label(root, text="This is the SQLite database file that contains the words and definitions for Zyzzyva.\nIt should look something like 'CSW24.db' and\ncan usually be found in C:\\Users\\<name>\\.collinszyzzyva\\lexicons for Collins Zyzzyva or C:\\Users\\<name>\\Zyzzyva\\lexicons for NASPA Zyzzyva.\nFor MacOS and Linux users it can be found in ~/.collinszyzzyva/lexicons for Collins Zyzzyva or ~/Zyzzyva/lexicons for NASPA Zyzzyva.", fg="gray")
-db_description.grid(row=3, column=0, columnspan=3, padx=10, pady=(0, 10), sticky="w")
-
-# Output text area
-output_label = tk.Label(root, text="Output:")
-output_label.grid(row=4, column=0, padx=10, pady=10)
-output_text = tk.Text(root, height=15, width=60)
-output_text.grid(row=5, column=0, columnspan=3, padx=10, pady=10)
-
-# Run button
-run_button = tk.Button(root, text="Update Definitions", command=run_update)
-run_button.grid(row=6, column=0, columnspan=3, padx=10, pady=10)
-
-root.mainloop()
+if __name__ == "__main__":
+    main()
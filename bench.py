@@ -0,0 +1,587 @@
+import io
+import os
+import re
+import sys
+import copy
+import json
+import time
+import random
+import argparse
+import platform
+import tempfile
+import contextlib
+import subprocess
+import tracemalloc
+import csd
+
+GENERATED_LETTERS = 'ABCDEFGHIJKLMNOPRSTUVWY'
+GENERATED_VOCABULARY_SIZE = 2000
+GENERATED_LOOS = ['Scots', 'Austral', 'Hawaiian', 'Yiddish', 'Spanish']
+
+# The regex based parse_definition that csd.parse_definition replaced, kept
+# as the baseline for the parse benchmark
+def regex_parse_definition(defi, valid_words, word, existing_words_info):
+    if defi.count('[') != 1:
+        raise ValueError("definition does not have exactly one '[' character: " + defi)
+    if defi.count(']') != 1:
+        raise ValueError("definition does not have exactly one ']' character: " + defi)
+    if not defi.endswith(']'):
+        raise ValueError("definition does not end with ']' character: " + defi)
+
+    root_word = None
+    loo = None
+    alt_spellings = set()
+    part_of_speech = None
+    conjugations = None
+
+    defi = defi.strip()
+
+    word_is_root_word = False
+    root_word_match = re.search(r'^([A-Z]+),', defi)
+    if root_word_match:
+        root_word = root_word_match.group(1)
+        if word == root_word:
+            raise ValueError(f"definition lists word as its own root word: " + defi)
+        defi = defi[len(root_word) + 1:].strip()
+    else:
+        root_word = word
+        word_is_root_word = True
+
+    loo_match = re.search(r'^\(([^)]+)\)', defi)
+    if loo_match:
+        loo = loo_match.group(1)
+        defi = defi[len(loo)+2:].strip()
+
+    pos_and_conj_match = re.search(r'\[([^]]+)\]', defi)
+    if pos_and_conj_match:
+        pos_and_conj = pos_and_conj_match.group(1)
+        split_by_pos = pos_and_conj.split(" ", 1)
+        part_of_speech = split_by_pos[0]
+        if len(split_by_pos) > 1:
+            if not word_is_root_word and word not in csd.ROOT_WORD_EXCEPTIONS:
+                raise ValueError("definition lists conjugations for nonroot word: " + word + ", " + defi)
+            tenses = split_by_pos[1].split(",")
+            tenses = [x.strip() for x in tenses]
+            conjugations = []
+            for tense in tenses:
+                tense_conjs_split = tense.strip().replace("or", " ").split()
+                tense_conjs = []
+                for conj in tense_conjs_split:
+                    conj = conj.strip()
+                    if conj[0] == "(" and conj[-1] == ")":
+                        continue
+                    if not conj.isupper():
+                        raise ValueError("definition contains a conjugation '' that is not uppercase: " + defi)
+                    tense_conjs.append(conj)
+                conjugations.append(tense_conjs)
+        defi = defi[:defi.find('[')].strip()
+    else:
+        raise ValueError("definition does not contain part of speech: " + defi)
+
+    if existing_words_info and word in existing_words_info and existing_words_info[word]['pos'] == part_of_speech and existing_words_info[word]['is_root'] != word_is_root_word:
+        raise ValueError("invalid root status: " + word)
+
+    alt_spellings_match = re.search(r', also ([^[]+)', defi)
+    if alt_spellings_match:
+        alt_spellings_str = alt_spellings_match.group(1)
+        alt_spellings = {x.strip() for x in alt_spellings_str.split(",")}
+        for alt_spelling in alt_spellings:
+            if not alt_spelling.isupper():
+                raise ValueError(f"definition contains an alt spelling that is not uppercase: " + defi)
+            if alt_spelling not in valid_words:
+                raise ValueError(f"definition contains an alt spelling that is not a valid word: " + defi)
+        defi = defi[:defi.find(', also ')].strip()
+
+    def_words = defi.split()
+    misspelled = []
+    for def_word in def_words:
+        if len(def_word) > 1 and len(def_word) <= 15 and def_word.isalpha() and def_word.islower() and def_word.upper() not in valid_words:
+            misspelled.append(def_word.upper())
+
+    if len(misspelled) > 0:
+        raise ValueError(f"{word.upper()} definition has mispelled word(s): " + ", ".join(misspelled))
+
+    return root_word, loo, defi, alt_spellings, part_of_speech, conjugations
+
+# The dict based model that csd.build_model and csd.group_alt_spellings
+# replaced, kept as the baseline for the memory benchmark
+def dict_build_model(parsed_definitions):
+    parsed_tsv = {}
+    adj_list = {}
+    for root_word, loo, def_text, alt_spellings, pos, conjugations, word in parsed_definitions:
+        conjugations_exp = None
+        if conjugations:
+            conjugations_exp = {tense.replace('-', word) for tenses in conjugations for tense in tenses}
+        entry = {
+            'root': root_word,
+            'loo': loo,
+            'def': def_text,
+            'alts': alt_spellings,
+            'pos': pos,
+            'conjs': conjugations,
+            'conjs_exp': conjugations_exp,
+        }
+        if word not in parsed_tsv:
+            parsed_tsv[word] = []
+        parsed_tsv[word].append(entry)
+        root_pos_key = root_word + '###' + pos
+        if root_pos_key not in adj_list:
+            adj_list[root_pos_key] = {
+                'root': root_word,
+                'def': def_text,
+                'neighbors': set(),
+                'vis': False,
+            }
+        adj_list[root_pos_key]['neighbors'] = adj_list[root_pos_key]['neighbors'].union([x + '###' + pos for x in alt_spellings])
+
+    for node_key, node_val in adj_list.items():
+        for neighbor in list(node_val['neighbors']):
+            if neighbor not in adj_list:
+                node_val['neighbors'].remove(neighbor)
+            else:
+                adj_list[neighbor]['neighbors'].add(node_key)
+
+    completed_groups = {}
+    for node_key in adj_list:
+        if adj_list[node_key]['vis']:
+            continue
+        words = []
+        defs = []
+        stack = [node_key]
+        while stack:
+            current_key = stack.pop()
+            node_val = adj_list[current_key]
+            if node_val['vis']:
+                continue
+            node_val['vis'] = True
+            words.append(node_val['root'])
+            defs.append(node_val['def'])
+            stack.extend(node_val['neighbors'])
+        sorted_alt_spellings = sorted(words)
+        pos = node_key.split('###')[1]
+        for salt in sorted_alt_spellings:
+            completed_groups[salt + '###' + pos] = {
+                'pdef': max(defs, key=len),
+                'ploo': None,
+                'alts': sorted_alt_spellings,
+            }
+    return parsed_tsv, adj_list, completed_groups
+
+def compact_build_model(parsed_definitions):
+    parsed_tsv, adj_list, reserved_nodes, _ = csd.build_model(parsed_definitions)
+    return parsed_tsv, adj_list, csd.group_alt_spellings(adj_list, reserved_nodes)
+
+def read_word_defis(filename):
+    valid_words = set()
+    word_defis = []
+    with open(filename, 'r') as file:
+        for line in file:
+            word_and_all_defis = line.split('\t')
+            if len(word_and_all_defis) != 2:
+                continue
+            word = word_and_all_defis[0].strip()
+            valid_words.add(word)
+            for defi in word_and_all_defis[1].strip().split(' / '):
+                word_defis.append((word, defi))
+    return valid_words, word_defis
+
+def run_parser(parse_function, word_defis, valid_words):
+    results = []
+    for word, defi in word_defis:
+        try:
+            results.append(tuple(parse_function(defi, valid_words, word, None)))
+        except ValueError as e:
+            results.append(str(e))
+    return results
+
+def time_parser(parse_function, word_defis, valid_words, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        results = run_parser(parse_function, word_defis, valid_words)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, results
+
+def bench_parse(args):
+    valid_words, word_defis = read_word_defis(args.file)
+    regex_time, regex_results = time_parser(regex_parse_definition, word_defis, valid_words, args.repeat)
+    single_pass_time, single_pass_results = time_parser(csd.parse_definition, word_defis, valid_words, args.repeat)
+    mismatches = sum(1 for x, y in zip(regex_results, single_pass_results) if x != y)
+    print(f"Definitions: {len(word_defis)}")
+    print(f"Regex parser: {regex_time:.3f}s")
+    print(f"Single pass parser: {single_pass_time:.3f}s ({regex_time / single_pass_time:.2f}x)")
+    print(f"Mismatched results: {mismatches}")
+
+def measure_memory(build_function, parsed_definitions):
+    parsed_definitions = copy.deepcopy(parsed_definitions)
+    tracemalloc.start()
+    model = build_function(parsed_definitions)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del model
+    return current, peak
+
+def bench_memory(args):
+    valid_words, word_defis = read_word_defis(args.file)
+    valid_words = {sys.intern(word) for word in valid_words}
+    parsed_definitions = []
+    for word, defi in word_defis:
+        try:
+            parsed = csd.parse_definition(defi, valid_words, word, None)
+        except ValueError:
+            continue
+        parsed_definitions.append([*parsed, sys.intern(word)])
+    if len(parsed_definitions) != len(word_defis):
+        print(f"Skipped {len(word_defis) - len(parsed_definitions)} invalid definitions")
+
+    dict_current, dict_peak = measure_memory(dict_build_model, parsed_definitions)
+    compact_current, compact_peak = measure_memory(compact_build_model, parsed_definitions)
+    print(f"Definitions: {len(parsed_definitions)}")
+    print(f"Dict model: {dict_current / 2**20:.1f} MiB retained, {dict_peak / 2**20:.1f} MiB peak")
+    print(f"Compact model: {compact_current / 2**20:.1f} MiB retained, {compact_peak / 2**20:.1f} MiB peak ({dict_peak / compact_peak:.2f}x)")
+
+# Builds the definitions of a synthetic lexicon with roughly num_lines lines.
+# Definitions only use words of the lexicon so that they pass the spell check.
+def generate_lexicon(num_lines, seed):
+    rng = random.Random(seed)
+    roots = set()
+    # About half of the lines are inflections of a root
+    while len(roots) < num_lines // 2 + 1:
+        roots.add(''.join(rng.choice(GENERATED_LETTERS) for _ in range(rng.randint(3, 8))))
+    roots = sorted(roots)
+    rng.shuffle(roots)
+    # A root adds at most four lines, so the roots the vocabulary is taken
+    # from are always in the lexicon
+    vocabulary = [root.lower() for root in roots[:max(1, min(GENERATED_VOCABULARY_SIZE, num_lines // 4))]]
+
+    lines = {}
+    def add(word, defi):
+        if word in lines:
+            lines[word] += " / " + defi
+        else:
+            lines[word] = defi
+
+    def text():
+        return ' '.join(rng.choice(vocabulary) for _ in range(rng.randint(2, 6)))
+
+    def loo():
+        if rng.random() < 0.1:
+            return f"({rng.choice(GENERATED_LOOS)}) "
+        return ""
+
+    def add_noun(root, defi, alts=""):
+        add(root, f"{defi}{alts} [n {root}S]")
+        add(root + 'S', f"{root}, {defi} [n]")
+
+    def add_verb(root, defi):
+        if rng.random() < 0.5:
+            add(root, f"{defi} [v -ED, -ING, -S]")
+        else:
+            add(root, f"{defi} [v {root}ED, {root}ING, {root}S]")
+        for suffix in ('ED', 'ING', 'S'):
+            add(root + suffix, f"{root}, {defi} [v]")
+
+    i = 0
+    while i < len(roots) and len(lines) < num_lines:
+        root = roots[i]
+        kind = rng.random()
+        if kind < 0.05 and i + 1 < len(roots):
+            # A chain of alt spellings where each word only lists its neighbors
+            chain = roots[i:i + rng.randint(2, 4)]
+            defi = text()
+            for j, word in enumerate(chain):
+                neighbors = [chain[k] for k in (j - 1, j + 1) if 0 <= k < len(chain)]
+                word_defi = defi if rng.random() < 0.7 else text()
+                add_noun(word, loo() + word_defi, ", also " + ", ".join(neighbors))
+            i += len(chain)
+            continue
+        if kind < 0.35:
+            add_verb(root, loo() + text())
+        elif kind < 0.75:
+            add_noun(root, loo() + text())
+        elif kind < 0.85:
+            # A word with more than one part of speech
+            add_noun(root, loo() + text())
+            add_verb(root, text())
+        else:
+            add(root, f"{loo()}{text()} [adj]")
+        i += 1
+
+    for word in sorted(lines):
+        yield f"{word}\t{lines[word]}\n"
+
+def bench_generate(args):
+    with open(args.output, 'w') as file:
+        num_lines = 0
+        for line in generate_lexicon(args.lines, args.seed):
+            file.write(line)
+            num_lines += 1
+    print(f"Wrote {num_lines} lines to {args.output}")
+
+# Runs every stage of csd.py in order and returns the wall time of each
+# stage and, when trace_memory is set, its peak traced memory
+def run_stages(args, trace_memory):
+    results = {}
+
+    def run_stage(name, function, *function_args):
+        if trace_memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        # The stages print their logs, which are not part of the benchmark
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = function(*function_args)
+        elapsed = time.perf_counter() - start
+        results[name] = {'seconds': elapsed}
+        if trace_memory:
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            results[name]['peak_bytes'] = peak
+        return result
+
+    parsed_tsv, adj_list, reserved_nodes, errors = run_stage('parse_tsv', csd.parse_tsv, args.file, args.exist, args.jobs)
+    if errors:
+        raise ValueError(f"{args.file} has {len(errors)} errors, the first is: {errors[0]}")
+    reserved_words = run_stage('group', csd.apply_alt_spelling_groups, parsed_tsv, adj_list, reserved_nodes)
+    run_stage('create_sheet', csd.create_sheet, parsed_tsv, reserved_words, args.file)
+    counts = {
+        'words': len(parsed_tsv),
+        'definitions': sum(len(entries) for entries in parsed_tsv.values()),
+        'nodes': len(adj_list),
+    }
+    return results, counts
+
+def bench_stages(args):
+    timings = None
+    for _ in range(args.repeat):
+        run_timings, counts = run_stages(args, False)
+        if timings is None:
+            timings = run_timings
+        for name, timing in run_timings.items():
+            timings[name]['seconds'] = min(timings[name]['seconds'], timing['seconds'])
+    if not args.no_memory:
+        memory, _ = run_stages(args, True)
+        for name in timings:
+            timings[name]['peak_bytes'] = memory[name]['peak_bytes']
+
+    report = {
+        'file': args.file,
+        'jobs': args.jobs,
+        'python': platform.python_version(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'counts': counts,
+        'stages': timings,
+    }
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, 'r') as file:
+            baseline = json.load(file)
+
+    print(f"Words: {counts['words']}, definitions: {counts['definitions']}, alt spelling nodes: {counts['nodes']}")
+    for name, timing in timings.items():
+        line = f"{name}: {timing['seconds']:.3f}s"
+        if 'peak_bytes' in timing:
+            line += f", {timing['peak_bytes'] / 2**20:.1f} MiB peak"
+        if baseline and name in baseline['stages']:
+            line += f" ({timing['seconds'] / baseline['stages'][name]['seconds']:.2f}x baseline time)"
+        print(line)
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+        print(f"Wrote results to {args.output}")
+
+# Times the validation of a file, with a validation cache if one is given
+def time_validation(args, file_path, cache_file):
+    reporter = csd.DiagnosticReporter(keep=True)
+    start = time.perf_counter()
+    if cache_file:
+        csd.parse_tsv_with_cache(file_path, args.exist, cache_file, args.jobs, reporter=reporter, need_model=False)
+    else:
+        csd.parse_tsv(file_path, args.exist, args.jobs, reporter=reporter)
+    elapsed = time.perf_counter() - start
+    if reporter.diagnostics:
+        raise ValueError(f"{file_path} has {len(reporter.diagnostics)} errors, the first is: {reporter.diagnostics[0].message}")
+    return elapsed
+
+# Reverses the words of count root definitions and rewords the definitions
+# of their inflections to match, which keeps the lexicon valid. Returns the
+# number of changed lines.
+def reword_definitions(lines, count, rng):
+    inflection_lines = {}
+    candidates = []
+    for i, line in enumerate(lines):
+        word, all_defis = line.rstrip('\n').split('\t')
+        for defi in all_defis.split(' / '):
+            match = re.match(r'([A-Z]+), ', defi)
+            if match:
+                inflection_lines.setdefault(match.group(1), []).append(i)
+        head = all_defis.split(' [', 1)[0]
+        if ' / ' not in all_defis and not re.match(r'[A-Z]+, ', all_defis) and '(' not in head and ', also ' not in head and len(set(head.split())) > 1:
+            candidates.append(i)
+
+    changed = set()
+    for i in rng.sample(candidates, min(count, len(candidates))):
+        word, all_defis = lines[i].rstrip('\n').split('\t')
+        head, tail = all_defis.split(' [', 1)
+        new_head = ' '.join(reversed(head.split()))
+        lines[i] = f"{word}\t{new_head} [{tail}\n"
+        changed.add(i)
+        for j in inflection_lines.get(word, ()):
+            lines[j] = lines[j].replace(f"{word}, {head} [", f"{word}, {new_head} [")
+            changed.add(j)
+    return len(changed)
+
+# Times validating without a cache, the first run that fills a validation
+# cache and the runs after changes of growing size, and fails if a run after
+# the smallest change is not faster than validating without a cache
+def bench_cache(args):
+    with open(args.file, 'r') as file:
+        lines = file.readlines()
+    rng = random.Random(args.seed)
+    uncached = min(time_validation(args, args.file, None) for _ in range(args.repeat))
+    print(f"No cache: {uncached:.3f}s")
+    with tempfile.TemporaryDirectory() as cache_dir:
+        file_path = os.path.join(cache_dir, 'lexicon.tsv')
+        cache_file = os.path.join(cache_dir, 'cache.db')
+        with open(file_path, 'w') as file:
+            file.writelines(lines)
+        fill = time_validation(args, file_path, cache_file)
+        print(f"First run: {fill:.3f}s ({fill / uncached:.2f}x no cache time)")
+        unchanged = min(time_validation(args, file_path, cache_file) for _ in range(args.repeat))
+        print(f"No change: {unchanged:.3f}s ({unchanged / uncached:.2f}x no cache time)")
+
+        change_times = []
+        for count in sorted(args.changes):
+            timings = []
+            for _ in range(args.repeat):
+                changed_lines = list(lines)
+                changed_count = reword_definitions(changed_lines, count, rng)
+                with open(file_path, 'w') as file:
+                    file.writelines(changed_lines)
+                timings.append(time_validation(args, file_path, cache_file))
+                # Going back to the original file is a change of the same size
+                with open(file_path, 'w') as file:
+                    file.writelines(lines)
+                time_validation(args, file_path, cache_file)
+            change_times.append(min(timings))
+            print(f"{count} reworded definitions, {changed_count} changed lines: {min(timings):.3f}s ({min(timings) / uncached:.2f}x no cache time)")
+
+    if change_times and change_times[0] >= uncached:
+        print("A run after the smallest change is not faster than validating without a cache")
+        exit(1)
+
+# Modules that each entry point only imports on the path that needs them
+DEFERRED_IMPORTS = {
+    'csd': ['requests', 'tracemalloc', 'cProfile'],
+    'serve': ['requests', 'tracemalloc', 'cProfile'],
+    'add_defs': [],
+    'add_defs_app': ['tkinter'],
+}
+
+# Imports a module in a new interpreter with -X importtime and returns its
+# cumulative import time in microseconds and the modules imported for it
+# with their cumulative times and whether the module imported them directly
+def measure_import(module):
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'], capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    if result.returncode != 0:
+        raise RuntimeError(f"importing {module} failed: {result.stderr.strip().splitlines()[-1]}")
+    imported = {}
+    for line in result.stderr.splitlines():
+        match = re.match(r'import time:\s+\d+ \|\s+(\d+) \|( +)(\S+)', line)
+        if not match:
+            continue
+        name = match.group(3)
+        # Only the modules imported after the previous top level import belong
+        # to this one
+        if len(match.group(2)) == 1 and name != module:
+            imported = {}
+            continue
+        if name == module:
+            return int(match.group(1)), imported
+        imported[name] = (int(match.group(1)), len(match.group(2)) == 3)
+    raise RuntimeError(f"no import time reported for {module}")
+
+def bench_startup(args):
+    results = {}
+    failed = False
+    for module in args.modules:
+        seconds = None
+        for _ in range(args.repeat):
+            microseconds, imported = measure_import(module)
+            if seconds is None or microseconds / 1e6 < seconds:
+                seconds = microseconds / 1e6
+        deferred = [name for name in DEFERRED_IMPORTS.get(module, []) if name in imported]
+        slowest = sorted(((name, microseconds) for name, (microseconds, direct) in imported.items() if direct), key=lambda x: -x[1])[:args.top]
+        results[module] = {'seconds': seconds, 'modules': len(imported), 'deferred_imported': deferred}
+
+        print(f"{module}: {seconds * 1000:.1f} ms, {len(imported)} modules")
+        for name, microseconds in slowest:
+            print(f"  {name}: {microseconds / 1000:.1f} ms")
+        if deferred:
+            print(f"  imports modules that should only load when needed: {', '.join(deferred)}")
+            failed = True
+
+    if args.baseline:
+        with open(args.baseline, 'r') as file:
+            baseline = json.load(file)
+        for module, result in results.items():
+            if module not in baseline['modules']:
+                continue
+            ratio = result['seconds'] / baseline['modules'][module]['seconds']
+            print(f"{module}: {ratio:.2f}x baseline time")
+            if ratio > args.tolerance:
+                print(f"  slower than {args.tolerance:.2f}x the baseline")
+                failed = True
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump({'python': platform.python_version(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'modules': results}, file, indent=2)
+        print(f"Wrote results to {args.output}")
+    if failed:
+        exit(1)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the definition tools.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    parse_parser = subparsers.add_parser("parse", help="Compare the regex and single pass definition parsers on a definitions file.")
+    parse_parser.add_argument("file", help="Specify the TSV file to parse.")
+    parse_parser.add_argument("--repeat", type=int, default=3, help="Number of timed runs for each parser.")
+    parse_parser.set_defaults(func=bench_parse)
+    memory_parser = subparsers.add_parser("memory", help="Compare the peak memory of the dict and compact lexicon models on a definitions file.")
+    memory_parser.add_argument("file", help="Specify the TSV file to parse.")
+    memory_parser.set_defaults(func=bench_memory)
+    generate_parser = subparsers.add_parser("generate", help="Write a synthetic definitions file with root words, LOOs, conjugations, alt spelling chains and multiple parts of speech.")
+    generate_parser.add_argument("output", help="Specify the TSV file to write.")
+    generate_parser.add_argument("--lines", type=int, default=100000, help="Approximate number of lines to generate.")
+    generate_parser.add_argument("--seed", type=int, default=1, help="Seed for the random generator.")
+    generate_parser.set_defaults(func=bench_generate)
+    stages_parser = subparsers.add_parser("stages", help="Time and measure the peak memory of parse_tsv, alt spelling grouping and create_sheet on a definitions file.")
+    stages_parser.add_argument("file", help="Specify the TSV file to process.")
+    stages_parser.add_argument("--exist", default=None, help="Specify the existing word definitions file.")
+    stages_parser.add_argument("--jobs", type=int, default=1, help="Number of worker processes used to parse definitions.")
+    stages_parser.add_argument("--repeat", type=int, default=1, help="Number of timed runs, the fastest time of each stage is reported.")
+    stages_parser.add_argument("--no-memory", action="store_true", help="Skip the extra run that measures peak memory.")
+    stages_parser.add_argument("--output", default=None, help="Write the results to a JSON file.")
+    stages_parser.add_argument("--baseline", default=None, help="Compare the times to the results in a JSON file written by an earlier run.")
+    stages_parser.set_defaults(func=bench_stages)
+    cache_parser = subparsers.add_parser("cache", help="Time validating without a validation cache and with one after changes of growing size.")
+    cache_parser.add_argument("file", help="Specify the TSV file to validate. It must not have errors.")
+    cache_parser.add_argument("--exist", default=None, help="Specify the existing word definitions file.")
+    cache_parser.add_argument("--jobs", type=int, default=1, help="Number of worker processes used to parse definitions.")
+    cache_parser.add_argument("--changes", type=int, nargs="+", default=[1, 10, 100, 1000, 10000], help="Numbers of root definitions to reword, with the definitions of their inflections, before a timed run.")
+    cache_parser.add_argument("--seed", type=int, default=1, help="Seed for the random choice of the reworded definitions.")
+    cache_parser.add_argument("--repeat", type=int, default=3, help="Number of timed runs of each kind, the fastest is reported.")
+    cache_parser.set_defaults(func=bench_cache)
+    startup_parser = subparsers.add_parser("startup", help="Measure the import time of the entry points with python -X importtime.")
+    startup_parser.add_argument("modules", nargs="*", default=list(DEFERRED_IMPORTS), help="Specify the modules to import.")
+    startup_parser.add_argument("--repeat", type=int, default=5, help="Number of timed imports of each module, the fastest is reported.")
+    startup_parser.add_argument("--top", type=int, default=5, help="Number of the slowest imported modules to list.")
+    startup_parser.add_argument("--output", default=None, help="Write the results to a JSON file.")
+    startup_parser.add_argument("--baseline", default=None, help="Compare the times to the results in a JSON file written by an earlier run.")
+    startup_parser.add_argument("--tolerance", type=float, default=1.5, help="Fail if a module takes longer than this multiple of its baseline time.")
+    startup_parser.set_defaults(func=bench_startup)
+    args = parser.parse_args()
+    args.func(args)
@@ -1,447 +1,2148 @@
 import csv
 import re
 import argparse
-import requests
-from io import StringIO
+import atexit
+import hashlib
+import json
+import marshal
+import mmap
+import os
+import sqlite3
+import struct
+import sys
+import time
+from array import array
+from collections import Counter, deque, namedtuple
+from contextlib import contextmanager
 
 VALID_POS = {'n', 'v', 'adj', 'adv', 'interj', 'pron', 'prep', 'conj'}
-KEY_DELIMITER = '###'
 ROOT_WORD_EXCEPTIONS = {'LOAST', 'LOSEN', 'SURBET'}
-SPECIAL_LOOS = {'obsolete', 'archaic', 'Spenser', 'Milton'}
 RETRIEVED_FILENAME = 'latest_edition.txt'
+RETRIEVED_METADATA_FILENAME = 'latest_edition.json'
+DOWNLOAD_CHUNK_SIZE = 65536
+DIFF_FILENAME = 'edition.diff'
+CROSS_LEXICON_REPORT_FILENAME = 'cross_lexicon_report.tsv'
+DIFF_FORMAT = ['#csd-diff', '1']
+# The edition file starts with the magic, the version and the number of
+# strings, string data bytes, words, entries, alt spelling groups and alt
+# spelling group members. Every column after the header is an array of
+# little endian unsigned 32 bit integers and the string data comes last.
+EDITION_MAGIC = b'CSDE'
+EDITION_VERSION = 1
+EDITION_HEADER = struct.Struct('<4sIIIIIII')
+EDITION_NONE = 0xFFFFFFFF
 TSV_URL = "https://docs.google.com/spreadsheets/d/1Msy6NKnhxCoBF23IwlfemSCZpgacJND4sWTQpvi7LZ4/export?format=tsv"
+PARSE_CHUNK_SIZE = 2000
+PARSE_BATCH_SIZE = 50000
+CACHE_QUERY_SIZE = 500
+# Number of words rendered by a worker at a time by create_sheet
+SHEET_CHUNK_SIZE = 5000
+SHEET_BUFFER_SIZE = 1 << 20
+# Increment whenever the tables of the working store change
+STORE_VERSION = 1
+WATCH_INTERVAL_SECONDS = 0.5
+# Number of root words checked together in watch mode and with a validation
+# cache. A change only checks the root words of the chunks that contain an
+# affected root word again.
+ROOT_CHUNK_SIZE = 20
+# Increment whenever the tables of the validation cache change
+VALIDATION_CACHE_VERSION = 3
+# Increment whenever the format of the spell check index changes
+SPELL_INDEX_VERSION = 1
+# Increment whenever the format of the search index changes
+SEARCH_INDEX_VERSION = 1
+# Only the start of each word is indexed, which keeps the index small while
+# still finding most words within the maximum edit distance
+SPELL_INDEX_PREFIX_LENGTH = 7
+SPELL_INDEX_MAX_DISTANCE = 2
+MAX_SPELLING_SUGGESTIONS = 3
 
+# Set once per worker process by init_parse_worker so that the large
+# lookup tables are not pickled with every task
+worker_valid_words = None
+worker_existing_words_info = None
+worker_lower_words = ()
+worker_spell_index = None
+# Suggestions for each misspelled word, which is usually in many definitions
+spelling_suggestions_cache = {}
 
-def parse_definition(defi, valid_words, word, existing_words_info):
-    if defi.count('[') != 1:
-        raise ValueError("definition does not have exactly one '[' character: " + defi)
-    if defi.count(']') != 1:
-        raise ValueError("definition does not have exactly one ']' character: " + defi)
-    if not defi.endswith(']'):
-        raise ValueError("definition does not end with ']' character: " + defi)
 
-    for match in re.finditer(r'\[(^[^\]\s]+)', defi):
-        part_of_speech = match.group(1)
-        if part_of_speech not in VALID_POS:
-            raise ValueError("definition contains invalid part of speech: " + defi)
+# Matches the optional root word and LOO at the start of a definition
+DEFINITION_HEAD_PATTERN = re.compile(r'\s*(?:([A-Z]+),\s*)?(?:\(([^)]+)\)\s*)?')
 
-    root_word = None
-    loo = None
-    alt_spellings = set()
-    part_of_speech = None
-    conjugations = None
+# A definition that cannot be parsed, with a code for the kind of error and
+# the span of the definition that it is about if it is not all of it
+class DefinitionError(ValueError):
+    def __init__(self, code, message, span=None):
+        super().__init__(message)
+        self.code = code
+        self.span = span
 
-    defi = defi.strip()
+class MisspelledWordsError(DefinitionError):
+    def __init__(self, word, misspelled, span=None):
+        super().__init__('misspelled-word', f"{word.upper()} definition has mispelled word(s): " + ", ".join(misspelled), span)
+        self.word = word
+        self.misspelled = misspelled
 
-    word_is_root_word = False
-    root_word_match = re.search(r'^([A-Z]+),', defi)
-    if root_word_match:
-        root_word = root_word_match.group(1)
-        if word == root_word:
-            raise ValueError(f"definition lists word as its own root word: " + defi)
-        defi = defi[len(root_word) + 1:].strip()
-    else:
+class TooManyErrors(Exception):
+    pass
+
+# An error found while validating. The line is the line number in the input
+# file and the span is the start and end of the text it is about on the line.
+Diagnostic = namedtuple('Diagnostic', ['line', 'word', 'code', 'message', 'span'])
+
+# Writes each diagnostic to the output as soon as it is found, skipping the
+# ones that repeat an earlier error of the same word, and raises
+# TooManyErrors once max_errors have been reported. With keep set the
+# diagnostics are kept for callers that handle the errors themselves.
+class DiagnosticReporter:
+    def __init__(self, output=None, error_format='text', max_errors=None, keep=False):
+        self.output = output
+        self.error_format = error_format
+        self.max_errors = max_errors
+        self.diagnostics = [] if keep else None
+        self.seen = set()
+        self.failed_words = set()
+        self.error_count = 0
+
+    def report(self, diagnostic):
+        if diagnostic.word:
+            self.failed_words.add(diagnostic.word)
+        key = (diagnostic.word, diagnostic.code, diagnostic.message)
+        if key in self.seen:
+            return
+        self.seen.add(key)
+        self.error_count += 1
+        if self.diagnostics is not None:
+            self.diagnostics.append(diagnostic)
+        if self.output is not None:
+            self.write(diagnostic)
+        if self.max_errors is not None and self.error_count >= self.max_errors:
+            raise TooManyErrors(f"Stopped after {self.error_count} errors")
+
+    # Writes a diagnostic to the output, marking the ones that were fixed
+    def write(self, diagnostic, cleared=False):
+        if self.error_format == 'jsonl':
+            fields = diagnostic._asdict()
+            if cleared:
+                fields['cleared'] = True
+            self.output.write(json.dumps(fields) + "\n")
+        else:
+            prefix = "cleared: " if cleared else ""
+            if diagnostic.line is not None:
+                prefix += f"line {diagnostic.line}: "
+            self.output.write(prefix + diagnostic.message + "\n")
+        self.output.flush()
+
+ParsedDefinition = namedtuple('ParsedDefinition', ['root', 'loo', 'defi', 'alts', 'pos', 'conjs'])
+ExistingWordInfo = namedtuple('ExistingWordInfo', ['is_root', 'pos'])
+EditionEntry = namedtuple('EditionEntry', ['pos', 'root', 'loo', 'defi', 'alts'])
+
+class Entry:
+    __slots__ = ('root', 'loo', 'defi', 'alts', 'pos', 'conjs', 'conjs_exp', 'node')
+
+    def __init__(self, root, loo, defi, alts, pos, conjs, conjs_exp, node):
+        self.root = root
+        self.loo = loo
+        self.defi = defi
+        self.alts = alts
+        self.pos = pos
+        self.conjs = conjs
+        self.conjs_exp = conjs_exp
+        self.node = node
+
+# A node of the alt spelling graph for a root word and part of speech
+class AltSpellingNode:
+    __slots__ = ('root', 'pos', 'defi', 'neighbors', 'parent')
+
+    def __init__(self, root, pos, defi, node_id):
+        self.root = root
+        self.pos = pos
+        self.defi = defi
+        self.neighbors = None
+        self.parent = node_id
+
+class AltSpellingGroup:
+    __slots__ = ('pdef', 'alts')
+
+    def __init__(self, pdef, alts):
+        self.pdef = pdef
+        self.alts = alts
+
+# Records the wall time, peak traced memory and counters of each stage of a
+# run for --profile. A stage only counts the time spent outside of the
+# stages nested in it, so the stage times add up to the profiled time.
+# tracemalloc and cProfile are only imported once profiling is enabled.
+class StageProfiler:
+    def __init__(self):
+        self.enabled = False
+        self.stages = {}
+        self.counters = {}
+        self.active = []
+        self.cprofile_stage = None
+        self.cprofile = None
+
+    def enable(self, cprofile_stage=None):
+        import tracemalloc
+        self.enabled = True
+        tracemalloc.start()
+        if cprofile_stage:
+            import cProfile
+            self.cprofile_stage = cprofile_stage
+            self.cprofile = cProfile.Profile()
+
+    def disable(self):
+        if not self.enabled:
+            return
+        import tracemalloc
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+        self.enabled = False
+
+    # Adds the time and peak memory since the innermost stage was entered or
+    # resumed to that stage
+    def pause(self):
+        if not self.active:
+            return
+        import tracemalloc
+        now = time.perf_counter()
+        name, start = self.active[-1]
+        stats = self.stages[name]
+        stats['seconds'] += now - start
+        stats['peak_bytes'] = max(stats['peak_bytes'], tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+        self.active[-1][1] = now
+
+    @contextmanager
+    def stage(self, name):
+        if not self.enabled:
+            yield
+            return
+        self.pause()
+        if name not in self.stages:
+            self.stages[name] = {'seconds': 0.0, 'peak_bytes': 0, 'calls': 0}
+        self.stages[name]['calls'] += 1
+        self.active.append([name, time.perf_counter()])
+        if name == self.cprofile_stage:
+            self.cprofile.enable()
+        try:
+            yield
+        finally:
+            if name == self.cprofile_stage:
+                self.cprofile.disable()
+            self.pause()
+            self.active.pop()
+            if self.active:
+                self.active[-1][1] = time.perf_counter()
+
+    # Counts the time spent getting each item of an iterable as a stage
+    def iterate(self, name, iterable):
+        if not self.enabled:
+            return iterable
+        return self.iterate_stage(name, iter(iterable))
+
+    def iterate_stage(self, name, iterator):
+        while True:
+            with self.stage(name):
+                item = next(iterator, None)
+            if item is None:
+                return
+            yield item
+
+    def count(self, name, value=1):
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def report(self, cprofile_file=None):
+        lines = ["Stage                 Time (s)  Calls  Peak traced memory (MiB)"]
+        for name, stats in self.stages.items():
+            lines.append(f"{name:<20} {stats['seconds']:>9.3f} {stats['calls']:>6}  {stats['peak_bytes'] / 2**20:>10.1f}")
+        lines.append(f"{'total':<20} {sum(stats['seconds'] for stats in self.stages.values()):>9.3f}")
+        if self.counters:
+            lines.append("Counters:")
+            for name, value in self.counters.items():
+                lines.append(f"  {name}: {value}")
+        if self.cprofile is not None and cprofile_file:
+            self.cprofile.dump_stats(cprofile_file)
+            lines.append(f"cProfile stats of the {self.cprofile_stage} stage written to {cprofile_file}")
+        print("\n".join(lines), file=sys.stderr)
+
+profiler = StageProfiler()
+
+# Reads the definition left to right in a single pass, locating each part by
+# index instead of repeatedly searching and slicing the remaining text
+def parse_definition(defi, valid_words, word, existing_words_info, lower_words=()):
+    open_index = defi.find('[')
+    if open_index == -1 or defi.find('[', open_index + 1) != -1:
+        raise DefinitionError('open-bracket-count', "definition does not have exactly one '[' character: " + defi)
+    close_index = defi.find(']')
+    if close_index == -1 or defi.find(']', close_index + 1) != -1:
+        raise DefinitionError('close-bracket-count', "definition does not have exactly one ']' character: " + defi)
+    if close_index != len(defi) - 1:
+        raise DefinitionError('text-after-pos', "definition does not end with ']' character: " + defi, (close_index + 1, len(defi)))
+
+    head_match = DEFINITION_HEAD_PATTERN.match(defi)
+    root_word, loo = head_match.group(1, 2)
+    word_is_root_word = root_word is None
+    if word_is_root_word:
         root_word = word
-        word_is_root_word = True
-
-    loo_match = re.search(r'^\(([^)]+)\)', defi)
-    if loo_match:
-        loo = loo_match.group(1)
-        # Use +2 to account for the parens 
-        defi = defi[len(loo)+2:].strip()
-
-    pos_and_conj_match = re.search(r'\[([^]]+)\]', defi)
-    if pos_and_conj_match:
-        pos_and_conj = pos_and_conj_match.group(1)
-        split_by_pos = pos_and_conj.split(" ", 1)
-        part_of_speech = split_by_pos[0]
-        if len(split_by_pos) > 1:
-            if not word_is_root_word and word not in ROOT_WORD_EXCEPTIONS:
-                raise ValueError("definition lists conjugations for nonroot word: " + word + ", " + defi)
-            tenses = split_by_pos[1].split(",")
-            tenses = [x.strip() for x in tenses]
-            conjugations = []
-            for tense in tenses:
-                tense_conjs_split = tense.strip().replace("or", " ").split()
-                tense_conjs = []
-                for conj in tense_conjs_split:
-                    conj = conj.strip()
-                    if conj[0] == "(" and conj[-1] == ")":
-                        continue
-                    if not conj.isupper():
-                        raise ValueError("definition contains a conjugation '' that is not uppercase: " + defi)
-                    tense_conjs.append(conj)
-                conjugations.append(tense_conjs)
-        defi = defi[:defi.find('[')].strip()
-    else:
-        raise ValueError("definition does not contain part of speech: " + defi)
-
-    if existing_words_info and word in existing_words_info and existing_words_info[word]['pos'] == part_of_speech and existing_words_info[word]['is_root'] != word_is_root_word:
-        raise ValueError("invalid root status: " + word)
-
-    alt_spellings_match = re.search(r', also ([^[]+)', defi)
-    if alt_spellings_match:
-        alt_spellings_str = alt_spellings_match.group(1)
-        alt_spellings = {x.strip() for x in alt_spellings_str.split(",")}
-        for alt_spelling in alt_spellings:
+    elif word == root_word:
+        raise DefinitionError('own-root-word', f"definition lists word as its own root word: " + defi.strip(), head_match.span(1))
+
+    # The POS block must follow the LOO and cannot be empty
+    text_start = head_match.end()
+    if open_index < text_start or close_index == open_index + 1:
+        raise DefinitionError('missing-pos', "definition does not contain part of speech: " + defi[text_start:])
+
+    conjugations = None
+    part_of_speech, separator, tenses_str = defi[open_index + 1:close_index].partition(" ")
+    if separator:
+        if not word_is_root_word and word not in ROOT_WORD_EXCEPTIONS:
+            raise DefinitionError('nonroot-conjugations', "definition lists conjugations for nonroot word: " + word + ", " + defi[text_start:], (open_index, close_index + 1))
+        conjugations = []
+        for tense in tenses_str.split(","):
+            tense_conjs = []
+            for conj in tense.replace("or", " ").split():
+                if conj[0] == "(" and conj[-1] == ")":
+                    continue
+                if not conj.isupper():
+                    raise DefinitionError('conjugation-case', "definition contains a conjugation '' that is not uppercase: " + defi[text_start:], (open_index, close_index + 1))
+                tense_conjs.append(conj)
+            conjugations.append(tense_conjs)
+
+    if existing_words_info and word in existing_words_info and existing_words_info[word].pos == part_of_speech and existing_words_info[word].is_root != word_is_root_word:
+        raise DefinitionError('root-status', "invalid root status: " + word)
+
+    text = defi[text_start:open_index]
+    text_offset = text_start + len(text) - len(text.lstrip())
+    text = text.strip()
+
+    alt_spellings = set()
+    alt_spellings_index = text.find(', also ')
+    if alt_spellings_index != -1:
+        alt_spellings_span = (text_offset + alt_spellings_index + 7, text_offset + len(text))
+        for alt_spelling in text[alt_spellings_index + 7:].split(","):
+            alt_spelling = alt_spelling.strip()
             if not alt_spelling.isupper():
-                raise ValueError(f"definition contains an alt spelling that is not uppercase: " + defi)
+                raise DefinitionError('alt-spelling-case', f"definition contains an alt spelling that is not uppercase: " + text, alt_spellings_span)
             if alt_spelling not in valid_words:
-                raise ValueError(f"definition contains an alt spelling that is not a valid word: " + defi)
-        defi = defi[:defi.find(', also ')].strip()
+                raise DefinitionError('unknown-alt-spelling', f"definition contains an alt spelling that is not a valid word: " + text, alt_spellings_span)
+            alt_spellings.add(alt_spelling)
+        text = text[:alt_spellings_index].strip()
 
-    def_words = defi.split()
+    # Most tokens are found in the lowercase words without uppercasing them
     misspelled = []
-    for def_word in def_words:
-        if len(def_word) > 1 and len(def_word) <= 15 and def_word.isalpha() and def_word.islower() and def_word.upper() not in valid_words:
+    for def_word in text.split():
+        if len(def_word) > 1 and len(def_word) <= 15 and def_word not in lower_words and def_word.isalpha() and def_word.islower() and def_word.upper() not in valid_words:
             misspelled.append(def_word.upper())
 
     if len(misspelled) > 0:
-        raise ValueError(f"{word.upper()} definition has mispelled word(s): " + ", ".join(misspelled))
+        # The span is the first misspelled word
+        first_misspelled = next(match for match in re.finditer(r'\S+', text) if match.group().upper() == misspelled[0])
+        raise MisspelledWordsError(word, misspelled, (text_offset + first_misspelled.start(), text_offset + first_misspelled.end()))
 
-    return root_word, loo, defi, alt_spellings, part_of_speech, conjugations
+    return ParsedDefinition(root_word, loo, text, alt_spellings, part_of_speech, conjugations)
 
-def create_key(word, pos):
-    return word + KEY_DELIMITER + pos
+# Returns the parsed definition or the code, message and span of its error
+def parse_word_definition(word, defi, valid_words, existing_words_info, lower_words=(), spell_index=None):
+    try:
+        return parse_definition(defi, valid_words, word, existing_words_info, lower_words), None
+    except MisspelledWordsError as e:
+        if spell_index is None:
+            return None, (e.code, str(e), e.span)
+        return None, (e.code, misspelled_words_message(spell_index, e), e.span)
+    except DefinitionError as e:
+        return None, (e.code, str(e), e.span)
 
-def decompose_key(key):
-    return key.split(KEY_DELIMITER)
+def init_parse_worker(valid_words, existing_words_info, lower_words, spell_index_file):
+    global worker_valid_words, worker_existing_words_info, worker_lower_words, worker_spell_index
+    worker_valid_words = valid_words
+    worker_existing_words_info = existing_words_info
+    worker_lower_words = lower_words
+    if spell_index_file:
+        worker_spell_index = open_spell_index(spell_index_file)
+    # The profiler only reports the stages of the main process
+    profiler.disable()
 
-# Function to parse the TSV file
-def parse_tsv(file_path, existing_lexicon):
-    valid_words = set()
+def parse_word_definition_in_worker(word_and_defi):
+    word, defi = word_and_defi
+    return parse_word_definition(word, defi, worker_valid_words, worker_existing_words_info, worker_lower_words, worker_spell_index)
 
-    word_def_lines = []
-    word_def_dict = {}
-    errors = []
+def iter_batches(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
 
-    existing_words_info = None
-    if existing_lexicon:
-        existing_words_info = {}
-        with open(existing_lexicon, 'r') as file:
-            for line in file:
-                word_and_defi = line.split('\t')
-                if len(word_and_defi) != 2:
-                    errors.append("line does not have exactly one tab: " + line)
-                    continue
-                word = word_and_defi[0].strip()
-                all_defis = word_and_defi[1].strip()
-                all_defis_split = all_defis.split(' / ')
-                for defi in all_defis_split:
-                    is_conj = re.search(r'^([A-Z]+),', defi)
-                    word_is_root = is_conj is None
-                    pos_matches = re.findall(r'\[(\w+)', defi)
-                    if len(pos_matches) != 1:
-                        errors.append(f"word {word} does not have exactly one part of speech")
-                        continue
-                    pos = pos_matches[0]
-                    if pos not in VALID_POS:
-                        errors.append(f"word {word} has invalid part of speech: {pos}")
-                        continue
-                    existing_words_info[word.upper()] = {
-                        'is_root': word_is_root,
-                        'pos': pos
-                    }
-
-        if errors:
-            return None, None, None, None, errors
+def parse_batch(pool, word_defis, valid_words, existing_words_info, lower_words, spell_index):
+    profiler.count('definitions parsed', len(word_defis))
+    with profiler.stage('parse'):
+        if pool is None:
+            return [parse_word_definition(word, defi, valid_words, existing_words_info, lower_words, spell_index) for word, defi in word_defis]
+        return pool.map(parse_word_definition_in_worker, word_defis, chunksize=PARSE_CHUNK_SIZE)
+
+# Yields ((word, definition), (parsed, error)) for each (word, definition)
+# pair, in order. The pairs are read and parsed in bounded batches.
+def parse_definitions(word_defis, valid_words, existing_words_info, jobs, spell_index_file=None):
+    lower_words = {word.lower() for word in valid_words}
+    pool = None
+    spell_index = None
+    try:
+        if spell_index_file:
+            with profiler.stage('spell index'):
+                update_spell_index(spell_index_file, valid_words)
+        if jobs > 1:
+            # multiprocessing is only imported when it is used
+            from multiprocessing import Pool
+            pool = Pool(jobs, initializer=init_parse_worker, initargs=(valid_words, existing_words_info, lower_words, spell_index_file))
+        elif spell_index_file:
+            spell_index = open_spell_index(spell_index_file)
+        for batch in iter_batches(word_defis, PARSE_BATCH_SIZE):
+            yield from zip(batch, parse_batch(pool, batch, valid_words, existing_words_info, lower_words, spell_index))
+    finally:
+        if pool is not None:
+            pool.terminate()
+        if spell_index is not None:
+            spell_index.close()
+
+def open_spell_index(index_file):
+    conn = sqlite3.connect(index_file)
+    if conn.execute("PRAGMA user_version").fetchone()[0] != SPELL_INDEX_VERSION:
+        with conn:
+            conn.execute("DROP TABLE IF EXISTS words")
+            conn.execute("DROP TABLE IF EXISTS deletes")
+            conn.execute("CREATE TABLE words (id INTEGER PRIMARY KEY, word TEXT NOT NULL UNIQUE)")
+            conn.execute("CREATE TABLE deletes (key TEXT NOT NULL, word_id INTEGER NOT NULL)")
+            conn.execute(f"PRAGMA user_version = {SPELL_INDEX_VERSION}")
+    return conn
+
+# Returns every string made by deleting up to SPELL_INDEX_MAX_DISTANCE
+# letters from the indexed prefix of a word
+def word_deletes(word):
+    deletes = {word[:SPELL_INDEX_PREFIX_LENGTH]}
+    edits = deletes
+    for _ in range(SPELL_INDEX_MAX_DISTANCE):
+        edits = {edit[:i] + edit[i + 1:] for edit in edits for i in range(len(edit))}
+        deletes |= edits
+    return deletes
+
+# Brings the deletion index in line with the words that definitions can use,
+# only adding and removing the words that changed since the last run
+def update_spell_index(index_file, valid_words):
+    conn = open_spell_index(index_file)
+    try:
+        spell_words = {word for word in valid_words if 1 < len(word) <= 15 and word.isalpha()}
+        indexed_words = dict(conn.execute("SELECT word, id FROM words"))
+        removed_words = [(word, indexed_words[word]) for word in indexed_words.keys() - spell_words]
+        added_words = sorted(spell_words - indexed_words.keys())
+        if not removed_words and not added_words:
+            return
+        next_id = max(indexed_words.values(), default=0) + 1
+        added_ids = list(enumerate(added_words, next_id))
+        with conn:
+            # Building the key index after a bulk insert is much faster than
+            # keeping it up to date during the insert
+            if not indexed_words:
+                conn.execute("DROP INDEX IF EXISTS deletes_key")
+            conn.executemany("DELETE FROM deletes WHERE key = ? AND word_id = ?", ((key, word_id) for word, word_id in removed_words for key in word_deletes(word)))
+            conn.executemany("DELETE FROM words WHERE id = ?", ((word_id,) for _, word_id in removed_words))
+            conn.executemany("INSERT INTO words (id, word) VALUES (?, ?)", added_ids)
+            conn.executemany("INSERT INTO deletes (key, word_id) VALUES (?, ?)", ((key, word_id) for word_id, word in added_ids for key in word_deletes(word)))
+            conn.execute("CREATE INDEX IF NOT EXISTS deletes_key ON deletes (key)")
+    finally:
+        conn.close()
+
+# Returns the optimal string alignment distance between two words, or
+# max_distance + 1 if it is larger than max_distance
+def edit_distance(word, other_word, max_distance):
+    if abs(len(word) - len(other_word)) > max_distance:
+        return max_distance + 1
+    before_previous_row = None
+    previous_row = None
+    row = list(range(len(other_word) + 1))
+    for i in range(1, len(word) + 1):
+        previous_row, row = row, [i] + [0] * len(other_word)
+        for j in range(1, len(other_word) + 1):
+            cost = 0 if word[i - 1] == other_word[j - 1] else 1
+            row[j] = min(previous_row[j] + 1, row[j - 1] + 1, previous_row[j - 1] + cost)
+            if i > 1 and j > 1 and word[i - 1] == other_word[j - 2] and word[i - 2] == other_word[j - 1]:
+                row[j] = min(row[j], before_previous_row[j - 2] + 1)
+        before_previous_row = previous_row
+        if min(row) > max_distance:
+            return max_distance + 1
+    return row[-1]
+
+# Returns the indexed words closest to a misspelled word, nearest and then
+# closest in length first
+def spelling_suggestions(spell_index, misspelled_word):
+    if misspelled_word in spelling_suggestions_cache:
+        return spelling_suggestions_cache[misspelled_word]
+    keys = list(word_deletes(misspelled_word))
+    length_range = [len(misspelled_word) - SPELL_INDEX_MAX_DISTANCE, len(misspelled_word) + SPELL_INDEX_MAX_DISTANCE]
+    candidates = set()
+    for i in range(0, len(keys), CACHE_QUERY_SIZE):
+        chunk = keys[i:i + CACHE_QUERY_SIZE]
+        placeholders = ",".join("?" * len(chunk))
+        candidates.update(row[0] for row in spell_index.execute(f"SELECT words.word FROM deletes JOIN words ON words.id = deletes.word_id WHERE deletes.key IN ({placeholders}) AND length(words.word) BETWEEN ? AND ?", chunk + length_range))
+    ranked = []
+    for candidate in candidates:
+        distance = edit_distance(misspelled_word, candidate, SPELL_INDEX_MAX_DISTANCE)
+        if distance <= SPELL_INDEX_MAX_DISTANCE:
+            ranked.append((distance, abs(len(candidate) - len(misspelled_word)), candidate))
+    ranked.sort()
+    suggestions = [candidate for _, _, candidate in ranked[:MAX_SPELLING_SUGGESTIONS]]
+    spelling_suggestions_cache[misspelled_word] = suggestions
+    return suggestions
+
+def misspelled_words_message(spell_index, error):
+    described = []
+    for misspelled_word in error.misspelled:
+        suggestions = spelling_suggestions(spell_index, misspelled_word)
+        if suggestions:
+            described.append(f"{misspelled_word} (did you mean {' or '.join(suggestions)}?)")
+        else:
+            described.append(misspelled_word)
+    return f"{error.word.upper()} definition has mispelled word(s): " + ", ".join(described)
 
+# Yields the word and definitions of every well formed line of a lexicon
+# file, reporting each malformed line if a reporter is given
+def read_lexicon_lines(file_path, reporter=None):
+    for _, word, all_defis, _ in read_numbered_lexicon_lines(file_path, reporter):
+        yield word, all_defis
+
+# Yields the line number, word, definitions and start of the definitions on
+# the line of every well formed line of a lexicon file, reporting each
+# malformed line if a reporter is given
+def read_numbered_lexicon_lines(file_path, reporter=None):
     with open(file_path, 'r') as file:
-        for line in file:
-            word_and_all_defis = line.split('\t')
-            if len(word_and_all_defis) != 2:
-                errors.append("line does not have exactly one tab: " + line)
-                continue
-            word = word_and_all_defis[0].strip()
-            all_defis = word_and_all_defis[1].strip()
-            if word == '':
-                errors.append("word is empty: " + line)
-                continue
-            if all_defis == '':
-                errors.append("definition is empty: " + line)
-                continue
-            if not word.isupper():
-                errors.append("word is not uppercase: " + line)
+        yield from numbered_lexicon_lines(enumerate(file, 1), reporter)
+
+# Does the same for (line number, line) pairs
+def numbered_lexicon_lines(numbered_lines, reporter=None):
+    for line_number, line in numbered_lines:
+        word_and_all_defis = line.split('\t')
+        if len(word_and_all_defis) != 2:
+            if reporter is not None:
+                report_line_error(reporter, line_number, None, 'tab-count', "line does not have exactly one tab: ", line)
+            continue
+        word = word_and_all_defis[0].strip()
+        all_defis = word_and_all_defis[1].strip()
+        if word == '':
+            if reporter is not None:
+                report_line_error(reporter, line_number, None, 'empty-word', "word is empty: ", line)
+            continue
+        if all_defis == '':
+            if reporter is not None:
+                report_line_error(reporter, line_number, word, 'empty-definition', "definition is empty: ", line)
+            continue
+        if not word.isupper():
+            if reporter is not None:
+                report_line_error(reporter, line_number, word, 'word-case', "word is not uppercase: ", line)
+            continue
+        defis_start = line.index(all_defis, len(word_and_all_defis[0]) + 1)
+        yield line_number, sys.intern(word), all_defis, defis_start
+
+def report_line_error(reporter, line_number, word, code, message, line):
+    line = line.rstrip('\n')
+    reporter.report(Diagnostic(line_number, word, code, message + line, (0, len(line))))
+
+def read_existing_lexicon(existing_lexicon, reporter):
+    existing_words_info = {}
+    with open(existing_lexicon, 'r') as file:
+        for line_number, line in enumerate(file, 1):
+            word_and_defi = line.split('\t')
+            if len(word_and_defi) != 2:
+                reporter.report(Diagnostic(line_number, None, 'existing-tab-count', f"{existing_lexicon}: line does not have exactly one tab: " + line.rstrip('\n'), None))
                 continue
+            word = word_and_defi[0].strip()
+            all_defis = word_and_defi[1].strip()
+            all_defis_split = all_defis.split(' / ')
+            for defi in all_defis_split:
+                is_conj = re.search(r'^([A-Z]+),', defi)
+                word_is_root = is_conj is None
+                pos_matches = re.findall(r'\[(\w+)', defi)
+                if len(pos_matches) != 1:
+                    reporter.report(Diagnostic(line_number, None, 'existing-pos-count', f"{existing_lexicon}: word {word} does not have exactly one part of speech", None))
+                    continue
+                pos = pos_matches[0]
+                if pos not in VALID_POS:
+                    reporter.report(Diagnostic(line_number, None, 'existing-invalid-pos', f"{existing_lexicon}: word {word} has invalid part of speech: {pos}", None))
+                    continue
+                existing_words_info[sys.intern(word.upper())] = ExistingWordInfo(word_is_root, sys.intern(pos))
+    return existing_words_info
+
+# Function to parse the TSV file. Every error is sent to the reporter as it
+# is found and the checks keep going after errors, so that one run finds
+# every kind of error. Without a reporter the error messages are returned.
+def parse_tsv(file_path, existing_lexicon, jobs=1, spell_index_file=None, reporter=None):
+    if reporter is None:
+        reporter = DiagnosticReporter(keep=True)
+    start_error_count = reporter.error_count
+
+    existing_words_info = None
+    if existing_lexicon:
+        with profiler.stage('read existing'):
+            existing_words_info = read_existing_lexicon(existing_lexicon, reporter)
 
-            valid_words.add(word)
-            word_def_lines.append((word, all_defis))
-            word_def_dict[word] = all_defis
+    # The first pass only collects the valid words since every definition is
+    # checked against all of them. The second pass streams the definitions.
+    with profiler.stage('read lexicon'):
+        valid_words = {word for word, _ in read_lexicon_lines(file_path, reporter)}
+    profiler.count('words', len(valid_words))
 
-    parsed_definitions = []
+    # The line number and start on the line of each definition, in the order
+    # the definitions are parsed
+    positions = deque()
+    def word_defis():
+        for line_number, word, all_defis, defi_start in read_numbered_lexicon_lines(file_path):
+            for defi in all_defis.split(' / '):
+                positions.append((line_number, defi_start))
+                defi_start += len(defi) + 3
+                yield word, defi
 
-    for word, all_defis in word_def_lines:
-        all_defis_split = all_defis.split(' / ')
-        for defi in all_defis_split:
-            try:
-                root_word, loo, defi, alt_spellings, part_of_speech, conjugations = parse_definition(defi, valid_words, word, existing_words_info)
-                parsed_definitions.append([root_word, loo, defi, alt_spellings, part_of_speech, conjugations, word])
-            except ValueError as e:
-                errors.append(str(e))
+    definitions = parse_definitions(profiler.iterate('read lexicon', word_defis()), valid_words, existing_words_info, jobs, spell_index_file)
+    def parsed_definitions():
+        for (word, defi), (parsed, error) in definitions:
+            line_number, defi_start = positions.popleft()
+            if error:
+                code, message, span = error
+                if span is None:
+                    span = (0, len(defi))
+                reporter.report(Diagnostic(line_number, word, code, message, (defi_start + span[0], defi_start + span[1])))
                 continue
+            yield [*parsed, word]
 
-    if errors:
-        return None, None, None, None, errors
+    try:
+        with profiler.stage('build model'):
+            # Words with errors are left out of the model checks, which would
+            # only report the same problem again
+            parsed_tsv, adj_list, reserved_nodes, model_errors = build_model(parsed_definitions(), reporter.failed_words)
+    finally:
+        definitions.close()
+    if model_errors:
+        word_lines = find_word_lines(file_path, {diagnostic.word for diagnostic in model_errors})
+        for diagnostic in model_errors:
+            reporter.report(diagnostic._replace(line=word_lines.get(diagnostic.word), span=(0, len(diagnostic.word))))
 
+    if reporter.error_count > start_error_count:
+        return None, None, None, [diagnostic.message for diagnostic in reporter.diagnostics or []]
+    return parsed_tsv, adj_list, reserved_nodes, []
+
+# Returns the first line number of each of the given words
+def find_word_lines(file_path, words):
+    word_lines = {}
+    for line_number, word, _, _ in read_numbered_lexicon_lines(file_path):
+        if word in words and word not in word_lines:
+            word_lines[word] = line_number
+    return word_lines
+
+# Builds the entry of a parsed definition. Conjugations that are the word
+# followed by ED, ING and S (or ES) are shortened to -ED, -ING and -S in place.
+def make_entry(root_word, loo, def_text, alt_spellings, pos, conjugations, word):
+    root_word = sys.intern(root_word)
+    pos = sys.intern(pos)
+    if loo:
+        loo = sys.intern(loo)
+    if alt_spellings:
+        alt_spellings = {sys.intern(x) for x in alt_spellings}
+
+    conjugations_exp = None
+    if conjugations:
+        conjugations_exp = tuple(tense.replace('-', word) for tenses in conjugations for tense in tenses)
+        total_conjs = len(conjugations_exp)
+        if len(conjugations) == 3 and total_conjs == 3:
+            wl = len(word)
+            abrev_conjs = set()
+            for tense in conjugations:
+                if len(tense[0]) <= wl or tense[0][:wl] != word:
+                    break
+                abrev_conjs.add(tense[0][wl:])
+            if abrev_conjs == {'ED', 'ING', 'S'} or abrev_conjs == {'ED', 'ING', 'ES'}:
+                for tense in conjugations:
+                    tense[0] = '-' + tense[0][wl:]
+
+    return Entry(root_word, loo, def_text, alt_spellings, pos, conjugations, conjugations_exp, None)
+
+# Builds the entries of every word and the alt spelling graph from the parsed
+# definitions and checks the root words and conjugations of every entry.
+# With lexicon_words the inflections are checked against those words instead
+# of the words of parsed_definitions, so that a subset of the root words can
+# be checked on its own. With error_keys the word and entry position each
+# error is sorted by are appended to it, the root word and the position of
+# its entry for the errors of missing conjugations.
+def build_model(parsed_definitions, skip_words=(), lexicon_words=None, error_keys=None):
+    errors = []
     parsed_tsv = {}
-    root_def_to_entry = {}
-    num_word_pos = {}
-    adj_list = {}
+    node_ids = {}
+    adj_list = []
+    # Definition texts are numbered so that the derivation checks compare
+    # integers instead of hashing long strings again
+    def_ids = {}
+    # (root word, definition ID) -> inflections listed by the last entry of
+    # the root word itself with that definition
+    derivations = {}
+    # (root word, definition ID) -> the words with entries derived from it
+    derived_words = {}
+    # (root word, definition ID) -> the position of its first entry
+    derivation_positions = {}
     for root_word, loo, def_text, alt_spellings, pos, conjugations, word in parsed_definitions:
-        conjugations_exp = None
-        if conjugations:
-            conjugations_exp = set()
-            total_conjs = 0
-            for tenses in conjugations:
-                for tense in tenses:
-                    conjugations_exp.add(tense.replace('-', word))
-                    total_conjs += 1
-            if len(conjugations) == 3 and total_conjs == 3:
-                wl = len(word)
-                abrev_conjs = set()
-                for tense in conjugations:
-                    if len(tense[0]) <= wl or tense[0][:wl] != word:
-                        break
-                    abrev_conjs.add(tense[0][wl:])
-                if abrev_conjs == {'ED', 'ING', 'S'} or abrev_conjs == {'ED', 'ING', 'ES'}:
-                    for tense in conjugations:
-                        tense[0] = '-' + tense[0][wl:]
-
-        entry = {
-            'root': root_word,
-            'loo': loo,
-            'def': def_text,
-            'alts': alt_spellings,
-            'pos': pos,
-            'conjs': conjugations,
-            'conjs_exp': conjugations_exp,
-        }
+        entry = make_entry(root_word, loo, def_text, alt_spellings, pos, conjugations, word)
+        root_word, alt_spellings, pos = entry.root, entry.alts, entry.pos
+
+        root_pos_key = (root_word, pos)
+        node_id = node_ids.get(root_pos_key)
+        if node_id is None:
+            node_id = len(adj_list)
+            node_ids[root_pos_key] = node_id
+            adj_list.append(AltSpellingNode(root_word, pos, def_text, node_id))
+        node = adj_list[node_id]
+        if alt_spellings:
+            if node.neighbors is None:
+                node.neighbors = set()
+            node.neighbors.update(alt_spellings)
+
+        def_id = def_ids.get(def_text)
+        if def_id is None:
+            def_id = len(def_ids)
+            def_ids[def_text] = def_id
+
+        entry.node = node_id
         if word not in parsed_tsv:
             parsed_tsv[word] = []
         parsed_tsv[word].append(entry)
+        if word == root_word:
+            if error_keys is not None and (root_word, def_id) not in derivations:
+                derivation_positions[(root_word, def_id)] = len(parsed_tsv[word]) - 1
+            derivations[(root_word, def_id)] = entry.conjs_exp or ()
+        elif word not in ROOT_WORD_EXCEPTIONS:
+            derivation_key = (root_word, def_id)
+            if derivation_key not in derived_words:
+                derived_words[derivation_key] = []
+            derived_words[derivation_key].append(word)
 
-        word_pos_key = create_key(word, pos)
-        if word_pos_key not in num_word_pos:
-            num_word_pos[word_pos_key] = 0
-        num_word_pos[word_pos_key] += 1
-        root_pos_key = create_key(root_word, pos)
-        if root_pos_key not in adj_list:
-            adj_list[root_pos_key] = {
-                'root': root_word,
-                'def': def_text,
-                'neighbors': set(),
-                'vis': False,
-            }
-        adj_list[root_pos_key]['neighbors'] = adj_list[root_pos_key]['neighbors'].union([create_key(x, pos) for x in alt_spellings])
-        if root_word == word:
-            root_def_key = create_key(root_word, def_text)
-            root_def_to_entry[root_def_key] = entry
-
-    multiple_identical_word_pos = {key for key, value in num_word_pos.items() if value > 1}
     reserved_nodes = set()
 
+    for word, entries in parsed_tsv.items():
+        repeated_pos = set()
+        if len(entries) > 1:
+            seen_pos = set()
+            for entry in entries:
+                if entry.pos in seen_pos:
+                    repeated_pos.add(entry.pos)
+                seen_pos.add(entry.pos)
+        for entry in entries:
+            if entry.pos in repeated_pos:
+                reserved_nodes.add(entry.node)
+
+    # Each group of derived words is checked against the inflections of its
+    # root definition with a single set difference
+    failed_derivations = {}
+    for derivation_key, words in derived_words.items():
+        if derivation_key[0] in skip_words:
+            continue
+        inflections = derivations.get(derivation_key)
+        if inflections is None:
+            failed_derivations[derivation_key] = (set(words).difference(skip_words), 'root-definition-not-found', "Root word definition not found: {word}")
+            continue
+        missing_words = set(words).difference(inflections, skip_words)
+        if missing_words:
+            failed_derivations[derivation_key] = (missing_words, 'missing-conjugation', derivation_key[0] + " has missing conjugation(s): {word}")
+    del derived_words
+
+    # Report one error for every failed entry in the order of the words and
+    # their entries
+    entry_errors = []
+    for derivation_key, (words, code, message) in failed_derivations.items():
+        for word in words:
+            for position, entry in enumerate(parsed_tsv[word]):
+                if (entry.root, def_ids[entry.defi]) == derivation_key:
+                    entry_errors.append((word, position, Diagnostic(None, word, code, message.format(word=word), None)))
+    if entry_errors:
+        word_order = {word: i for i, word in enumerate(parsed_tsv)}
+        entry_errors.sort(key=lambda x: (word_order[x[0]], x[1]))
+        errors.extend(error for _, _, error in entry_errors)
+        if error_keys is not None:
+            error_keys.extend((word, position) for word, position, _ in entry_errors)
+    del def_ids
+
+    # Every inflection a root word lists must be in the lexicon
+    if lexicon_words is None:
+        lexicon_words = parsed_tsv
+    missing_inflections = {}
+    missing_positions = {}
+    for derivation_key, inflections in derivations.items():
+        root_word = derivation_key[0]
+        for inflection in inflections:
+            if inflection not in lexicon_words and inflection not in skip_words:
+                if root_word not in missing_inflections:
+                    missing_inflections[root_word] = set()
+                    missing_positions[root_word] = derivation_positions.get(derivation_key)
+                missing_inflections[root_word].add(inflection)
+    for root_word, inflections in missing_inflections.items():
+        errors.append(Diagnostic(None, root_word, 'conjugation-not-in-lexicon', f"{root_word} has conjugation(s) missing from the lexicon: {', '.join(sorted(inflections))}", None))
+        if error_keys is not None:
+            error_keys.append((root_word, missing_positions[root_word]))
+    del derivations
+
+    if errors:
+        return None, None, None, errors
+
+    # Replace the alt spellings of each node with the IDs of the nodes that
+    # exist for them, dropping dead end neighbors
+    for node in adj_list:
+        if node.neighbors:
+            node.neighbors = {node_ids[(x, node.pos)] for x in node.neighbors if (x, node.pos) in node_ids}
+
+    # Make the graph undirected and join the alt spelling groups of each edge
+    for node_id, node in enumerate(adj_list):
+        if not node.neighbors:
+            continue
+        for neighbor_id in list(node.neighbors):
+            neighbor = adj_list[neighbor_id]
+            if neighbor.neighbors is None:
+                neighbor.neighbors = set()
+            neighbor.neighbors.add(node_id)
+            union_groups(adj_list, node_id, neighbor_id)
+
+    if profiler.enabled:
+        profiler.count('alt spelling nodes', len(adj_list))
+        profiler.count('alt spelling edges', sum(len(node.neighbors) for node in adj_list if node.neighbors) // 2)
+
+    return parsed_tsv, adj_list, reserved_nodes, []
+
+# Returns the ID of the node representing the alt spelling group of the
+# given node, halving the path to it along the way
+def find_group(adj_list, node_id):
+    node = adj_list[node_id]
+    while node.parent != node_id:
+        node.parent = adj_list[node.parent].parent
+        node_id = node.parent
+        node = adj_list[node_id]
+    return node_id
+
+def union_groups(adj_list, node_id, other_node_id):
+    group_id = find_group(adj_list, node_id)
+    other_group_id = find_group(adj_list, other_node_id)
+    if group_id != other_group_id:
+        adj_list[other_group_id].parent = group_id
+
+# Each strategy scores the definitions of the members of a group and the
+# definition with the highest score becomes the definition of the group. On
+# a tie the definition of the earliest member wins.
+def score_by_length(nodes, existing_words):
+    scores = Counter()
+    for node in nodes:
+        scores[node.defi] += len(node.defi)
+    return scores
+
+def score_by_frequency(nodes, existing_words):
+    return Counter(node.defi for node in nodes)
+
+# Prefers the definitions of the members that are in the existing lexicon and
+# then the longer definitions
+def score_by_existing(nodes, existing_words):
+    existing_scores = Counter()
+    for node in nodes:
+        if node.root in existing_words:
+            existing_scores[node.defi] += len(node.defi)
+    length_scores = score_by_length(nodes, existing_words)
+    return {defi: (existing_scores[defi], score) for defi, score in length_scores.items()}
+
+PLURALITY_STRATEGIES = {
+    'length': score_by_length,
+    'frequency': score_by_frequency,
+    'existing': score_by_existing,
+}
+
+def complete_group(nodes, score, existing_words):
+    if len(nodes) == 1:
+        return AltSpellingGroup(nodes[0].defi, [nodes[0].root])
+    def_scores = score(nodes, existing_words)
+    return AltSpellingGroup(max(def_scores, key=def_scores.get), sorted(node.root for node in nodes))
+
+# Returns every node in a group with a reserved node and a list with the
+# AltSpellingGroup of every other node by node ID
+def group_alt_spellings(adj_list, start_reserved_nodes, strategy='length', existing_words=()):
+    reserved_groups = {find_group(adj_list, node_id) for node_id in start_reserved_nodes}
+    reserved_nodes = start_reserved_nodes.copy()
+    groups = {}
+    for node_id in range(len(adj_list)):
+        group_id = find_group(adj_list, node_id)
+        if group_id in reserved_groups:
+            reserved_nodes.add(node_id)
+            continue
+        if group_id not in groups:
+            groups[group_id] = []
+        groups[group_id].append(node_id)
+
+    score = PLURALITY_STRATEGIES[strategy]
+    completed_groups = [None] * len(adj_list)
+    for group_node_ids in groups.values():
+        completed_group = complete_group([adj_list[node_id] for node_id in group_node_ids], score, existing_words)
+        for node_id in group_node_ids:
+            completed_groups[node_id] = completed_group
+
+    profiler.count('alt spelling groups', len(groups))
+    profiler.count('reserved alt spelling groups', len(reserved_groups))
+    return reserved_nodes, completed_groups
+
+# Without need_model only the errors are checked and None, None is returned
+def validate(input_lexicon, existing_lexicon, jobs=1, cache_file=None, spell_index_file=None, reporter=None, strategy='length', need_model=True):
+    if reporter is None:
+        reporter = DiagnosticReporter(sys.stdout)
+    try:
+        if cache_file:
+            parsed_tsv, adj_list, start_reserved_nodes, _ = parse_tsv_with_cache(input_lexicon, existing_lexicon, cache_file, jobs, spell_index_file, reporter, need_model)
+        else:
+            parsed_tsv, adj_list, start_reserved_nodes, _ = parse_tsv(input_lexicon, existing_lexicon, jobs, spell_index_file, reporter)
+    except TooManyErrors as e:
+        print(e, file=sys.stderr)
+
+    if reporter.error_count:
+        profiler.count('errors', reporter.error_count)
+        exit(1)
+    if parsed_tsv is None:
+        return None, None
+
+    existing_words = ()
+    if strategy == 'existing' and existing_lexicon:
+        # The errors of the existing lexicon were already reported
+        existing_words = read_existing_lexicon(existing_lexicon, DiagnosticReporter()).keys()
+    with profiler.stage('group'):
+        reserved_words = apply_alt_spelling_groups(parsed_tsv, adj_list, start_reserved_nodes, strategy, existing_words)
+    return parsed_tsv, reserved_words
+
+# Gives every entry outside of a reserved group the plurality definition and
+# alt spellings of its group and returns the reserved words
+def apply_alt_spelling_groups(parsed_tsv, adj_list, start_reserved_nodes, strategy='length', existing_words=()):
+    reserved_nodes, completed_groups = group_alt_spellings(adj_list, start_reserved_nodes, strategy, existing_words)
+
+    reserved_words = {adj_list[node_id].root for node_id in reserved_nodes}
+
     for word in parsed_tsv:
         for entry in parsed_tsv[word]:
-            word_pos_key = create_key(word, entry['pos'])
-            root_word = entry['root']
-            if word_pos_key in multiple_identical_word_pos:
-                reserved_nodes.add(create_key(root_word, entry['pos']))
-            root_def_key = create_key(root_word, entry['def'])
-            if root_def_key not in root_def_to_entry and word not in ROOT_WORD_EXCEPTIONS:
-                errors.append("Root word definition not found: " + word)
+            if entry.node in reserved_nodes:
+                continue
+            completed_group = completed_groups[entry.node]
+            root = entry.root
+            entry.alts = [x for x in completed_group.alts if x != root]
+            entry.defi = completed_group.pdef
+
+    return reserved_words
+
+# Keeps the parse of every definition and the model errors of every root word
+# in memory, so that when the lexicon changes only the changed definitions
+# are parsed again and only the root words whose entries or listed
+# conjugations changed are checked again
+class LexiconWatcher:
+    def __init__(self, file_path, existing_lexicon, jobs=1, spell_index_file=None):
+        self.file_path = file_path
+        self.existing_lexicon = existing_lexicon
+        self.jobs = jobs
+        self.spell_index_file = spell_index_file
+        self.existing_words_info = None
+        self.existing_diagnostics = []
+        self.reset()
+
+    def reset(self):
+        # line -> (word, definitions, start of the definitions, line error)
+        self.line_fields = {}
+        self.line_counts = Counter()
+        # word -> the definitions of each of its lines
+        self.word_lines = {}
+        self.valid_words = set()
+        # (word, definition) -> (parsed, error)
+        self.parses = {}
+        # word -> the parsed definitions of its entries
+        self.word_entries = {}
+        self.failed_words = set()
+        self.lexicon_words = set()
+        # root word -> {word: the parsed definitions of its entries with that root}
+        self.root_entries = {}
+        # inflection -> the root words that list it
+        self.inflection_roots = {}
+        self.word_inflections = {}
+        self.root_chunks = {}
+        self.chunks = {}
+        self.next_chunk_id = 0
+        self.diagnostics = {}
+        # The fields of each line in file order and the words whose entries
+        # may have changed in the last update
+        self.lexicon_lines = []
+        self.changed_words = set()
+
+    # Reads the files again and returns the diagnostics that are new and the
+    # ones that were cleared since the last update
+    def update(self, existing_changed=False):
+        if self.existing_lexicon and (existing_changed or self.existing_words_info is None):
+            existing_reporter = DiagnosticReporter(keep=True)
+            self.existing_words_info = read_existing_lexicon(self.existing_lexicon, existing_reporter)
+            self.existing_diagnostics = existing_reporter.diagnostics
+            # Every parse depends on the existing lexicon
+            self.reset()
+
+        with open(self.file_path, 'r') as file:
+            lines = file.readlines()
+        line_counts = Counter(lines)
+        # Only the lines that were added or removed are split again
+        changed_words = set()
+        for line, count in line_counts.items():
+            if self.line_counts.get(line) != count:
+                if line not in self.line_fields:
+                    line_reporter = DiagnosticReporter(keep=True)
+                    fields = next(numbered_lexicon_lines([(None, line)], line_reporter), None)
+                    if fields is None:
+                        self.line_fields[line] = (None, None, None, line_reporter.diagnostics[0])
+                    else:
+                        self.line_fields[line] = (fields[1], fields[2], fields[3], None)
+                changed_words.add(self.line_fields[line][0])
+        for line in self.line_counts:
+            if line not in line_counts:
+                changed_words.add(self.line_fields.pop(line)[0])
+        changed_words.discard(None)
+        self.line_counts = line_counts
+
+        line_fields = [self.line_fields[line] for line in lines]
+        for word in changed_words:
+            self.word_lines.pop(word, None)
+        for word, all_defis, _, _ in line_fields:
+            if word in changed_words:
+                if word not in self.word_lines:
+                    self.word_lines[word] = []
+                self.word_lines[word].append(all_defis)
+        removed_words = {word for word in changed_words if word not in self.word_lines and word in self.valid_words}
+        added_words = {word for word in changed_words if word in self.word_lines and word not in self.valid_words}
+        self.valid_words.difference_update(removed_words)
+        self.valid_words.update(added_words)
+
+        # A definition that uses a removed word as an alt spelling or in its
+        # text has to be parsed again, whether or not it failed, and an added
+        # word can fix a definition that failed
+        if removed_words or added_words:
+            removed_texts = [x for word in removed_words for x in (word, word.lower())]
+            for key, (_, error) in list(self.parses.items()):
+                stale = any(x in key[1] for x in removed_texts)
+                if error is not None and added_words:
+                    stale = True
+                if stale:
+                    del self.parses[key]
+                    changed_words.add(key[0])
+
+        word_defis = []
+        for word in changed_words:
+            for all_defis in self.word_lines.get(word, ()):
+                for defi in all_defis.split(' / '):
+                    if (word, defi) not in self.parses:
+                        word_defis.append((word, defi))
+        jobs = self.jobs if len(word_defis) > PARSE_CHUNK_SIZE else 1
+        with profiler.stage('watch parse'):
+            for key, result in parse_definitions(iter(dict.fromkeys(word_defis)), self.valid_words, self.existing_words_info, jobs, self.spell_index_file):
+                self.parses[key] = result
+        profiler.count('watch parsed definitions', len(word_defis))
+
+        affected_roots = set()
+        for word in changed_words:
+            affected_roots.update(self.update_word(word))
+
+        with profiler.stage('watch check'):
+            model_diagnostics = self.check_roots(affected_roots)
+        profiler.count('watch checked root words', len(affected_roots))
+
+        # Only the lines of the words with errors are looked at again. Model
+        # errors point at the first line of their word.
+        model_words = {diagnostic.word for diagnostic in model_diagnostics}
+        first_lines = {}
+        diagnostics = list(self.existing_diagnostics)
+        for line_number, (word, all_defis, defi_start, line_error) in enumerate(line_fields, 1):
+            if line_error is not None:
+                diagnostics.append(line_error._replace(line=line_number))
                 continue
-            if word not in ROOT_WORD_EXCEPTIONS:
-                root_entry = root_def_to_entry[root_def_key]
-                if word != root_word and (root_entry['conjs_exp'] is None or word not in root_entry['conjs_exp']):
-                    errors.append(f"{root_word} has missing conjugation(s): {word}")
+            if word in model_words and word not in first_lines:
+                first_lines[word] = line_number
+            if word not in self.failed_words:
+                continue
+            for defi in all_defis.split(' / '):
+                error = self.parses[(word, defi)][1]
+                if error:
+                    code, message, span = error
+                    if span is None:
+                        span = (0, len(defi))
+                    diagnostics.append(Diagnostic(line_number, word, code, message, (defi_start + span[0], defi_start + span[1])))
+                defi_start += len(defi) + 3
+        for diagnostic in model_diagnostics:
+            diagnostics.append(diagnostic._replace(line=first_lines.get(diagnostic.word), span=(0, len(diagnostic.word))))
+
+        current = {}
+        for diagnostic in diagnostics:
+            key = (diagnostic.word, diagnostic.code, diagnostic.message)
+            if key not in current:
+                current[key] = diagnostic
+        new = [diagnostic for key, diagnostic in current.items() if key not in self.diagnostics]
+        cleared = [diagnostic for key, diagnostic in self.diagnostics.items() if key not in current]
+        self.diagnostics = current
+        self.lexicon_lines = line_fields
+        self.changed_words = changed_words
+        return new, cleared
+
+    # Updates the entries of a word and returns the root words whose checks
+    # depend on it
+    def update_word(self, word):
+        entries = []
+        failed = False
+        for all_defis in self.word_lines.get(word, ()):
+            for defi in all_defis.split(' / '):
+                parsed, error = self.parses[(word, defi)]
+                if error:
+                    failed = True
+                else:
+                    entries.append(parsed)
+        # The roots that list the word check whether it is in the lexicon
+        affected_roots = {word, *self.inflection_roots.get(word, ())}
+        for root in {parsed[0] for parsed in self.word_entries.get(word, ())}:
+            affected_roots.add(root)
+            del self.root_entries[root][word]
+        for inflection in self.word_inflections.pop(word, ()):
+            self.inflection_roots[inflection].discard(word)
+
+        if entries:
+            self.word_entries[word] = entries
+            self.lexicon_words.add(word)
+        else:
+            self.word_entries.pop(word, None)
+            self.lexicon_words.discard(word)
+        if failed:
+            self.failed_words.add(word)
+        else:
+            self.failed_words.discard(word)
+
+        inflections = set()
+        for parsed in entries:
+            root = parsed[0]
+            affected_roots.add(root)
+            if root not in self.root_entries:
+                self.root_entries[root] = {}
+            if word not in self.root_entries[root]:
+                self.root_entries[root][word] = []
+            self.root_entries[root][word].append(parsed)
+            if root == word and parsed[5]:
+                inflections.update(conj.replace('-', word) for tenses in parsed[5] for conj in tenses)
+        if inflections:
+            self.word_inflections[word] = inflections
+            for inflection in inflections:
+                if inflection not in self.inflection_roots:
+                    self.inflection_roots[inflection] = set()
+                self.inflection_roots[inflection].add(word)
+        return affected_roots
+
+    # Checks the root words of every chunk with an affected root word again
+    # and returns the model errors of all root words
+    def check_roots(self, affected_roots):
+        roots = set(affected_roots)
+        for root in affected_roots:
+            chunk_id = self.root_chunks.get(root)
+            if chunk_id is not None and chunk_id in self.chunks:
+                roots.update(self.chunks.pop(chunk_id)[0])
+        roots = sorted(roots)
+        for i in range(0, len(roots), ROOT_CHUNK_SIZE):
+            chunk_roots = roots[i:i + ROOT_CHUNK_SIZE]
+            entries = [[*parsed, word] for root in chunk_roots for word, parsed_entries in self.root_entries.get(root, {}).items() for parsed in parsed_entries]
+            _, _, _, errors = build_model(entries, self.failed_words, self.lexicon_words)
+            chunk_id = self.next_chunk_id
+            self.next_chunk_id += 1
+            self.chunks[chunk_id] = (chunk_roots, errors)
+            for root in chunk_roots:
+                self.root_chunks[root] = chunk_id
+        return [diagnostic for _, errors in self.chunks.values() for diagnostic in errors]
+
+def watched_files_stamp(file_path, existing_lexicon):
+    stamp = [os.stat(file_path).st_mtime_ns, os.stat(file_path).st_size]
+    if existing_lexicon:
+        stamp.append(os.stat(existing_lexicon).st_mtime_ns)
+    return tuple(stamp)
+
+# Validates the lexicon whenever it or the existing lexicon changes and
+# reports the errors that are new and the ones that were fixed
+def watch(input_lexicon, existing_lexicon, reporter, jobs=1, spell_index_file=None, interval=WATCH_INTERVAL_SECONDS):
+    watcher = LexiconWatcher(input_lexicon, existing_lexicon, jobs, spell_index_file)
+    stamp = None
+    try:
+        while True:
+            try:
+                new_stamp = watched_files_stamp(input_lexicon, existing_lexicon)
+            except OSError:
+                time.sleep(interval)
+                continue
+            if new_stamp != stamp:
+                existing_changed = stamp is not None and new_stamp[2:] != stamp[2:]
+                first = stamp is None
+                stamp = new_stamp
+                start = time.perf_counter()
+                try:
+                    new, cleared = watcher.update(existing_changed)
+                except (OSError, UnicodeDecodeError) as e:
+                    print(e, file=sys.stderr)
                     continue
+                for diagnostic in new:
+                    reporter.write(diagnostic)
+                for diagnostic in cleared:
+                    reporter.write(diagnostic, cleared=True)
+                summary = f"{len(watcher.diagnostics)} errors in {input_lexicon}"
+                if not first:
+                    summary += f", {len(new)} new and {len(cleared)} cleared"
+                print(f"{time.strftime('%H:%M:%S')} {summary} ({time.perf_counter() - start:.2f}s), watching for changes", file=sys.stderr)
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
 
-    if errors:
-        return None, None, None, None, errors
+def open_validation_cache(cache_file):
+    conn = sqlite3.connect(cache_file)
+    if conn.execute("PRAGMA user_version").fetchone()[0] != VALIDATION_CACHE_VERSION:
+        with conn:
+            for table, in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'").fetchall():
+                conn.execute(f"DROP TABLE {table}")
+            conn.execute(f"PRAGMA user_version = {VALIDATION_CACHE_VERSION}")
+    conn.execute("CREATE TABLE IF NOT EXISTS state (name TEXT PRIMARY KEY, value BLOB NOT NULL) WITHOUT ROWID")
+    conn.execute("CREATE TABLE IF NOT EXISTS existing_words (word TEXT PRIMARY KEY, is_root INTEGER NOT NULL, pos TEXT NOT NULL) WITHOUT ROWID")
+    # One row for every definition of every word, in the order of the file
+    conn.execute("CREATE TABLE IF NOT EXISTS entries (word TEXT NOT NULL, position INTEGER NOT NULL, definition TEXT NOT NULL, root TEXT, parsed BLOB, error BLOB, PRIMARY KEY (word, position)) WITHOUT ROWID")
+    conn.execute("CREATE INDEX IF NOT EXISTS entries_root ON entries (root)")
+    conn.execute("CREATE INDEX IF NOT EXISTS entries_error ON entries (word) WHERE error IS NOT NULL")
+    # The inflections each root word lists for itself
+    conn.execute("CREATE TABLE IF NOT EXISTS inflections (inflection TEXT NOT NULL, root TEXT NOT NULL, PRIMARY KEY (inflection, root)) WITHOUT ROWID")
+    conn.execute("CREATE INDEX IF NOT EXISTS inflections_root ON inflections (root)")
+    conn.execute("CREATE TABLE IF NOT EXISTS root_chunks (root TEXT PRIMARY KEY, chunk INTEGER NOT NULL) WITHOUT ROWID")
+    conn.execute("CREATE TABLE IF NOT EXISTS chunks (chunk INTEGER PRIMARY KEY, roots BLOB NOT NULL, errors BLOB NOT NULL)")
+    return conn
+
+# Runs a query that has {} in place of the placeholders of an IN list,
+# CACHE_QUERY_SIZE values at a time
+def select_in(conn, query, values):
+    values = list(values)
+    for i in range(0, len(values), CACHE_QUERY_SIZE):
+        query_values = values[i:i + CACHE_QUERY_SIZE]
+        yield from conn.execute(query.format(", ".join("?" * len(query_values))), query_values)
+
+# Parses are stored with marshal, which loads the strings, set and lists of a
+# parse several times faster than json
+def encode_parsed_definition(parsed):
+    return marshal.dumps(tuple(parsed))
+
+def decode_parsed_definition(encoded):
+    return ParsedDefinition._make(marshal.loads(encoded))
 
-    # Make the graph undirected and remove dead end neighbors
-    for node_key, node_val in adj_list.items():
-        for neighbor in list(node_val['neighbors']):
-            if neighbor not in adj_list:
-                node_val['neighbors'].remove(neighbor)
+# Validates a lexicon the same way parse_tsv does and keeps the lines of the
+# file, the parse of every definition and the model errors of every chunk of
+# root words in a cache file. The next run only parses the definitions of
+# the changed lines and the ones that depend on added or removed words, and
+# only checks the root words they touch again, so its time grows with the
+# size of the change. The errors are reported in the same order as
+# parse_tsv. Without need_model only the errors are returned.
+def parse_tsv_with_cache(file_path, existing_lexicon, cache_file, jobs=1, spell_index_file=None, reporter=None, need_model=True):
+    if reporter is None:
+        reporter = DiagnosticReporter(keep=True)
+    start_error_count = reporter.error_count
+
+    with profiler.stage('read lexicon'):
+        with open(file_path, 'r') as file:
+            lines = file.readlines()
+        line_reporter = DiagnosticReporter(keep=True)
+        fields = list(numbered_lexicon_lines(enumerate(lines, 1), line_reporter))
+    profiler.count('words', len({field[1] for field in fields}))
+    existing_hash = ''
+    if existing_lexicon:
+        with open(existing_lexicon, 'rb') as file:
+            existing_hash = hashlib.sha1(file.read()).hexdigest()
+
+    conn = open_validation_cache(cache_file)
+    try:
+        # The state is committed before any error is reported, so stopping
+        # at --max-errors still leaves it up to date
+        with conn:
+            diagnostics = update_validation_cache(conn, lines, fields, line_reporter.diagnostics, existing_lexicon, existing_hash, jobs, spell_index_file)
+        for diagnostic in diagnostics:
+            reporter.report(diagnostic)
+        if reporter.error_count > start_error_count:
+            return None, None, None, [diagnostic.message for diagnostic in reporter.diagnostics or []]
+        if not need_model:
+            return None, None, None, []
+
+        with profiler.stage('build model'):
+            parses = {(word, position): parsed for word, position, parsed in conn.execute("SELECT word, position, parsed FROM entries")}
+            def parsed_definitions():
+                next_positions = {}
+                for _, word, all_defis, _ in fields:
+                    position = next_positions.get(word, 0)
+                    for _ in all_defis.split(' / '):
+                        yield [*decode_parsed_definition(parses[(word, position)]), word]
+                        position += 1
+                    next_positions[word] = position
+            parsed_tsv, adj_list, reserved_nodes, _ = build_model(parsed_definitions())
+        return parsed_tsv, adj_list, reserved_nodes, []
+    finally:
+        conn.close()
+
+# Brings the cache in line with the lines of the input file and returns the
+# errors of the whole file in the order parse_tsv reports them
+def update_validation_cache(conn, lines, fields, line_errors, existing_lexicon, existing_hash, jobs, spell_index_file):
+    state = {name: marshal.loads(value) for name, value in conn.execute("SELECT name, value FROM state")}
+    existing_words_info = None
+    existing_diagnostics = state.get('existing_diagnostics', [])
+    if state.get('existing_hash') != existing_hash:
+        # Every parse depends on the existing lexicon
+        for table in ('state', 'existing_words', 'entries', 'inflections', 'root_chunks', 'chunks'):
+            conn.execute(f"DELETE FROM {table}")
+        state = {}
+        existing_diagnostics = []
+        if existing_lexicon:
+            with profiler.stage('read existing'):
+                existing_reporter = DiagnosticReporter(keep=True)
+                existing_words_info = read_existing_lexicon(existing_lexicon, existing_reporter)
+                existing_diagnostics = [tuple(diagnostic) for diagnostic in existing_reporter.diagnostics]
+                conn.executemany("INSERT INTO existing_words (word, is_root, pos) VALUES (?, ?, ?)", sorted((word, info.is_root, info.pos) for word, info in existing_words_info.items()))
+
+    old_lines = state.get('lines', [])
+    old_valid_words = state.get('valid_words', set())
+    valid_words = {field[1] for field in fields}
+    line_error_words = {diagnostic.word for diagnostic in line_errors if diagnostic.word}
+
+    # Only the words of the lines that were added or removed can have new
+    # entries. The words of malformed lines are left out of the model checks.
+    with profiler.stage('cache diff'):
+        line_counts = Counter(lines)
+        old_line_counts = Counter(old_lines)
+        changed_lines = [line for line, count in line_counts.items() if old_line_counts[line] != count]
+        changed_lines.extend(line for line in old_line_counts if line not in line_counts)
+        changed_words = {field[1] for field in numbered_lexicon_lines(enumerate(changed_lines, 1))}
+        changed_words.update(line_error_words.symmetric_difference(state.get('line_error_words', set())))
+
+        # A parse that uses a removed word as an alt spelling or in its text
+        # has to be parsed again, and any change to the words can fix a
+        # failed parse or change the spelling suggestions of its error
+        removed_words = old_valid_words - valid_words
+        added_words = valid_words - old_valid_words
+        stale = set()
+        if removed_words:
+            for word, definition in conn.execute("SELECT word, definition FROM entries WHERE error IS NULL"):
+                if not removed_words.isdisjoint(definition.replace(',', ' ').upper().split()):
+                    stale.add((word, definition))
+        if removed_words or added_words or state.get('spell_index') != (spell_index_file or ''):
+            stale.update(conn.execute("SELECT word, definition FROM entries WHERE error IS NOT NULL"))
+        changed_words.update(word for word, _ in stale)
+    profiler.count('changed lines', len(changed_lines))
+    profiler.count('changed words', len(changed_words))
+
+    changed_words = sorted(changed_words)
+    results = {}
+    affected_roots = set(changed_words)
+    for word, definition, root, parsed, error in select_in(conn, "SELECT word, definition, root, parsed, error FROM entries WHERE word IN ({})", changed_words):
+        if (word, definition) not in stale:
+            results[(word, definition)] = (root, parsed, error)
+        if root is not None:
+            affected_roots.add(root)
+    # The roots that list a changed word check whether it is in the lexicon
+    affected_roots.update(root for root, in select_in(conn, "SELECT root FROM inflections WHERE inflection IN ({})", changed_words))
+
+    word_defis = {}
+    changed_word_set = set(changed_words)
+    for _, word, all_defis, _ in fields:
+        if word in changed_word_set:
+            if word not in word_defis:
+                word_defis[word] = []
+            word_defis[word].extend(all_defis.split(' / '))
+    unparsed = list(dict.fromkeys((word, defi) for word, defis in word_defis.items() for defi in defis if (word, defi) not in results))
+    if unparsed:
+        if existing_words_info is None and existing_lexicon:
+            rows = select_in(conn, "SELECT word, is_root, pos FROM existing_words WHERE word IN ({})", sorted({word for word, _ in unparsed}))
+            existing_words_info = {word: ExistingWordInfo(bool(is_root), pos) for word, is_root, pos in rows}
+        parse_jobs = jobs if len(unparsed) > PARSE_CHUNK_SIZE else 1
+        for key, (parsed, error) in parse_definitions(iter(unparsed), valid_words, existing_words_info, parse_jobs, spell_index_file):
+            if error:
+                results[key] = (None, None, marshal.dumps(error))
             else:
-                adj_list[neighbor]['neighbors'].add(node_key)
-
-    return parsed_tsv, adj_list, reserved_nodes, word_def_dict, []
-
-def dfs(adj_list, node_key, current_group):
-    node_val = adj_list[node_key]
-    if node_val['vis']:
-        return
-    node_val['vis'] = True
-    if isinstance(current_group, set):
-        current_group.add(node_key)
-    else:
-        current_group['defs'].append(node_val['def'])
-        current_group['words'].append(node_val['root'])
-        loo = node_val.get('loo')
-        if loo and loo not in SPECIAL_LOOS:
-            current_group['loos'].append(loo)
-    for neighbor in node_val['neighbors']:
-        dfs(adj_list, neighbor, current_group)
-
-def validate(input_lexicon, existing_lexicon):
-    parsed_tsv, adj_list, start_reserved_nodes, word_def_dict, errors = parse_tsv(input_lexicon, existing_lexicon)
+                results[key] = (parsed.root, encode_parsed_definition(parsed), None)
+
+    with profiler.stage('cache write'):
+        entry_rows = []
+        inflection_rows = []
+        for word, defis in word_defis.items():
+            for position, defi in enumerate(defis):
+                root, parsed, error = results[(word, defi)]
+                entry_rows.append((word, position, defi, root, parsed, error))
+                if root is not None:
+                    affected_roots.add(root)
+                    conjugations = decode_parsed_definition(parsed).conjs if root == word else None
+                    if conjugations:
+                        inflection_rows.extend((conj.replace('-', word), word) for tenses in conjugations for conj in tenses)
+        conn.executemany("DELETE FROM entries WHERE word = ?", ((word,) for word in changed_words))
+        conn.executemany("DELETE FROM inflections WHERE root = ?", ((word,) for word in changed_words))
+        conn.executemany("INSERT INTO entries (word, position, definition, root, parsed, error) VALUES (?, ?, ?, ?, ?, ?)", entry_rows)
+        conn.executemany("INSERT OR IGNORE INTO inflections (inflection, root) VALUES (?, ?)", inflection_rows)
+
+    # Every chunk with an affected root word is checked again
+    with profiler.stage('check roots'):
+        roots = set(affected_roots)
+        chunk_ids = sorted({chunk for chunk, in select_in(conn, "SELECT chunk FROM root_chunks WHERE root IN ({})", sorted(affected_roots))})
+        for chunk_roots, in select_in(conn, "SELECT roots FROM chunks WHERE chunk IN ({})", chunk_ids):
+            roots.update(marshal.loads(chunk_roots))
+        conn.executemany("DELETE FROM chunks WHERE chunk = ?", ((chunk,) for chunk in chunk_ids))
+        failed_words = line_error_words | {word for word, in conn.execute("SELECT DISTINCT word FROM entries WHERE error IS NOT NULL")}
+        roots = sorted(roots)
+        for i in range(0, len(roots), ROOT_CHUNK_SIZE):
+            chunk_roots = roots[i:i + ROOT_CHUNK_SIZE]
+            errors = check_cached_roots(conn, chunk_roots, failed_words)
+            chunk = conn.execute("INSERT INTO chunks (roots, errors) VALUES (?, ?)", (marshal.dumps(chunk_roots), marshal.dumps(errors))).lastrowid
+            conn.executemany("INSERT OR REPLACE INTO root_chunks (root, chunk) VALUES (?, ?)", ((root, chunk) for root in chunk_roots))
+    profiler.count('checked root words', len(roots))
+
+    # Only the values that changed are written again
+    new_state = {'existing_hash': existing_hash, 'existing_diagnostics': existing_diagnostics, 'lines': lines, 'valid_words': valid_words, 'line_error_words': line_error_words, 'spell_index': spell_index_file or ''}
+    conn.executemany("INSERT OR REPLACE INTO state (name, value) VALUES (?, ?)", ((name, marshal.dumps(value)) for name, value in new_state.items() if state.get(name) != value))
+
+    return cached_diagnostics(conn, fields, line_errors, [Diagnostic._make(diagnostic) for diagnostic in existing_diagnostics])
 
+# Checks a chunk of root words against the cached parses and returns its
+# errors with the word and entry position that parse_tsv sorts them by
+def check_cached_roots(conn, roots, failed_words):
+    rows = sorted(select_in(conn, "SELECT word, position, parsed FROM entries WHERE root IN ({}) AND error IS NULL", roots))
+    definitions = []
+    positions = {}
+    inflections = set()
+    for word, position, parsed in rows:
+        parsed = decode_parsed_definition(parsed)
+        definitions.append([*parsed, word])
+        if word not in positions:
+            positions[word] = []
+        positions[word].append(position)
+        if parsed.root == word and parsed.conjs:
+            inflections.update(conj.replace('-', word) for tenses in parsed.conjs for conj in tenses)
+    lexicon_words = {word for word, in select_in(conn, "SELECT DISTINCT word FROM entries WHERE word IN ({}) AND error IS NULL", sorted(inflections))}
+    error_keys = []
+    _, _, _, errors = build_model(definitions, failed_words, lexicon_words, error_keys)
+    return [(key_word, positions[key_word][position], error.word, error.code, error.message) for error, (key_word, position) in zip(errors, error_keys)]
+
+# Returns the errors of the existing lexicon, the malformed lines, the failed
+# parses in the order of the lines and then the model errors in the order
+# build_model finds them for the whole file
+def cached_diagnostics(conn, fields, line_errors, existing_diagnostics):
+    failed_entries = {}
+    for word, position, error in conn.execute("SELECT word, position, error FROM entries WHERE error IS NOT NULL"):
+        if word not in failed_entries:
+            failed_entries[word] = {}
+        failed_entries[word][position] = marshal.loads(error)
+    model_errors = [error for errors, in conn.execute("SELECT errors FROM chunks WHERE errors != ?", (marshal.dumps([]),)) for error in marshal.loads(errors)]
+
+    needed_words = set(failed_entries).union(*((error[0], error[2]) for error in model_errors))
+    word_lines = {}
+    parse_errors = []
+    for line_number, word, all_defis, defi_start in fields:
+        if word not in needed_words:
+            continue
+        if word not in word_lines:
+            word_lines[word] = []
+        position = sum(len(defis) for _, defis in word_lines[word])
+        defis = all_defis.split(' / ')
+        word_lines[word].append((line_number, defis))
+        for defi in defis:
+            error = failed_entries.get(word, {}).get(position)
+            if error:
+                code, message, span = error
+                if span is None:
+                    span = (0, len(defi))
+                parse_errors.append(Diagnostic(line_number, word, code, message, (defi_start + span[0], defi_start + span[1])))
+            position += 1
+            defi_start += len(defi) + 3
+
+    # Returns the line number and index on the line of an entry
+    def entry_order(word, position):
+        for line_number, defis in word_lines[word]:
+            if position < len(defis):
+                return (line_number, position)
+            position -= len(defis)
+
+    # Entry errors come in the order of the first entry of their word in the
+    # model and then of their entry, the missing conjugations after them in
+    # the order of the entry of their root word
+    def model_error_order(error):
+        key_word, position, _, code, _ = error
+        if code == 'conjugation-not-in-lexicon':
+            return (1, entry_order(key_word, position))
+        failed_positions = failed_entries.get(key_word, {})
+        first_position = 0
+        while first_position in failed_positions:
+            first_position += 1
+        return (0, entry_order(key_word, first_position), position)
+    model_errors.sort(key=model_error_order)
+
+    diagnostics = existing_diagnostics + line_errors + parse_errors
+    for _, _, word, code, message in model_errors:
+        line_number = word_lines[word][0][0] if word in word_lines else None
+        diagnostics.append(Diagnostic(line_number, word, code, message, (0, len(word))))
+    return diagnostics
+
+def disable_worker_profiler():
+    # The profiler only reports the stages of the main process
+    profiler.disable()
+
+# Validates one lexicon of a batch and returns its errors or, for every word,
+# the part of speech, root word and grouped definition of each entry. Only
+# this summary is sent back to the main process.
+def validate_lexicon_summary(lexicon_and_existing):
+    input_lexicon, existing_lexicon = lexicon_and_existing
+    try:
+        parsed_tsv, adj_list, reserved_nodes, errors = parse_tsv(input_lexicon, existing_lexicon)
+    except OSError as e:
+        return input_lexicon, [str(e)], None
     if errors:
-        print("\n".join(errors))
+        return input_lexicon, errors, None
+    apply_alt_spelling_groups(parsed_tsv, adj_list, reserved_nodes)
+    summary = {word: tuple((entry.pos, entry.root, entry.defi) for entry in entries) for word, entries in parsed_tsv.items()}
+    return input_lexicon, [], summary
+
+# Returns the report values of the entries of a word in one lexicon
+def describe_word_entries(word, entries):
+    pos = " ".join(sorted({entry_pos for entry_pos, _, _ in entries}))
+    roots = ", ".join(sorted({'root' if root == word else root for _, root, _ in entries}))
+    definitions = " / ".join(defi for _, _, defi in entries)
+    return {'pos': pos, 'root': roots, 'definition': definitions}
+
+# Writes a row for every word in more than one lexicon whose parts of speech,
+# root words or definitions differ between the lexicons and returns the
+# number of rows of each kind
+def write_cross_lexicon_report(lexicons, summaries, report_file):
+    counts = {'pos': 0, 'root': 0, 'definition': 0}
+    word_counts = {}
+    for summary in summaries:
+        for word in summary:
+            word_counts[word] = word_counts.get(word, 0) + 1
+    shared_words = sorted(word for word, count in word_counts.items() if count > 1)
+    with open(report_file, 'w', newline='', encoding='utf-8') as report_out:
+        writer = csv.writer(report_out, delimiter='\t')
+        writer.writerow(['word', 'difference', *lexicons])
+        for word in shared_words:
+            described = [describe_word_entries(word, summary[word]) if word in summary else None for summary in summaries]
+            for kind in counts:
+                values = {x[kind] for x in described if x is not None}
+                if len(values) > 1:
+                    counts[kind] += 1
+                    writer.writerow([word, kind, *(x[kind] if x is not None else '' for x in described)])
+    return len(shared_words), counts
+
+# Validates every lexicon in its own process and reports the differences
+# between the ones that are valid
+def validate_batch(lexicons, existing_lexicons, jobs, report_file):
+    if existing_lexicons is None:
+        existing_lexicons = [None] * len(lexicons)
+    summaries = {}
+    failed = False
+    from multiprocessing import Pool
+    with Pool(max(1, min(jobs, len(lexicons))), initializer=disable_worker_profiler) as pool:
+        for input_lexicon, errors, summary in pool.imap_unordered(validate_lexicon_summary, zip(lexicons, existing_lexicons)):
+            if errors:
+                failed = True
+                print(f"{input_lexicon} has {len(errors)} errors:")
+                print("\n".join(errors))
+                continue
+            # The lexicons share most of their words, which are only kept once
+            summaries[input_lexicon] = {sys.intern(word): entries for word, entries in summary.items()}
+            print(f"{input_lexicon} is valid with {len(summary)} words")
+
+    valid_lexicons = [lexicon for lexicon in lexicons if lexicon in summaries]
+    if len(valid_lexicons) > 1:
+        num_shared, counts = write_cross_lexicon_report(valid_lexicons, [summaries[lexicon] for lexicon in valid_lexicons], report_file)
+        print(f"Words in more than one lexicon: {num_shared}")
+        print(f"Words with different parts of speech: {counts['pos']}")
+        print(f"Words with different root words: {counts['root']}")
+        print(f"Words with different definitions: {counts['definition']}")
+        print(f"Wrote the cross lexicon report to {report_file}")
+    if failed:
         exit(1)
 
-    # Run the DFS on reserved nodes to mark them as visited
-    reserved_nodes = start_reserved_nodes.copy()
-    for node_key in start_reserved_nodes:
-        if node_key in adj_list:
-            dfs(adj_list, node_key, reserved_nodes)
-
-    reserved_words = set()
-    for node_key in reserved_nodes:
-        word, _ = decompose_key(node_key)
-        reserved_words.add(word)
-
-    completed_groups = {}
-    for node_key in adj_list:
-        current_group = {'defs': [], 'words': [], 'loos': []}
-        dfs(adj_list, node_key, current_group)
-        if len(current_group['words']) == 0:
-            continue
-        def_counts = {}
-        for root_def in current_group['defs']:
-            if root_def not in def_counts:
-                def_counts[root_def] = 0
-            def_counts[root_def] += len(root_def)
-        loo_counts = {}
-        for loo in current_group['loos']:
-            if loo not in loo_counts:
-                loo_counts[loo] = 0
-            loo_counts += 1
-        plurality_def = max(def_counts, key=def_counts.get)
-        plurality_loo = None
-        if len(loo_counts) > 0:
-            plurality_loo = max(loo_counts, key=loo_counts.get)
-        sorted_alt_spellings = sorted(current_group['words'])
-        _, pos = decompose_key(node_key)
-        for salt in sorted_alt_spellings:
-            completed_groups[create_key(salt, pos)] = {
-                'pdef': plurality_def,
-                'ploo': plurality_loo,
-                'alts': sorted_alt_spellings,
-            }
+# Writes an entry back in the format that parse_definition reads
+def format_definition(word, entry):
+    parts = []
 
-    for word in parsed_tsv:
-        for entry in parsed_tsv[word]:
-            root = entry['root']
-            adj_list_key = create_key(root, entry['pos'])
-            if adj_list_key not in completed_groups and adj_list_key not in reserved_nodes:
-                raise ValueError("Key not found in alt spelling groups: " + adj_list_key)
-            if adj_list_key in completed_groups and adj_list_key not in reserved_nodes:
-                completed_alts = completed_groups[adj_list_key]['alts']
-                plurality_def = completed_groups[adj_list_key]['pdef']
-                plurality_loo = completed_groups[adj_list_key]['ploo']
-                entry['alts'] = [x for x in completed_alts if x != root]
-                entry['def'] = plurality_def
-                if plurality_loo and entry['loo'] not in SPECIAL_LOOS:
-                    entry['loo'] = plurality_loo
-
-    return parsed_tsv, reserved_words, word_def_dict
-
-def create_sheet(parsed_tsv, reserved_words, word_def_dict):
-    output_file = "out.tsv"
-    new_defs_log = "New Definitions:\n"
-    total = 0
+    if entry.root and entry.root != word:
+        parts.append(entry.root + ", ")
+
+    if entry.loo:
+        parts.append(f"({entry.loo}) ")
+
+    parts.append(entry.defi)
+
+    if entry.alts:
+        parts.append(", also " + ", ".join(entry.alts))
+
+    parts.append(" [" + entry.pos)
+    if entry.conjs:
+        parts.append(" " + ", ".join(" or ".join(tense_conjs) for tense_conjs in entry.conjs))
+    parts.append("]")
+
+    return "".join(parts)
+
+# Renders the (word, old definition, reserved, entries) of a chunk
+def render_sheet_chunk(chunk):
+    return render_sheet_rows((word, old_def, reserved, " / ".join([format_definition(word, entry) for entry in entries]).strip()) for word, old_def, reserved, entries in chunk)
+
+# Returns the out.tsv rows of the (word, old definition, reserved, new
+# definition) of a chunk, the log of the new and tagged definitions, the
+# number of logged rows and the autosuggestion rows
+def render_sheet_rows(chunk):
+    rows = []
+    log = []
     autosuggestions = []
-    with open(output_file, 'w', newline='', encoding='utf-8') as tsv_out:
-        writer = csv.writer(tsv_out, delimiter='\t')
+    for word, old_def, reserved, new_def in chunk:
+        tags = "MultiPOSDef Root" if reserved else ""
+        new_def_empty_if_same = ""
+        if old_def != new_def:
+            new_def_empty_if_same = new_def
+            autosuggestions.append((word, old_def, new_def))
+            tags = tags + ", Autosuggestion" if tags else "Autosuggestion"
+        row = (word.strip(), old_def.strip(), new_def_empty_if_same, tags)
+        if tags:
+            log.append("\n".join(row) + "\n\n")
+        rows.append(row)
+    return rows, "".join(log), len(log), autosuggestions
+
+# Yields the words of parsed_tsv with their old definition in chunks. Only
+# the fields needed to render the entries are sent to the workers.
+def sheet_chunks(parsed_tsv, reserved_words, input_lexicon, for_workers):
+    # A word that is on more than one line has the definitions of its last line
+    seen_words = set()
+    repeated_word_defs = {}
+    for word, all_defis in read_lexicon_lines(input_lexicon):
+        if word in seen_words:
+            repeated_word_defs[word] = all_defis
+        seen_words.add(word)
+    del seen_words
 
+    # The words of parsed_tsv are in the order of their first line
+    lexicon_lines = read_lexicon_lines(input_lexicon)
+    chunk = []
+    for word, entries in parsed_tsv.items():
+        for line_word, all_defis in lexicon_lines:
+            if line_word == word:
+                break
+        if for_workers:
+            entries = [ParsedDefinition(entry.root, entry.loo, entry.defi, entry.alts, entry.pos, entry.conjs) for entry in entries]
+        chunk.append((word, repeated_word_defs.get(word, all_defis), word in reserved_words, entries))
+        if len(chunk) == SHEET_CHUNK_SIZE:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+# Writes out.tsv and autosuggestions.tsv and logs the new and tagged
+# definitions to log_file, or stdout, as the chunks are rendered. With
+# jobs > 1 the chunks are rendered by worker processes and written in order.
+def create_sheet(parsed_tsv, reserved_words, input_lexicon, jobs=1, log_file=None):
+    pool = None
+    if jobs > 1:
+        from multiprocessing import Pool
+        pool = Pool(jobs, initializer=disable_worker_profiler)
+    try:
+        chunks = sheet_chunks(parsed_tsv, reserved_words, input_lexicon, pool is not None)
+        if pool is not None:
+            rendered_chunks = pool.imap(render_sheet_chunk, chunks)
+        else:
+            rendered_chunks = map(render_sheet_chunk, chunks)
+        write_sheet(rendered_chunks, log_file)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+# Writes the rendered chunks to out.tsv and autosuggestions.tsv in order and
+# streams the log to log_file or stdout
+def write_sheet(rendered_chunks, log_file=None):
+    log = open(log_file, 'w', encoding='utf-8', buffering=SHEET_BUFFER_SIZE) if log_file else sys.stdout
+    num_rows = 0
+    total = 0
+    num_autosuggestions = 0
+    try:
+        log.write("New Definitions:\n")
+        with open("out.tsv", 'w', newline='', encoding='utf-8', buffering=SHEET_BUFFER_SIZE) as tsv_out, \
+             open("autosuggestions.tsv", 'w', newline='', encoding='utf-8', buffering=SHEET_BUFFER_SIZE) as autosugg_out:
+            writer = csv.writer(tsv_out, delimiter='\t')
+            autosugg_writer = csv.writer(autosugg_out, delimiter='\t')
+            for rows, chunk_log, num_logged, autosuggestions in rendered_chunks:
+                writer.writerows(rows)
+                num_rows += len(rows)
+                log.write(chunk_log)
+                autosugg_writer.writerows(autosuggestions)
+                total += num_logged
+                num_autosuggestions += len(autosuggestions)
+        log.write(f"\nTotal:  {total}\n")
+    finally:
+        if log_file:
+            log.close()
+    profiler.count('rows written', num_rows)
+    profiler.count('autosuggestions', num_autosuggestions)
+
+def create_store_tables(conn):
+    conn.execute("CREATE TABLE words (word TEXT PRIMARY KEY, position INTEGER NOT NULL, definition TEXT NOT NULL, old_definition TEXT NOT NULL, reserved INTEGER NOT NULL)")
+    conn.execute("CREATE TABLE alt_spelling_groups (id INTEGER PRIMARY KEY, pos TEXT NOT NULL, definition TEXT NOT NULL, members TEXT NOT NULL)")
+    conn.execute("CREATE TABLE entries (id INTEGER PRIMARY KEY, word TEXT NOT NULL, position INTEGER NOT NULL, root TEXT NOT NULL, loo TEXT, definition TEXT NOT NULL, pos TEXT NOT NULL, alts TEXT NOT NULL, group_id INTEGER, formatted TEXT NOT NULL)")
+    conn.execute("CREATE TABLE conjugations (entry_id INTEGER NOT NULL, tense INTEGER NOT NULL, position INTEGER NOT NULL, conjugation TEXT NOT NULL)")
+    conn.execute("CREATE TABLE autosuggestions (word TEXT PRIMARY KEY, old_definition TEXT NOT NULL, new_definition TEXT NOT NULL)")
+    conn.execute(f"PRAGMA user_version = {STORE_VERSION}")
+
+# The indexes are created after the rows are inserted, which is faster than
+# updating them row by row
+def create_store_indexes(conn):
+    conn.execute("CREATE INDEX words_position ON words (position)")
+    conn.execute("CREATE INDEX entries_word ON entries (word)")
+    conn.execute("CREATE INDEX entries_root ON entries (root)")
+    conn.execute("CREATE INDEX entries_pos ON entries (pos)")
+    conn.execute("CREATE INDEX entries_group ON entries (group_id)")
+    conn.execute("CREATE INDEX conjugations_entry ON conjugations (entry_id)")
+    conn.execute("CREATE INDEX conjugations_conjugation ON conjugations (conjugation)")
+
+# Writes the validated and grouped lexicon to an SQLite working store with a
+# row for every word, entry, alt spelling group, conjugation and
+# autosuggestion. The store is written to a temporary file first so that
+# readers never see a partial store.
+def write_store(parsed_tsv, reserved_words, input_lexicon, store_file):
+    temp_file = store_file + '.part'
+    if os.path.exists(temp_file):
+        os.remove(temp_file)
+    conn = sqlite3.connect(temp_file)
+    try:
+        conn.execute("PRAGMA journal_mode = OFF")
+        conn.execute("PRAGMA synchronous = OFF")
+        create_store_tables(conn)
+        group_ids = {}
+        entry_id = 0
+        position = 0
+        with conn:
+            for chunk in sheet_chunks(parsed_tsv, reserved_words, input_lexicon, False):
+                word_rows = []
+                entry_rows = []
+                conjugation_rows = []
+                autosuggestion_rows = []
+                group_rows = []
+                for word, old_def, reserved, entries in chunk:
+                    definitions = []
+                    for entry_position, entry in enumerate(entries):
+                        formatted = format_definition(word, entry)
+                        definitions.append(formatted)
+                        # The entries of reserved groups keep the set of alt
+                        # spellings they were parsed with and have no group
+                        group_id = None
+                        if not isinstance(entry.alts, set):
+                            members = " ".join(sorted([entry.root, *entry.alts]))
+                            group_id = group_ids.get((entry.pos, members))
+                            if group_id is None:
+                                group_id = len(group_ids)
+                                group_ids[(entry.pos, members)] = group_id
+                                group_rows.append((group_id, entry.pos, entry.defi, members))
+                        alts = " ".join(sorted(entry.alts)) if entry.alts else ""
+                        entry_rows.append((entry_id, word, entry_position, entry.root, entry.loo, entry.defi, entry.pos, alts, group_id, formatted))
+                        if entry.conjs:
+                            for tense, tense_conjs in enumerate(entry.conjs):
+                                for conj_position, conj in enumerate(tense_conjs):
+                                    conjugation_rows.append((entry_id, tense, conj_position, conj.replace('-', word)))
+                        entry_id += 1
+                    new_def = " / ".join(definitions).strip()
+                    word_rows.append((word, position, new_def, old_def, reserved))
+                    if new_def != old_def:
+                        autosuggestion_rows.append((word, old_def, new_def))
+                    position += 1
+                conn.executemany("INSERT INTO words (word, position, definition, old_definition, reserved) VALUES (?, ?, ?, ?, ?)", word_rows)
+                conn.executemany("INSERT INTO alt_spelling_groups (id, pos, definition, members) VALUES (?, ?, ?, ?)", group_rows)
+                conn.executemany("INSERT INTO entries (id, word, position, root, loo, definition, pos, alts, group_id, formatted) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", entry_rows)
+                conn.executemany("INSERT INTO conjugations (entry_id, tense, position, conjugation) VALUES (?, ?, ?, ?)", conjugation_rows)
+                conn.executemany("INSERT INTO autosuggestions (word, old_definition, new_definition) VALUES (?, ?, ?)", autosuggestion_rows)
+            create_store_indexes(conn)
+    finally:
+        conn.close()
+    os.replace(temp_file, store_file)
+    profiler.count('store entries', entry_id)
+    profiler.count('store alt spelling groups', len(group_ids))
+
+def open_store(store_file):
+    conn = sqlite3.connect(store_file)
+    if conn.execute("PRAGMA user_version").fetchone()[0] != STORE_VERSION:
+        conn.close()
+        raise ValueError(f"{store_file} is not a version {STORE_VERSION} working store")
+    return conn
+
+# Creates the sheet from the rows of a working store without parsing the
+# definitions again
+def create_sheet_from_store(store_file, log_file=None):
+    conn = open_store(store_file)
+    try:
+        cursor = conn.execute("SELECT word, old_definition, reserved, definition FROM words ORDER BY position")
+        write_sheet(map(render_sheet_rows, iter(lambda: cursor.fetchmany(SHEET_CHUNK_SIZE), [])), log_file)
+    finally:
+        conn.close()
+
+def open_search_index(index_file):
+    conn = sqlite3.connect(index_file)
+    if conn.execute("PRAGMA user_version").fetchone()[0] != SEARCH_INDEX_VERSION:
+        with conn:
+            conn.execute("DROP TABLE IF EXISTS words")
+            conn.execute("DROP TABLE IF EXISTS word_rows")
+            conn.execute("DROP TABLE IF EXISTS definitions")
+            conn.execute("CREATE TABLE words (word TEXT PRIMARY KEY, hash TEXT NOT NULL) WITHOUT ROWID")
+            conn.execute("CREATE TABLE word_rows (id INTEGER PRIMARY KEY, word TEXT NOT NULL)")
+            conn.execute("CREATE INDEX word_rows_word ON word_rows (word)")
+            conn.execute("CREATE VIRTUAL TABLE definitions USING fts5(word, root, pos, loo, definition, formatted UNINDEXED)")
+            conn.execute(f"PRAGMA user_version = {SEARCH_INDEX_VERSION}")
+    return conn
+
+def entries_hash(word, entries):
+    return hashlib.sha1("\n".join(format_definition(word, entry) for entry in entries).encode('utf-8')).hexdigest()
+
+# Brings the search index in line with the validated entries, only
+# rewriting the rows of the words whose definitions changed
+def update_search_index(index_file, parsed_tsv):
+    conn = open_search_index(index_file)
+    try:
+        indexed_hashes = dict(conn.execute("SELECT word, hash FROM words"))
+        changed_words = []
         for word, entries in parsed_tsv.items():
-            definitions = []
-            tags = ""
-            for entry in entries:
-                definition_str = ""
+            definitions_hash = entries_hash(word, entries)
+            if indexed_hashes.pop(word, None) != definitions_hash:
+                changed_words.append((word, definitions_hash))
+        # The words left over are no longer in the lexicon
+        stale_words = list(indexed_hashes) + [word for word, _ in changed_words]
+        with conn:
+            for word in stale_words:
+                conn.execute("DELETE FROM definitions WHERE rowid IN (SELECT id FROM word_rows WHERE word = ?)", (word,))
+                conn.execute("DELETE FROM word_rows WHERE word = ?", (word,))
+            conn.executemany("DELETE FROM words WHERE word = ?", ((word,) for word in indexed_hashes))
+            conn.executemany("INSERT OR REPLACE INTO words (word, hash) VALUES (?, ?)", changed_words)
+            for word, _ in changed_words:
+                for entry in parsed_tsv[word]:
+                    row_id = conn.execute("INSERT INTO word_rows (word) VALUES (?)", (word,)).lastrowid
+                    conn.execute("INSERT INTO definitions (rowid, word, root, pos, loo, definition, formatted) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                 (row_id, word, entry.root, entry.pos, entry.loo or '', entry.defi, format_definition(word, entry)))
+        return len(changed_words), len(indexed_hashes)
+    finally:
+        conn.close()
 
-                if entry['root'] and entry['root'] != word:
-                    definition_str += f"{entry['root']}, "
+# Prints the definitions matching an FTS5 query such as 'hairy', '"small
+# bird"', 'fish*', 'loo:scots' or 'pos:v AND root:ABC'
+def search_definitions(index_file, query, limit=None):
+    if not os.path.exists(index_file):
+        print(f"Search index {index_file} does not exist, create it with --index on a validation run")
+        exit(1)
+    conn = open_search_index(index_file)
+    try:
+        sql = "SELECT word, formatted FROM definitions WHERE definitions MATCH ? ORDER BY word"
+        params = [query]
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        rows = conn.execute(sql, params).fetchall()
+    except sqlite3.OperationalError as e:
+        print(f"Invalid search query '{query}': {e}")
+        exit(1)
+    finally:
+        conn.close()
+    for word, formatted in rows:
+        print(f"{word}\t{formatted}")
+    print("Total: ", len(rows))
 
-                if entry['loo']:
-                    definition_str += f"({entry['loo']}) "
+# Reads a definitions file the same way add_defs.py does so that the hashes
+# match the ones add_defs.py computes from the database
+def read_definitions_file(definitions_file):
+    if is_edition_file(definitions_file):
+        edition = EditionReader(definitions_file)
+        try:
+            return dict(edition.definitions())
+        finally:
+            edition.close()
+    with open(definitions_file, 'r', encoding='utf-8') as file:
+        reader = csv.reader(file, delimiter='\t')
+        return {row[0].upper(): row[1] for row in reader}
 
-                definition_str += entry['def']
+def is_edition_file(file_path):
+    with open(file_path, 'rb') as file:
+        return file.read(len(EDITION_MAGIC)) == EDITION_MAGIC
 
-                if entry['alts']:
-                    definition_str += f", also {', '.join(entry['alts'])}"
+def write_uint32_array(file, values):
+    values = array('I', values)
+    if sys.byteorder != 'little':
+        values.byteswap()
+    values.tofile(file)
 
-                pos_str = f"[{entry['pos']}"
-                if entry['conjs']:
-                    tense_strs = []
-                    for tense_conjs in entry['conjs']:
-                        tense_str = " or ".join(tense_conjs)
-                        tense_strs.append(tense_str)
-                    pos_str += f" {', '.join(tense_strs)}"
-                pos_str += "]"
-                definition_str += " " + pos_str
+# Writes the validated model in the columnar edition format. The words are
+# sorted and each has the definitions add_defs.py would load for it from the
+# input file along with the POS, root, LOO, definition text and alt spelling
+# group of each of its entries.
+def write_edition(parsed_tsv, input_lexicon, edition_file):
+    string_ids = {}
+    strings = []
+    def string_id(value):
+        if value is None:
+            return EDITION_NONE
+        if value not in string_ids:
+            string_ids[value] = len(strings)
+            strings.append(value.encode('utf-8'))
+        return string_ids[value]
 
-                definitions.append(definition_str)
+    definitions = read_definitions_file(input_lexicon)
+    words = sorted(definitions)
+    word_column = [string_id(word) for word in words]
+    definition_column = [string_id(definitions[word]) for word in words]
 
-            if word in reserved_words:
-                if tags != "":
-                    tags += ", "
-                tags += "MultiPOSDef Root"
+    entry_offsets = [0]
+    entry_columns = ([], [], [], [], [])
+    group_ids = {}
+    group_offsets = [0]
+    group_members = []
+    for word in words:
+        for entry in parsed_tsv.get(word, ()):
+            group_id = EDITION_NONE
+            if entry.alts:
+                group = tuple(sorted({entry.root, *entry.alts}))
+                if group not in group_ids:
+                    group_ids[group] = len(group_ids)
+                    group_members.extend(string_id(x) for x in group)
+                    group_offsets.append(len(group_members))
+                group_id = group_ids[group]
+            for column, value in zip(entry_columns, (string_id(entry.pos), string_id(entry.root), string_id(entry.loo), string_id(entry.defi), group_id)):
+                column.append(value)
+        entry_offsets.append(len(entry_columns[0]))
 
-            old_def = word_def_dict[word]
-            new_def = (" / ".join(definitions)).strip()
-            new_def_empty_if_same = new_def
-            if old_def == new_def:
-                new_def_empty_if_same = ""
+    string_offsets = [0]
+    for value in strings:
+        string_offsets.append(string_offsets[-1] + len(value))
+
+    with open(edition_file, 'wb') as file:
+        file.write(EDITION_HEADER.pack(EDITION_MAGIC, EDITION_VERSION, len(strings), string_offsets[-1], len(words), len(entry_columns[0]), len(group_ids), len(group_members)))
+        for column in (string_offsets, word_column, definition_column, entry_offsets, *entry_columns, group_offsets, group_members):
+            write_uint32_array(file, column)
+        file.write(b''.join(strings))
+
+# Reads an edition file through a memory map, so opening it only reads the
+# header and lookups only touch the pages they need
+class EditionReader:
+    def __init__(self, edition_file):
+        with open(edition_file, 'rb') as file:
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, num_strings, string_bytes, num_words, num_entries, num_groups, num_group_members = EDITION_HEADER.unpack_from(self.map, 0)
+        if magic != EDITION_MAGIC or version != EDITION_VERSION:
+            self.map.close()
+            raise ValueError(f"{edition_file} is not a version {EDITION_VERSION} edition file")
+        self.num_words = num_words
+        offset = EDITION_HEADER.size
+        columns = []
+        for length in (num_strings + 1, num_words, num_words, num_words + 1, num_entries, num_entries, num_entries, num_entries, num_entries, num_groups + 1, num_group_members):
+            columns.append(self.uint32_array(offset, length))
+            offset += length * 4
+        self.columns = columns
+        (self.string_offsets, self.word_column, self.definition_column, self.entry_offsets,
+         self.entry_pos, self.entry_root, self.entry_loo, self.entry_defi, self.entry_group,
+         self.group_offsets, self.group_members) = columns
+        self.string_data = offset
+
+    def uint32_array(self, offset, length):
+        view = memoryview(self.map)[offset:offset + length * 4]
+        if sys.byteorder == 'little':
+            return view.cast('I')
+        values = array('I')
+        values.frombytes(view)
+        values.byteswap()
+        return values
+
+    def string(self, string_id):
+        if string_id == EDITION_NONE:
+            return None
+        start = self.string_data + self.string_offsets[string_id]
+        end = self.string_data + self.string_offsets[string_id + 1]
+        return self.map[start:end].decode('utf-8')
+
+    def __len__(self):
+        return self.num_words
+
+    def word(self, index):
+        return self.string(self.word_column[index])
+
+    def definition(self, index):
+        return self.string(self.definition_column[index])
+
+    # Returns the index of a word with a binary search over the sorted words,
+    # or -1 if the word is not in the edition
+    def find_word(self, word):
+        low = 0
+        high = self.num_words
+        while low < high:
+            middle = (low + high) // 2
+            if self.word(middle) < word:
+                low = middle + 1
             else:
-                autosuggestions.append([word, old_def, new_def])
-                if tags != "":
-                    tags += ", "
-                tags += "Autosuggestion"
-            row_to_write = [word.strip(), old_def.strip(), new_def_empty_if_same, tags]
-            if new_def != old_def or tags != "":
-                new_defs_log += "\n".join(row_to_write) + "\n\n"
-                total += 1
-            writer.writerow(row_to_write)
-    print(new_defs_log)
-    print("Total: ", total)
-    with open("autosuggestions.tsv", "w", newline='', encoding='utf-8') as autosugg_out:
-        writer = csv.writer(autosugg_out, delimiter='\t')
-        writer.writerows(autosuggestions)
-
-def retrieve_latest_edition():
-    response = requests.get(TSV_URL)
-    response.raise_for_status()  # Ensure we downloaded successfully
-    
-    tsv_content = response.text
-    reader = csv.reader(StringIO(tsv_content), delimiter='\t')
-    
-    with open(RETRIEVED_FILENAME, "w") as outfile:
-        # Skip the header row
-        # Skip the first two rows
-        next(reader, None)  # Skip the first row
-        next(reader, None)  # Skip the second row
-
-        for row in reader:
-            if len(row) < 6:
-                raise ValueError("Row does not have enough columns: " + str(row))
-            
-            word = row[0].strip()
-            existing_def = row[1].strip()
-            autosuggested_def = row[2].strip()
-            new_def = row[4].strip()
-            completed = row[5].strip().lower() in ("true", "1", "yes", "x")
-            
-            if completed:
-                definition = new_def or autosuggested_def or existing_def
+                high = middle
+        if low < self.num_words and self.word(low) == word:
+            return low
+        return -1
+
+    # Returns the entries of a word. The alts of an entry are every member of
+    # its alt spelling group, including its own root word.
+    def entries(self, index):
+        entries = []
+        for i in range(self.entry_offsets[index], self.entry_offsets[index + 1]):
+            alts = []
+            group_id = self.entry_group[i]
+            if group_id != EDITION_NONE:
+                alts = [self.string(x) for x in self.group_members[self.group_offsets[group_id]:self.group_offsets[group_id + 1]]]
+            entries.append(EditionEntry(self.string(self.entry_pos[i]), self.string(self.entry_root[i]), self.string(self.entry_loo[i]), self.string(self.entry_defi[i]), alts))
+        return entries
+
+    # Yields the word and definitions of every word in sorted order
+    def definitions(self):
+        for index in range(self.num_words):
+            yield self.word(index), self.definition(index)
+
+    def close(self):
+        for column in self.columns:
+            if isinstance(column, memoryview):
+                column.release()
+        self.map.close()
+
+# Writes an edition file back to the tab separated definitions format
+def edition_to_tsv(edition_file, tsv_file):
+    edition = EditionReader(edition_file)
+    try:
+        with open(tsv_file, 'w', encoding='utf-8') as outfile:
+            for word, definition in edition.definitions():
+                outfile.write(f"{word}\t{definition}\n")
+        print(f"Wrote {len(edition)} words to {tsv_file}")
+    finally:
+        edition.close()
+
+def definitions_hash(definitions):
+    sha = hashlib.sha256()
+    for word in sorted(definitions):
+        sha.update(f"{word}\t{definitions[word]}\n".encode('utf-8'))
+    return sha.hexdigest()
+
+# Writes the added, changed and removed definitions from the base definitions
+# file to the new one along with the hashes of both editions
+def create_diff(base_file, new_file):
+    base_defs = read_definitions_file(base_file)
+    new_defs = read_definitions_file(new_file)
+    counts = {'+': 0, '~': 0, '-': 0}
+    with open(DIFF_FILENAME, 'w', newline='', encoding='utf-8') as diff_out:
+        writer = csv.writer(diff_out, delimiter='\t')
+        writer.writerow(DIFF_FORMAT + [definitions_hash(base_defs), definitions_hash(new_defs)])
+        for word in sorted(base_defs.keys() | new_defs.keys()):
+            if word not in base_defs:
+                row = ['+', word, new_defs[word]]
+            elif word not in new_defs:
+                row = ['-', word]
+            elif base_defs[word] != new_defs[word]:
+                row = ['~', word, new_defs[word]]
             else:
-                definition = existing_def
-            
-            # Write manually to the file with tabs between values
-            outfile.write(f"{word}\t{definition}\n")
+                continue
+            counts[row[0]] += 1
+            writer.writerow(row)
+    print(f"Diff written to {DIFF_FILENAME}: {counts['+']} added, {counts['~']} changed, {counts['-']} removed")
+
+def load_retrieved_metadata():
+    try:
+        with open(RETRIEVED_METADATA_FILENAME, 'r') as file:
+            return json.load(file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+def save_retrieved_metadata(metadata):
+    with open(RETRIEVED_METADATA_FILENAME, 'w') as file:
+        json.dump(metadata, file, indent=2)
+
+# Yields the lines of a streamed response with their line endings
+def iter_response_lines(response):
+    if response.encoding is None:
+        response.encoding = 'utf-8'
+    pending = ''
+    for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE, decode_unicode=True):
+        pending += chunk
+        lines = pending.split('\n')
+        pending = lines.pop()
+        for line in lines:
+            yield line + '\n'
+    if pending:
+        yield pending
+
+# Downloads the latest edition unless the server or the content hash shows
+# that it has not changed and returns whether RETRIEVED_FILENAME changed
+def retrieve_latest_edition(url=TSV_URL):
+    # requests takes longer to import than the rest of csd.py, so it is only
+    # imported when downloading
+    import requests
+
+    metadata = load_retrieved_metadata()
+    headers = {}
+    if os.path.exists(RETRIEVED_FILENAME):
+        if metadata.get('etag'):
+            headers['If-None-Match'] = metadata['etag']
+        if metadata.get('last_modified'):
+            headers['If-Modified-Since'] = metadata['last_modified']
+
+    with requests.get(url, headers=headers, stream=True) as response:
+        if response.status_code == 304:
+            return False
+        response.raise_for_status()  # Ensure we downloaded successfully
+
+        # Parse the response as it arrives instead of holding all of it
+        reader = csv.reader(iter_response_lines(response), delimiter='\t')
+        sha = hashlib.sha256()
+        temp_filename = RETRIEVED_FILENAME + '.part'
+        try:
+            with open(temp_filename, "w") as outfile:
+                # Skip the header row
+                # Skip the first two rows
+                next(reader, None)  # Skip the first row
+                next(reader, None)  # Skip the second row
+
+                for row in reader:
+                    if len(row) < 6:
+                        raise ValueError("Row does not have enough columns: " + str(row))
+
+                    word = row[0].strip()
+                    existing_def = row[1].strip()
+                    autosuggested_def = row[2].strip()
+                    new_def = row[4].strip()
+                    completed = row[5].strip().lower() in ("true", "1", "yes", "x")
+
+                    if completed:
+                        definition = new_def or autosuggested_def or existing_def
+                    else:
+                        definition = existing_def
+
+                    # Write manually to the file with tabs between values
+                    line = f"{word}\t{definition}\n"
+                    outfile.write(line)
+                    sha.update(line.encode('utf-8'))
+        except BaseException:
+            os.remove(temp_filename)
+            raise
+
+        content_hash = sha.hexdigest()
+        changed = content_hash != metadata.get('sha256') or not os.path.exists(RETRIEVED_FILENAME)
+        if changed:
+            os.replace(temp_filename, RETRIEVED_FILENAME)
+        else:
+            os.remove(temp_filename)
+        metadata['etag'] = response.headers.get('ETag')
+        metadata['last_modified'] = response.headers.get('Last-Modified')
+        metadata['sha256'] = content_hash
+        save_retrieved_metadata(metadata)
+        return changed
+
+def latest_edition_validated():
+    metadata = load_retrieved_metadata()
+    return 'sha256' in metadata and metadata.get('validated_sha256') == metadata['sha256']
+
+def mark_latest_edition_validated():
+    metadata = load_retrieved_metadata()
+    metadata['validated_sha256'] = metadata.get('sha256')
+    save_retrieved_metadata(metadata)
 
 
 if __name__ == "__main__":
@@ -449,14 +2150,105 @@ if __name__ == "__main__":
     parser.add_argument("--file", nargs="?", default=None, help="Specify the TSV file to process.")
     parser.add_argument("--exist", nargs="?", default=None, help="Specify the existing word definitions file.")
     parser.add_argument("--create", action="store_true", help="Creates a new TSV file from the input definitions for crowdsourcing on Google Sheets.")
+    parser.add_argument("--plurality", choices=list(PLURALITY_STRATEGIES), default="length", help="How the definition of an alt spelling group is chosen: the definition with the most total length, the most common definition, or the definitions of the words in the existing lexicon first.")
+    parser.add_argument("--watch", action="store_true", help="Validate the file again whenever it changes, only parsing the changed definitions, and report the new and cleared errors.")
+    parser.add_argument("--watch-interval", type=float, default=WATCH_INTERVAL_SECONDS, help="Seconds between checks for changes in watch mode.")
+    parser.add_argument("--store", default=None, help="Write the validated entries, alt spelling groups, conjugations and autosuggestions to an SQLite working store.")
+    parser.add_argument("--create-from-store", default=None, help="Create the TSV for crowdsourcing from a working store written by --store without validating again.")
+    parser.add_argument("--create-log", default=None, help="Write the log of new and tagged definitions from --create to a file instead of stdout.")
+    parser.add_argument("--jobs", type=int, default=1, help="Number of worker processes used to parse definitions.")
+    parser.add_argument("--cache", default=None, help="Specify a validation cache file so that a run only parses the changed definitions and checks the root words they affect again.")
+    parser.add_argument("--spell-index", default=None, help="Specify a spell check index file so that misspelled words in definitions come with suggestions.")
+    parser.add_argument("--index", default=None, help="Specify a search index file that is updated with the validated definitions.")
+    parser.add_argument("--search", default=None, help="Prints the definitions in the --index file that match an FTS5 query instead of validating.")
+    parser.add_argument("--limit", type=int, default=None, help="Maximum number of search results.")
+    parser.add_argument("--edition", default=None, help="Writes the validated definitions to a columnar edition file that add_defs.py can read.")
+    parser.add_argument("--edition-to-tsv", nargs=2, default=None, metavar=("EDITION", "TSV"), help="Converts an edition file back to a TSV definitions file instead of validating.")
+    parser.add_argument("--batch", nargs="+", default=None, metavar="FILE", help="Validates several TSV files at the same time, using up to --jobs processes, and writes a report of the words that differ between them.")
+    parser.add_argument("--batch-exist", nargs="+", default=None, metavar="EXIST", help="Specify the existing word definitions file of each --batch file, in the same order.")
+    parser.add_argument("--report", default=CROSS_LEXICON_REPORT_FILENAME, help="Specify the file the cross lexicon report of --batch is written to.")
+    parser.add_argument("--error-format", choices=["text", "jsonl"], default="text", help="Print each error as text or as a JSON object with its line, word, code, message and span.")
+    parser.add_argument("--error-file", default=None, help="Write the errors to a file instead of stdout.")
+    parser.add_argument("--max-errors", type=int, default=None, help="Stop validating after this many errors.")
+    parser.add_argument("--url", default=TSV_URL, help="Specify the URL of the TSV export of the crowdsourced Google Sheet.")
+    parser.add_argument("--profile", action="store_true", help="Prints the time, peak traced memory and counters of each stage to stderr. Tracing memory slows the run down.")
+    parser.add_argument("--profile-stage", default=None, help="Specify a stage such as 'parse' to run under cProfile when profiling. With --jobs the parse stage only includes the wait for the workers.")
+    parser.add_argument("--profile-output", default="csd.prof", help="Specify the file the cProfile stats of --profile-stage are written to.")
+    parser.add_argument("--diff", default=None, help="Writes the changes from the specified base definitions file to the input definitions file to a diff file for add_defs.py.")
     args = parser.parse_args()
     
     filename = args.file if args.file else RETRIEVED_FILENAME
-    
+
+    if args.batch:
+        if args.batch_exist and len(args.batch_exist) != len(args.batch):
+            print("--batch-exist must list one existing definitions file for every --batch file")
+            exit(1)
+        validate_batch(args.batch, args.batch_exist, args.jobs, args.report)
+        exit(0)
+
+    if args.edition_to_tsv:
+        edition_to_tsv(*args.edition_to_tsv)
+        exit(0)
+
+    if args.watch:
+        error_output = open(args.error_file, 'w', encoding='utf-8') if args.error_file else sys.stdout
+        watch(filename, args.exist, DiagnosticReporter(error_output, args.error_format), args.jobs, args.spell_index, args.watch_interval)
+        exit(0)
+
+    if args.create_from_store:
+        try:
+            with profiler.stage('create sheet'):
+                create_sheet_from_store(args.create_from_store, args.create_log)
+        except (ValueError, sqlite3.Error) as e:
+            print(e)
+            exit(1)
+        exit(0)
+
+    if args.search is not None:
+        if not args.index:
+            print("--search needs the search index file given with --index")
+            exit(1)
+        search_definitions(args.index, args.search, args.limit)
+        exit(0)
+
+    if args.profile:
+        profiler.enable(args.profile_stage)
+        # Report even when validation exits with errors
+        atexit.register(profiler.report, args.profile_output)
+
     if args.file is None:
-        retrieve_latest_edition()
-    
-    parsed_tsv, reserved_words, word_def_dict = validate(filename, args.exist)
+        with profiler.stage('retrieve'):
+            changed = retrieve_latest_edition(args.url)
+        # Skip validation when there is nothing new to validate or write
+        if not changed and latest_edition_validated() and not (args.exist or args.create or args.diff or args.index or args.edition or args.store):
+            print("The latest edition has not changed since it was last validated.")
+            exit(0)
+
+    error_output = open(args.error_file, 'w', encoding='utf-8') if args.error_file else sys.stdout
+    reporter = DiagnosticReporter(error_output, args.error_format, args.max_errors)
+    # The model is only built when something is written from it
+    need_model = bool(args.index or args.edition or args.store or args.create)
+    parsed_tsv, reserved_words = validate(filename, args.exist, args.jobs, args.cache, args.spell_index, reporter, args.plurality, need_model)
+
+    if args.file is None:
+        mark_latest_edition_validated()
+
+    if args.index:
+        with profiler.stage('search index'):
+            update_search_index(args.index, parsed_tsv)
+
+    if args.edition:
+        with profiler.stage('write edition'):
+            write_edition(parsed_tsv, filename, args.edition)
+
+    if args.store:
+        with profiler.stage('write store'):
+            write_store(parsed_tsv, reserved_words, filename, args.store)
 
     if args.create:
-        create_sheet(parsed_tsv, reserved_words, word_def_dict)
\ No newline at end of file
+        with profiler.stage('create sheet'):
+            create_sheet(parsed_tsv, reserved_words, filename, args.jobs, args.create_log)
+
+    if args.diff:
+        with profiler.stage('create diff'):
+            create_diff(args.diff, filename)
@@ -0,0 +1,481 @@
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+from collections import namedtuple
+from urllib.parse import unquote, urlsplit
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import csd
+
+RELOAD_INTERVAL_SECONDS = 2
+
+# The validated lexicon and the indexes built from it. A reload builds a new
+# model and replaces the old one, so requests never see a partial model.
+LexiconModel = namedtuple('LexiconModel', ['parsed_tsv', 'root_words', 'loo_words', 'file_stamp', 'loaded_at'])
+
+# Returns the modification times of the files a model is built from
+def file_stamp(args):
+    stamp = [os.stat(args.file).st_mtime_ns]
+    if args.exist:
+        stamp.append(os.stat(args.exist).st_mtime_ns)
+    return tuple(stamp)
+
+def entry_to_json(entry):
+    alts = entry.alts
+    if isinstance(alts, set):
+        alts = sorted(alts)
+    return {
+        'root': entry.root,
+        'loo': entry.loo,
+        'definition': entry.defi,
+        'alts': alts or [],
+        'pos': entry.pos,
+        'conjugations': entry.conjs,
+    }
+
+# Keeps the served model up to date with a LexiconWatcher. After the first
+# load only the words whose definitions changed are parsed and built again
+# and only the alt spelling groups that gain, lose or change a member are
+# scored again.
+class LexiconLoader:
+    def __init__(self, args):
+        self.args = args
+        self.watcher = csd.LexiconWatcher(args.file, args.exist, args.jobs)
+        self.model = None
+        self.reset()
+
+    def reset(self):
+        self.watcher.reset()
+        self.rebuild = True
+        self.pending_words = set()
+        self.reset_nodes()
+
+    # Reads the files again and returns the errors. The model is only
+    # replaced when the files have no errors, the words that changed while
+    # they had errors are rebuilt with the next good update.
+    def update(self, existing_changed=False):
+        stamp = file_stamp(self.args)
+        if existing_changed:
+            # The watcher parses everything again and cannot tell which
+            # words were removed
+            self.rebuild = True
+        self.watcher.update(existing_changed)
+        self.pending_words.update(self.watcher.changed_words)
+        if self.watcher.diagnostics:
+            return [format_diagnostic(diagnostic) for diagnostic in self.watcher.diagnostics.values()]
+        self.apply(stamp)
+        return []
+
+    def reset_nodes(self):
+        # word -> the parsed definitions of its entries in the served model
+        self.word_entries = {}
+        # (root, pos) -> the words with an entry for that node
+        self.node_words = {}
+        # (root, pos) -> the alt spellings its entries list
+        self.node_alts = {}
+        # (root, pos) -> the nodes that list it as an alt spelling
+        self.alt_listers = {}
+        # (root, pos) -> the nodes of its group in the order of the file
+        self.node_groups = {}
+        # (root, pos) -> the AltSpellingGroup of the node, or None when the
+        # group is reserved
+        self.completed_groups = {}
+
+    def apply(self, stamp):
+        if self.rebuild:
+            self.reset_nodes()
+            words = set(self.watcher.word_entries)
+            parsed_tsv = {}
+            root_words = {}
+            loo_words = {}
+        else:
+            words = self.pending_words
+            parsed_tsv = dict(self.model.parsed_tsv)
+            root_words = dict(self.model.root_words)
+            loo_words = dict(self.model.loo_words)
+
+        changed_nodes = set()
+        for word in words:
+            for parsed in self.word_entries.pop(word, ()):
+                key = (parsed[0], parsed[4])
+                self.node_words[key].discard(word)
+                changed_nodes.add(key)
+            entries = self.watcher.word_entries.get(word)
+            if entries:
+                self.word_entries[word] = list(entries)
+                for parsed in entries:
+                    key = (parsed[0], parsed[4])
+                    if key not in self.node_words:
+                        self.node_words[key] = set()
+                    self.node_words[key].add(word)
+                    changed_nodes.add(key)
+        for key in changed_nodes:
+            self.update_node(key)
+
+        groups = self.regroup(changed_nodes)
+        for nodes in groups:
+            for key in nodes:
+                words.update(self.node_words[key])
+
+        root_words = IndexUpdate(root_words)
+        loo_words = IndexUpdate(loo_words)
+        for word in words:
+            for entry in parsed_tsv.pop(word, ()):
+                if entry.root != word:
+                    root_words.discard(entry.root, word)
+                if entry.loo:
+                    loo_words.discard(entry.loo.lower(), word)
+            if word not in self.word_entries:
+                continue
+            entries = []
+            for root, loo, defi, alts, pos, conjs in self.word_entries[word]:
+                # The parse is shared with the watcher, which shortens the
+                # conjugations of its own copy in place
+                entry = csd.make_entry(root, loo, defi, alts, pos, conjs and [list(tenses) for tenses in conjs], word)
+                completed_group = self.completed_groups[(entry.root, entry.pos)]
+                if completed_group is not None:
+                    entry.alts = [x for x in completed_group.alts if x != entry.root]
+                    entry.defi = completed_group.pdef
+                entries.append(entry)
+                if entry.root != word:
+                    root_words.add(entry.root, word)
+                if entry.loo:
+                    loo_words.add(entry.loo.lower(), word)
+            parsed_tsv[word] = entries
+
+        self.model = LexiconModel(parsed_tsv, root_words.index, loo_words.index, stamp, time.time())
+        self.rebuild = False
+        self.pending_words = set()
+
+    # Updates the alt spellings a node lists after its entries changed
+    def update_node(self, key):
+        root, pos = key
+        alts = set()
+        for word in self.node_words[key]:
+            for parsed in self.word_entries[word]:
+                if parsed[0] == root and parsed[4] == pos and parsed[3]:
+                    alts.update(parsed[3])
+        if not self.node_words[key]:
+            del self.node_words[key]
+        old_alts = self.node_alts.pop(key, set())
+        if alts:
+            self.node_alts[key] = alts
+        for alt in old_alts - alts:
+            listers = self.alt_listers[(alt, pos)]
+            listers.discard(key)
+            if not listers:
+                del self.alt_listers[(alt, pos)]
+        for alt in alts - old_alts:
+            if (alt, pos) not in self.alt_listers:
+                self.alt_listers[(alt, pos)] = set()
+            self.alt_listers[(alt, pos)].add(key)
+
+    def neighbors(self, key):
+        pos = key[1]
+        for alt in self.node_alts.get(key, ()):
+            if (alt, pos) in self.node_words:
+                yield (alt, pos)
+        for lister in self.alt_listers.get(key, ()):
+            if lister in self.node_words:
+                yield lister
+
+    # Finds the groups of the changed nodes and of the nodes that were in a
+    # group with them, scores them again and returns their nodes
+    def regroup(self, changed_nodes):
+        start_nodes = set()
+        for key in changed_nodes:
+            start_nodes.update(self.node_groups.get(key, ()))
+            start_nodes.add(key)
+        for key in start_nodes:
+            self.node_groups.pop(key, None)
+            self.completed_groups.pop(key, None)
+
+        groups = []
+        seen = set()
+        for key in start_nodes:
+            if key in seen or key not in self.node_words:
+                continue
+            seen.add(key)
+            nodes = [key]
+            for node in nodes:
+                for neighbor in self.neighbors(node):
+                    if neighbor not in seen:
+                        seen.add(neighbor)
+                        nodes.append(neighbor)
+            groups.append(nodes)
+
+        # The nodes of a group are in the order of their first entry in the
+        # file and a node takes the definition of its first entry, as in
+        # csd.build_model
+        group_words = {word for nodes in groups for key in nodes for word in self.node_words[key]}
+        first_entries = {}
+        for line_index, (word, all_defis, _, _) in enumerate(self.watcher.lexicon_lines):
+            if word not in group_words:
+                continue
+            defis = all_defis.split(' / ')
+            entry_index = len(first_entries.get(word, ()))
+            for defi_index, parsed in enumerate(self.word_entries[word][entry_index:entry_index + len(defis)]):
+                if word not in first_entries:
+                    first_entries[word] = []
+                first_entries[word].append(((line_index, defi_index), parsed))
+        node_orders = {}
+        for word, entries in first_entries.items():
+            repeated_pos = set()
+            if len(entries) > 1:
+                seen_pos = set()
+                for _, parsed in entries:
+                    if parsed[4] in seen_pos:
+                        repeated_pos.add(parsed[4])
+                    seen_pos.add(parsed[4])
+            for order, parsed in entries:
+                key = (parsed[0], parsed[4])
+                reserved = parsed[4] in repeated_pos
+                if key not in node_orders:
+                    node_orders[key] = [order, parsed[2], reserved]
+                    continue
+                node_order = node_orders[key]
+                if order < node_order[0]:
+                    node_order[0] = order
+                    node_order[1] = parsed[2]
+                node_order[2] = node_order[2] or reserved
+
+        score = csd.PLURALITY_STRATEGIES['length']
+        for nodes in groups:
+            nodes.sort(key=lambda key: node_orders[key][0])
+            completed_group = None
+            if not any(node_orders[key][2] for key in nodes):
+                group_nodes = [csd.AltSpellingNode(key[0], key[1], node_orders[key][1], None) for key in nodes]
+                completed_group = csd.complete_group(group_nodes, score, ())
+            for key in nodes:
+                self.node_groups[key] = nodes
+                self.completed_groups[key] = completed_group
+        return groups
+
+# Copies the sets of an index the first time they change, so that the index
+# of the model being served is left as it was
+class IndexUpdate:
+    def __init__(self, index):
+        self.index = index
+        self.copied = set()
+
+    def values(self, key):
+        if key not in self.copied:
+            self.copied.add(key)
+            self.index[key] = set(self.index.get(key, ()))
+        return self.index[key]
+
+    def add(self, key, value):
+        self.values(key).add(value)
+
+    def discard(self, key, value):
+        values = self.values(key)
+        values.discard(value)
+        if not values:
+            del self.index[key]
+            self.copied.discard(key)
+
+# Looks words up in an edition file with a binary search, so serving an
+# edition does not parse anything. Edition files have no conjugations.
+class EditionWords:
+    def __init__(self, edition):
+        self.edition = edition
+
+    def __len__(self):
+        return len(self.edition)
+
+    def __contains__(self, word):
+        return self.edition.find_word(word) != -1
+
+    def __iter__(self):
+        for index in range(len(self.edition)):
+            yield self.edition.word(index)
+
+    def get(self, word, default=None):
+        index = self.edition.find_word(word)
+        if index == -1:
+            return default
+        entries = []
+        for pos, root, loo, defi, alts in self.edition.entries(index):
+            entries.append(csd.Entry(root, loo, defi, [x for x in alts if x != root], pos, None, None, None))
+        return entries
+
+# Serves an edition file written by csd.py --edition. Only the root word and
+# LOO indexes are built when it is loaded.
+class EditionLoader:
+    def __init__(self, args):
+        self.args = args
+        self.model = None
+
+    def reset(self):
+        pass
+
+    def update(self, existing_changed=False):
+        stamp = file_stamp(self.args)
+        try:
+            edition = csd.EditionReader(self.args.file)
+        except ValueError as e:
+            return [str(e)]
+        root_words = {}
+        loo_words = {}
+        for index in range(len(edition)):
+            word = edition.word(index)
+            for i in range(edition.entry_offsets[index], edition.entry_offsets[index + 1]):
+                root = edition.string(edition.entry_root[i])
+                if root != word:
+                    if root not in root_words:
+                        root_words[root] = set()
+                    root_words[root].add(word)
+                loo = edition.string(edition.entry_loo[i])
+                if loo:
+                    loo = loo.lower()
+                    if loo not in loo_words:
+                        loo_words[loo] = set()
+                    loo_words[loo].add(word)
+        # The replaced edition is unmapped once the requests using it are done
+        self.model = LexiconModel(EditionWords(edition), root_words, loo_words, stamp, time.time())
+        return []
+
+def format_diagnostic(diagnostic):
+    if diagnostic.line is None:
+        return diagnostic.message
+    return f"line {diagnostic.line}: {diagnostic.message}"
+
+def word_response(model, word):
+    entries = model.parsed_tsv.get(word)
+    if entries is None:
+        return None
+    return {'word': word, 'entries': [entry_to_json(entry) for entry in entries]}
+
+def alts_response(model, word):
+    entries = model.parsed_tsv.get(word)
+    if entries is None:
+        return None
+    alts = {}
+    for entry in entries:
+        if entry.alts:
+            if entry.pos not in alts:
+                alts[entry.pos] = set()
+            alts[entry.pos].update(entry.alts)
+    return {'word': word, 'alts': {pos: sorted(pos_alts) for pos, pos_alts in alts.items()}}
+
+def root_response(model, root):
+    if root not in model.parsed_tsv and root not in model.root_words:
+        return None
+    conjugations = []
+    for entry in model.parsed_tsv.get(root, []):
+        if entry.conjs_exp:
+            conjugations.extend(x for x in entry.conjs_exp if x not in conjugations)
+    return {'root': root, 'words': sorted(model.root_words.get(root, [])), 'conjugations': conjugations}
+
+def loo_response(model, loo):
+    words = model.loo_words.get(loo.lower())
+    if words is None:
+        return None
+    return {'loo': loo, 'words': sorted(words)}
+
+WORD_LOOKUPS = {
+    'word': word_response,
+    'alts': alts_response,
+    'root': root_response,
+}
+
+class QueryHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        parts = [unquote(part) for part in urlsplit(self.path).path.strip('/').split('/')]
+        model = self.server.model
+        if parts == ['status']:
+            self.send_json(200, {
+                'file': self.server.args.file,
+                'words': len(model.parsed_tsv),
+                'loaded_at': model.loaded_at,
+                'reload_errors': self.server.reload_errors,
+            })
+            return
+        if len(parts) != 2 or (parts[0] not in WORD_LOOKUPS and parts[0] != 'loo'):
+            self.send_json(404, {'error': 'unknown path, use /word/<word>, /alts/<word>, /root/<word>, /loo/<loo> or /status'})
+            return
+        if parts[0] == 'loo':
+            response = loo_response(model, parts[1])
+        else:
+            response = WORD_LOOKUPS[parts[0]](model, parts[1].upper())
+        if response is None:
+            self.send_json(404, {'error': 'not found: ' + parts[1]})
+            return
+        self.send_json(200, response)
+
+    def send_json(self, status, body):
+        encoded = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(encoded)))
+        self.end_headers()
+        self.wfile.write(encoded)
+
+    def log_message(self, format, *args):
+        if self.server.args.verbose:
+            super().log_message(format, *args)
+
+# Reloads the model whenever the input files change. A file with errors
+# leaves the last good model in place and the errors are shown in /status.
+def watch_files(server):
+    loader = server.loader
+    while True:
+        time.sleep(server.args.interval)
+        try:
+            stamp = file_stamp(server.args)
+            if stamp == server.loaded_stamp:
+                continue
+            existing_changed = stamp[1:] != server.loaded_stamp[1:]
+            server.loaded_stamp = stamp
+            errors = loader.update(existing_changed)
+        except Exception as e:
+            # The watcher may have been left half updated, so the next
+            # reload starts from scratch
+            loader.reset()
+            errors = [f"{type(e).__name__}: {e}"]
+        if errors:
+            server.reload_errors = errors
+            print(f"Reload failed with {len(errors)} errors, still serving the model loaded at {time.ctime(server.model.loaded_at)}", file=sys.stderr)
+            continue
+        server.model = loader.model
+        server.reload_errors = []
+        print(f"Reloaded {len(loader.model.parsed_tsv)} words from {server.args.file}", file=sys.stderr)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve lookups of a validated definitions file over HTTP.")
+    parser.add_argument("file", help="Specify the TSV file to serve.")
+    parser.add_argument("--exist", default=None, help="Specify the existing word definitions file.")
+    parser.add_argument("--jobs", type=int, default=1, help="Number of worker processes used to parse definitions.")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on.")
+    parser.add_argument("--port", type=int, default=8000, help="Port to listen on.")
+    parser.add_argument("--interval", type=float, default=RELOAD_INTERVAL_SECONDS, help="Seconds between checks for changes to the input files.")
+    parser.add_argument("--verbose", action="store_true", help="Log every request.")
+    args = parser.parse_args()
+
+    if csd.is_edition_file(args.file):
+        loader = EditionLoader(args)
+    else:
+        loader = LexiconLoader(args)
+    errors = loader.update()
+    if errors:
+        print("\n".join(errors))
+        exit(1)
+    model = loader.model
+
+    server = ThreadingHTTPServer((args.host, args.port), QueryHandler)
+    server.daemon_threads = True
+    server.args = args
+    server.loader = loader
+    server.model = model
+    server.loaded_stamp = model.file_stamp
+    server.reload_errors = []
+    threading.Thread(target=watch_files, args=(server,), daemon=True).start()
+    print(f"Serving {len(model.parsed_tsv)} words from {args.file} on http://{args.host}:{args.port}", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,44 @@
+import sqlite3
+
+import add_defs
+import bench
+import csd
+
+def create_database(db_file, words):
+    conn = sqlite3.connect(db_file)
+    with conn:
+        conn.execute("CREATE TABLE words (word varchar(16), definition varchar(256))")
+        conn.execute("CREATE UNIQUE INDEX word_index on words (word)")
+        conn.executemany("INSERT INTO words (word, definition) VALUES (?, '')", ((word,) for word in words))
+    conn.close()
+
+def database_definitions(db_file):
+    conn = sqlite3.connect(db_file)
+    try:
+        return conn.execute("SELECT word, definition FROM words ORDER BY word").fetchall()
+    finally:
+        conn.close()
+
+# A working store must update a database with the reviewed definitions of
+# its input file, not with the autosuggestions made while validating it
+def test_store_and_tsv_update_the_same_database(tmp_path):
+    tsv_file = str(tmp_path / 'lexicon.tsv')
+    store_file = str(tmp_path / 'store.db')
+    with open(tsv_file, 'w') as file:
+        file.writelines(bench.generate_lexicon(600, 3))
+    parsed_tsv, reserved_words = csd.validate(tsv_file, None, reporter=csd.DiagnosticReporter())
+    csd.write_store(parsed_tsv, reserved_words, tsv_file, store_file)
+    conn = sqlite3.connect(store_file)
+    autosuggestions = conn.execute("SELECT COUNT(*) FROM autosuggestions").fetchone()[0]
+    conn.close()
+    assert autosuggestions > 0
+
+    words = [word for word, _ in add_defs.read_definition_rows(tsv_file)]
+    tsv_db = str(tmp_path / 'tsv.db')
+    store_db = str(tmp_path / 'from_store.db')
+    create_database(tsv_db, words)
+    create_database(store_db, words)
+    add_defs.update_definitions(tsv_file, tsv_db)
+    add_defs.update_definitions(store_file, store_db)
+    assert database_definitions(tsv_db) == database_definitions(store_db)
+    assert database_definitions(tsv_db) == sorted(add_defs.read_definition_rows(tsv_file))
@@ -0,0 +1,481 @@
+import os
+import argparse
+import random
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+import bench
+import csd
+import serve
+
+def write_lines(path, lines):
+    with open(path, 'w') as file:
+        file.writelines(lines)
+
+def full_run_diagnostics(path):
+    reporter = csd.DiagnosticReporter(keep=True)
+    csd.parse_tsv(str(path), None, reporter=reporter)
+    return {(d.line, d.word, d.code, d.message) for d in reporter.diagnostics}
+
+def watch_diagnostics(watcher):
+    return {(d.line, d.word, d.code, d.message) for d in watcher.diagnostics.values()}
+
+# Removing words that other definitions use must bring back the misspelling
+# errors of those definitions, including the ones that had already failed
+def test_watch_matches_full_run_after_removing_words(tmp_path):
+    path = tmp_path / 'lexicon.tsv'
+    lines = list(bench.generate_lexicon(600, 1))
+    rng = random.Random(1)
+    # Start with some failed definitions so that removals also hit them
+    for i in rng.sample(range(len(lines)), 20):
+        lines[i] = lines[i].replace(' [', ' zzqy [', 1)
+    write_lines(path, lines)
+    watcher = csd.LexiconWatcher(str(path), None)
+    watcher.update()
+    assert watch_diagnostics(watcher) == full_run_diagnostics(path)
+
+    for _ in range(10):
+        del lines[rng.randrange(len(lines))]
+        write_lines(path, lines)
+        watcher.update()
+        assert watch_diagnostics(watcher) == full_run_diagnostics(path)
+
+def sheet_body(rows):
+    lines = ["Word\tExisting\tAutosuggested\tNotes\tNew\tCompleted", "header\t\t\t\t\t"]
+    lines.extend("\t".join(row) for row in rows)
+    return ("\n".join(lines) + "\n").encode('utf-8')
+
+# Serves a sheet export with an ETag and Last-Modified date and answers 304
+# when the request carries the current ETag
+class SheetHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        sheet = self.server.sheet
+        self.server.requests.append(dict(self.headers))
+        if self.headers.get('If-None-Match') == sheet['etag']:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('ETag', sheet['etag'])
+        self.send_header('Last-Modified', sheet['last_modified'])
+        self.send_header('Content-Type', 'text/tab-separated-values; charset=utf-8')
+        self.send_header('Content-Length', str(len(sheet['body'])))
+        self.end_headers()
+        self.wfile.write(sheet['body'])
+
+    def log_message(self, format, *args):
+        pass
+
+@pytest.fixture
+def sheet_server():
+    server = HTTPServer(('127.0.0.1', 0), SheetHandler)
+    server.requests = []
+    server.sheet = {
+        'etag': '"1"',
+        'last_modified': 'Mon, 05 Oct 2026 10:00:00 GMT',
+        'body': sheet_body([("AA", "old aa [n AAS]", "", "", "", ""), ("AAS", "AA, old aa [n]", "", "", "AA, new aa [n]", "TRUE")]),
+    }
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+
+def test_retrieve_latest_edition_downloads_conditionally(tmp_path, monkeypatch, sheet_server):
+    monkeypatch.chdir(tmp_path)
+    url = f"http://127.0.0.1:{sheet_server.server_address[1]}/export"
+
+    # The first download has nothing to compare with
+    assert csd.retrieve_latest_edition(url)
+    assert 'If-None-Match' not in sheet_server.requests[-1]
+    with open(csd.RETRIEVED_FILENAME) as file:
+        assert file.read() == "AA\told aa [n AAS]\nAAS\tAA, new aa [n]\n"
+    metadata = csd.load_retrieved_metadata()
+    assert metadata['etag'] == '"1"'
+    assert metadata['last_modified'] == 'Mon, 05 Oct 2026 10:00:00 GMT'
+
+    # The server reports that nothing changed
+    stamp = os.stat(csd.RETRIEVED_FILENAME).st_mtime_ns
+    assert not csd.retrieve_latest_edition(url)
+    assert sheet_server.requests[-1]['If-None-Match'] == '"1"'
+    assert sheet_server.requests[-1]['If-Modified-Since'] == 'Mon, 05 Oct 2026 10:00:00 GMT'
+    assert os.stat(csd.RETRIEVED_FILENAME).st_mtime_ns == stamp
+
+    # A new export of the same content is downloaded but leaves the file as it was
+    sheet_server.sheet['etag'] = '"2"'
+    assert not csd.retrieve_latest_edition(url)
+    assert os.stat(csd.RETRIEVED_FILENAME).st_mtime_ns == stamp
+    assert csd.load_retrieved_metadata()['etag'] == '"2"'
+
+    # A new edition replaces the file
+    sheet_server.sheet['etag'] = '"3"'
+    sheet_server.sheet['body'] = sheet_body([("AA", "old aa [n AAS]", "", "", "newer aa [n AAS]", "x")])
+    assert csd.retrieve_latest_edition(url)
+    with open(csd.RETRIEVED_FILENAME) as file:
+        assert file.read() == "AA\tnewer aa [n AAS]\n"
+    assert sorted(os.listdir(tmp_path)) == [csd.RETRIEVED_METADATA_FILENAME, csd.RETRIEVED_FILENAME]
+
+def entry_fields(entry):
+    return (entry.root, entry.loo, entry.defi, entry.alts, entry.pos, entry.conjs, entry.conjs_exp, entry.node)
+
+def node_fields(node):
+    return (node.root, node.pos, node.defi, node.neighbors, node.parent)
+
+# --jobs must give the same model, errors and sheet as the serial path, in
+# the same order
+def test_parallel_parse_matches_serial(tmp_path, monkeypatch):
+    # Small chunks so that the work is spread over several tasks
+    monkeypatch.setattr(csd, 'PARSE_CHUNK_SIZE', 50)
+    monkeypatch.setattr(csd, 'SHEET_CHUNK_SIZE', 100)
+    path = tmp_path / 'lexicon.tsv'
+    lines = list(bench.generate_lexicon(1000, 4))
+    write_lines(path, lines)
+
+    results = []
+    for jobs in (1, 2):
+        parsed_tsv, adj_list, reserved_nodes, errors = csd.parse_tsv(str(path), None, jobs)
+        assert errors == []
+        model = (
+            {word: [entry_fields(entry) for entry in entries] for word, entries in parsed_tsv.items()},
+            [node_fields(node) for node in adj_list],
+            reserved_nodes,
+        )
+        assert list(model[0]) == list(parsed_tsv)
+        reserved_words = csd.apply_alt_spelling_groups(parsed_tsv, adj_list, reserved_nodes)
+        sheet_dir = tmp_path / f'jobs{jobs}'
+        sheet_dir.mkdir()
+        monkeypatch.chdir(sheet_dir)
+        csd.create_sheet(parsed_tsv, reserved_words, str(path), jobs, str(sheet_dir / 'log.txt'))
+        with open(sheet_dir / 'out.tsv', 'rb') as file:
+            sheet = file.read()
+        results.append((model, list(parsed_tsv), reserved_words, sheet))
+    assert results[0] == results[1]
+
+    # The errors come out the same and in the same order
+    rng = random.Random(4)
+    for i in rng.sample(range(len(lines)), 30):
+        lines[i] = lines[i].replace(' [', ' zzqy [', 1) if i % 2 else lines[i].replace('\t', ' ', 1)
+    write_lines(path, lines)
+    diagnostics = []
+    for jobs in (1, 2):
+        reporter = csd.DiagnosticReporter(keep=True)
+        csd.parse_tsv(str(path), None, jobs, reporter=reporter)
+        diagnostics.append(reporter.diagnostics)
+    assert len(diagnostics[0]) > 30
+    assert diagnostics[0] == diagnostics[1]
+
+def served_model(model):
+    words = {word: serve.word_response(model, word) for word in model.parsed_tsv}
+    return words, model.root_words, model.loo_words
+
+def full_served_model(path):
+    parsed_tsv, adj_list, reserved_nodes, errors = csd.parse_tsv(str(path), None)
+    assert errors == []
+    csd.apply_alt_spelling_groups(parsed_tsv, adj_list, reserved_nodes)
+    root_words = {}
+    loo_words = {}
+    for word, entries in parsed_tsv.items():
+        for entry in entries:
+            if entry.root != word:
+                root_words.setdefault(entry.root, set()).add(word)
+            if entry.loo:
+                loo_words.setdefault(entry.loo.lower(), set()).add(word)
+    return served_model(serve.LexiconModel(parsed_tsv, root_words, loo_words, None, None))
+
+def split_alts(line):
+    if ', also ' in line:
+        head, rest = line.split(', also ', 1)
+        alts, tail = rest.split(' [', 1)
+        return head, alts.split(', '), ' [' + tail
+    head, tail = line.split(' [', 1)
+    return head, [], ' [' + tail
+
+def join_alts(head, alts, tail):
+    if alts:
+        return head + ', also ' + ', '.join(alts) + tail
+    return head + tail
+
+# Makes an edit that keeps the lexicon valid: moves a line, links or unlinks
+# two nouns as alt spellings, rewords a noun and its plural, gives a noun a
+# second noun definition or removes a noun and adds it back
+def edit_lexicon(lines, removed, rng):
+    kind = rng.randrange(7)
+    if kind == 0:
+        lines.insert(rng.randrange(len(lines)), lines.pop(rng.randrange(len(lines))))
+        return
+    if kind == 1 and removed:
+        for line in removed.pop(rng.randrange(len(removed))):
+            lines.insert(rng.randrange(len(lines)), line)
+        return
+    index = {line.split('\t')[0]: i for i, line in enumerate(lines)}
+    all_nouns = sorted(word for word, i in index.items() if f' [n {word}S]' in lines[i] and word + 'S' in index)
+    nouns = [word for word in all_nouns if ' / ' not in lines[index[word]]]
+    listers = {}
+    for word in nouns:
+        for alt in split_alts(lines[index[word]])[1]:
+            listers.setdefault(alt, []).append(word)
+
+    def set_alt(word, alt, linked):
+        head, alts, tail = split_alts(lines[index[word]])
+        if linked and alt not in alts:
+            alts.append(alt)
+        elif not linked and alt in alts:
+            alts.remove(alt)
+        lines[index[word]] = join_alts(head, alts, tail)
+
+    # A shuffle keeps the length of the definition, so that its group can
+    # end up with a tie that the order of the file decides
+    def reword(word, texts=None):
+        head, alts, tail = split_alts(lines[index[word]])
+        head = head[len(word) + 1:]
+        loo = head[:head.index(') ') + 2] if head.startswith('(') else ''
+        if texts is None:
+            texts = head[len(loo):].split()
+            if rng.random() < 0.5:
+                texts.append(texts[0])
+        rng.shuffle(texts)
+        new_head = loo + ' '.join(texts)
+        lines[index[word]] = join_alts(f"{word}\t{new_head}", alts, tail)
+        lines[index[word + 'S']] = lines[index[word + 'S']].replace(f"{word}, {head} [", f"{word}, {new_head} [", 1)
+
+    if kind == 2:
+        word, alt = rng.sample(nouns, 2)
+        if rng.random() < 0.5:
+            texts = split_alts(lines[index[word]])[0].split('\t')[1].split()
+            reword(alt, [text for text in texts if not text.startswith('(') and not text.endswith(')')])
+        set_alt(word, alt, True)
+    elif kind == 3 and listers:
+        alt = rng.choice(sorted(listers))
+        set_alt(rng.choice(listers[alt]), alt, False)
+    elif kind == 4:
+        # Words that other definitions use cannot be removed
+        text = ''.join(lines)
+        words = [word for word in nouns if word.lower() not in text]
+        linked = [word for word in words if split_alts(lines[index[word]])[1]]
+        word = rng.choice(linked if linked and rng.random() < 0.5 else words)
+        for lister in listers.get(word, ()):
+            set_alt(lister, word, False)
+        removed.append([lines[index[word]], lines[index[word + 'S']]])
+        for i in sorted((index[word], index[word + 'S']), reverse=True):
+            del lines[i]
+    elif kind == 5:
+        word = rng.choice(nouns)
+        other = rng.choice(nouns)
+        defi = split_alts(lines[index[other]])[0].split('\t')[1]
+        lines[index[word]] = lines[index[word]][:-1] + f" / {defi} [n {word}S]\n"
+        lines[index[word + 'S']] = lines[index[word + 'S']][:-1] + f" / {word}, {defi} [n]\n"
+    else:
+        reword(rng.choice(nouns))
+
+def ordered_diagnostics(path, existing_lexicon, cache_file=None):
+    reporter = csd.DiagnosticReporter(keep=True)
+    if cache_file:
+        model = csd.parse_tsv_with_cache(str(path), existing_lexicon, str(cache_file), reporter=reporter)
+    else:
+        model = csd.parse_tsv(str(path), existing_lexicon, reporter=reporter)
+    return [tuple(d) for d in reporter.diagnostics], model
+
+def model_fields(model):
+    parsed_tsv, adj_list, reserved_nodes, _ = model
+    if parsed_tsv is None:
+        return None
+    entries = [(word, [entry_fields(entry) for entry in word_entries]) for word, word_entries in parsed_tsv.items()]
+    return entries, [node_fields(node) for node in adj_list], reserved_nodes
+
+# A run with a validation cache must report the same errors in the same
+# order as a full run and build the same model, whatever changed in between
+@pytest.mark.parametrize('with_existing', [False, True])
+def test_validation_cache_matches_full_run(tmp_path, with_existing):
+    path = tmp_path / 'lexicon.tsv'
+    cache_file = tmp_path / 'cache.db'
+    lines = list(bench.generate_lexicon(800, 6))
+    rng = random.Random(6)
+    existing_lexicon = None
+    if with_existing:
+        existing_lexicon = str(tmp_path / 'existing.tsv')
+        write_lines(existing_lexicon, rng.sample(lines, 100))
+    removed = []
+    valid_lines = None
+    for step in range(40):
+        # The first edits keep the lexicon valid so that the models are compared
+        kind = rng.randrange(11) if step >= 15 else 0
+        if step == 15:
+            valid_lines = list(lines)
+        i = rng.randrange(len(lines))
+        if kind == 5:
+            lines[i] = lines[i].replace(' [', ' zzqy [', 1)
+        elif kind == 6:
+            lines[i] = lines[i].replace(' zzqy [', ' [', 1)
+        elif kind == 7:
+            del lines[i]
+        elif kind == 8:
+            lines.insert(i, rng.choice(["BADLINE\n", "lower\tx [n]\n", lines[i].split('\t')[0] + "\t\n"]))
+        elif kind == 9:
+            lines[i] = lines[i].replace(' [', ' ' + lines[rng.randrange(len(lines))].split('\t')[0].lower() + ' [', 1)
+        elif kind == 10:
+            # Points an inflection at the root word of another line
+            inflections = [j for j, line in enumerate(lines) if ', ' in line and line.split('\t')[1].split(', ')[0].isupper()]
+            j = rng.choice(inflections)
+            word, defi = lines[j].split('\t')
+            lines[j] = word + '\t' + lines[i].split('\t')[0] + defi[defi.index(','):]
+        else:
+            edit_lexicon(lines, removed, rng)
+        write_lines(path, lines)
+        full_diagnostics, full_model = ordered_diagnostics(path, existing_lexicon)
+        cached_diagnostics, cached_model = ordered_diagnostics(path, existing_lexicon, cache_file)
+        assert cached_diagnostics == full_diagnostics
+        assert model_fields(cached_model) == model_fields(full_model)
+
+    # Going back to a valid lexicon clears the errors
+    write_lines(path, valid_lines)
+    full_diagnostics, full_model = ordered_diagnostics(path, existing_lexicon)
+    cached_diagnostics, cached_model = ordered_diagnostics(path, existing_lexicon, cache_file)
+    assert cached_diagnostics == full_diagnostics
+    assert model_fields(cached_model) == model_fields(full_model)
+
+# A malformed line leaves its word out of the model checks, which must clear
+# the model errors of its other lines without them changing
+def test_validation_cache_skips_words_of_malformed_lines(tmp_path):
+    path = tmp_path / 'lexicon.tsv'
+    cache_file = tmp_path / 'cache.db'
+    lines = list(bench.generate_lexicon(400, 3))
+    nouns = [i for i, line in enumerate(lines) if ' [n ' in line and ' / ' not in line and '(' not in line and ', also ' not in line]
+    word = lines[nouns[0]].split('\t')[0]
+    other_defi = lines[nouns[1]].split('\t')[1].split(' [')[0]
+    plural = next(i for i, line in enumerate(lines) if line.startswith(word + 'S\t'))
+    lines[plural] = f"{word}S\t{word}, {other_defi} [n]\n"
+    write_lines(path, lines)
+    full_diagnostics = ordered_diagnostics(path, None)[0]
+    assert [d[2] for d in full_diagnostics] == ['root-definition-not-found']
+    assert ordered_diagnostics(path, None, cache_file)[0] == full_diagnostics
+
+    write_lines(path, lines + [f"{word}S\t\n"])
+    full_diagnostics = ordered_diagnostics(path, None)[0]
+    assert [d[2] for d in full_diagnostics] == ['empty-definition']
+    assert ordered_diagnostics(path, None, cache_file)[0] == full_diagnostics
+
+# After the first run only the definitions of the changed lines are parsed
+# and only the root words near them are checked again
+def test_validation_cache_work_grows_with_change(tmp_path, monkeypatch):
+    path = tmp_path / 'lexicon.tsv'
+    cache_file = str(tmp_path / 'cache.db')
+    lines = list(bench.generate_lexicon(3000, 7))
+    write_lines(path, lines)
+    parsed = []
+    checked_roots = []
+    parse_word_definition = csd.parse_word_definition
+    check_cached_roots = csd.check_cached_roots
+    def counted_parse(word, defi, *args):
+        parsed.append((word, defi))
+        return parse_word_definition(word, defi, *args)
+    def counted_check(conn, roots, failed_words):
+        checked_roots.extend(roots)
+        return check_cached_roots(conn, roots, failed_words)
+    monkeypatch.setattr(csd, 'parse_word_definition', counted_parse)
+    monkeypatch.setattr(csd, 'check_cached_roots', counted_check)
+
+    assert csd.parse_tsv_with_cache(str(path), None, cache_file, need_model=False)[3] == []
+    assert len(parsed) == sum(len(line.split('\t')[1].split(' / ')) for line in lines)
+    del parsed[:], checked_roots[:]
+    assert csd.parse_tsv_with_cache(str(path), None, cache_file, need_model=False)[3] == []
+    assert parsed == [] and checked_roots == []
+
+    for count in (1, 10):
+        changed_lines = list(lines)
+        changed_count = bench.reword_definitions(changed_lines, count, random.Random(count))
+        write_lines(path, changed_lines)
+        del parsed[:], checked_roots[:]
+        assert csd.parse_tsv_with_cache(str(path), None, cache_file, need_model=False)[3] == []
+        assert 0 < len(parsed) <= changed_count * 3
+        assert len(checked_roots) <= changed_count * 2 * csd.ROOT_CHUNK_SIZE
+        write_lines(path, lines)
+        assert csd.parse_tsv_with_cache(str(path), None, cache_file, need_model=False)[3] == []
+
+# A reload only regroups the changed groups and must serve the same model as
+# a full load, and a reload with errors must keep the last good model
+def test_serve_reload_matches_full_load(tmp_path):
+    path = tmp_path / 'lexicon.tsv'
+    lines = list(bench.generate_lexicon(1500, 5))
+    write_lines(path, lines)
+    args = argparse.Namespace(file=str(path), exist=None, jobs=1)
+    loader = serve.LexiconLoader(args)
+    assert loader.update() == []
+    assert served_model(loader.model) == full_served_model(path)
+
+    rng = random.Random(5)
+    removed = []
+    for _ in range(60):
+        edit_lexicon(lines, removed, rng)
+        write_lines(path, lines)
+        assert loader.update() == []
+        assert served_model(loader.model) == full_served_model(path)
+
+    write_lines(path, lines + ["BADLINE\n"])
+    served = loader.model
+    assert loader.update() != []
+    assert loader.model is served
+
+    # The words changed while the file had errors are rebuilt once it is fixed
+    for _ in range(5):
+        edit_lexicon(lines, removed, rng)
+    write_lines(path, lines + ["BADLINE\n"])
+    assert loader.update() != []
+    write_lines(path, lines)
+    assert loader.update() == []
+    assert served_model(loader.model) == full_served_model(path)
+
+# Patching the byte order makes the writer and the reader both swap, which
+# runs the reader's copying path on a little endian machine
+@pytest.mark.parametrize('byteorder', ['little', 'big'])
+def test_edition_lookups(tmp_path, monkeypatch, byteorder):
+    monkeypatch.setattr(sys, 'byteorder', byteorder)
+    path = tmp_path / 'lexicon.tsv'
+    edition_file = tmp_path / 'lexicon.csde'
+    write_lines(path, bench.generate_lexicon(800, 6))
+    parsed_tsv, adj_list, reserved_nodes, errors = csd.parse_tsv(str(path), None)
+    assert errors == []
+    csd.apply_alt_spelling_groups(parsed_tsv, adj_list, reserved_nodes)
+    csd.write_edition(parsed_tsv, str(path), str(edition_file))
+
+    edition = csd.EditionReader(str(edition_file))
+    try:
+        assert len(edition) == len(parsed_tsv)
+        for word, entries in parsed_tsv.items():
+            index = edition.find_word(word)
+            assert edition.word(index) == word
+            expected = []
+            for entry in entries:
+                alts = sorted({entry.root, *entry.alts}) if entry.alts else []
+                expected.append(csd.EditionEntry(entry.pos, entry.root, entry.loo, entry.defi, alts))
+            assert edition.entries(index) == expected
+        for word in ('', 'A', 'ZZZZZZZZZZ', min(parsed_tsv) + 'A'):
+            if word not in parsed_tsv:
+                assert edition.find_word(word) == -1
+    finally:
+        edition.close()
+
+# Serving an edition file gives the same lookups as serving the lexicon it
+# was written from, except for the conjugations it does not store
+def test_serve_edition_matches_lexicon(tmp_path):
+    path = tmp_path / 'lexicon.tsv'
+    edition_file = tmp_path / 'lexicon.csde'
+    write_lines(path, bench.generate_lexicon(800, 7))
+    parsed_tsv, adj_list, reserved_nodes, errors = csd.parse_tsv(str(path), None)
+    csd.apply_alt_spelling_groups(parsed_tsv, adj_list, reserved_nodes)
+    csd.write_edition(parsed_tsv, str(path), str(edition_file))
+
+    loader = serve.EditionLoader(argparse.Namespace(file=str(edition_file), exist=None))
+    assert loader.update() == []
+    words, root_words, loo_words = served_model(loader.model)
+    expected_words, expected_root_words, expected_loo_words = full_served_model(path)
+    for response in expected_words.values():
+        for entry in response['entries']:
+            entry['conjugations'] = None
+    assert words == expected_words
+    assert (root_words, loo_words) == (expected_root_words, expected_loo_words)
+    assert serve.word_response(loader.model, 'NOTAWORD') is None